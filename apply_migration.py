@@ -18,4 +18,6 @@ def run_sql_file(filename):
                 print(f"Error executing {filename}: {e}")
 
 if __name__ == "__main__":
-    run_sql_file("backend/create_order_item_details.sql")
+    import sys
+    # python apply_migration.py backend/update_processing_tasks_queue.sql
+    run_sql_file(sys.argv[1] if len(sys.argv) > 1 else "backend/create_order_item_details.sql")
@@ -0,0 +1,205 @@
+import mimetypes
+import os
+import stat
+import zlib
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Brotli is optional: without it we negotiate gzip only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compression Configuration
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1000"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_LEVEL = int(os.getenv("COMPRESSION_BROTLI_LEVEL", "4"))
+
+# Media types that are already compressed: re-compressing them burns CPU for ~0% gain
+INCOMPRESSIBLE_TYPES = {
+    "image/png",
+    "image/jpeg",
+    "image/webp",
+    "image/gif",
+    "image/avif",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-brotli",
+    "application/x-7z-compressed",
+    "application/pdf",
+}
+INCOMPRESSIBLE_PREFIXES = ("video/", "audio/")
+
+
+def is_compressible(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    if not media_type:
+        return False
+    if media_type in INCOMPRESSIBLE_TYPES:
+        return False
+    return not media_type.startswith(INCOMPRESSIBLE_PREFIXES)
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """Parses an Accept-Encoding header, dropping encodings explicitly refused with q=0."""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    return accepted
+
+
+def select_encoding(accept_encoding: str):
+    """Picks 'br' (if the brotli module is installed) or 'gzip' from an Accept-Encoding header."""
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    """Incremental compressor with a common interface for gzip and brotli."""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_level: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._impl = brotli.Compressor(quality=brotli_level)
+        else:
+            # wbits=31 -> gzip container
+            self._impl = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._impl.process(data) + self._impl.flush()
+        return self._impl.compress(data) + self._impl.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._impl.finish()
+        return self._impl.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """
+    Replacement for GZipMiddleware that only compresses what is worth compressing:
+    - Already-compressed media (PNG/JPEG/WebP/zip...) and pre-encoded responses pass through.
+    - JSON/text use brotli when available, gzip otherwise, with configurable levels.
+    - Streaming bodies are compressed chunk by chunk instead of being buffered.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+                 gzip_level: int = COMPRESSION_GZIP_LEVEL, brotli_level: int = COMPRESSION_BROTLI_LEVEL):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_level = brotli_level
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = select_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, config: CompressionMiddleware, encoding: str, send: Send):
+        self.config = config
+        self.encoding = encoding
+        self.downstream_send = send
+        self.start_message: Message = None
+        self.passthrough = False
+        self.started = False
+        self.compressor: _Compressor = None
+
+    async def send(self, message: Message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            if "content-encoding" in headers or not is_compressible(headers.get("content-type", "")):
+                self.passthrough = True
+                self.started = True
+                await self.downstream_send(message)
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self.downstream_send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            if not more_body and len(body) < self.config.minimum_size:
+                # Small single-chunk body: not worth the CPU
+                await self.downstream_send(self.start_message)
+                await self.downstream_send(message)
+                self.passthrough = True
+                return
+
+            self.compressor = _Compressor(self.encoding, self.config.gzip_level, self.config.brotli_level)
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+
+            if not more_body:
+                compressed = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(compressed))
+                await self.downstream_send(self.start_message)
+                await self.downstream_send({"type": "http.response.body", "body": compressed})
+                return
+
+            # Streaming: length is unknown up front
+            del headers["Content-Length"]
+            await self.downstream_send(self.start_message)
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.finish()
+        await self.downstream_send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves 'file.br' / 'file.gz' siblings when present and accepted by the client,
+    so static assets are compressed once at build/write time instead of on every request.
+    """
+
+    async def get_response(self, path: str, scope: Scope):
+        if scope["method"] in ("GET", "HEAD"):
+            media_type = mimetypes.guess_type(path)[0] or ""
+            # Skip the extra stat() calls for media we never precompress (PNG results etc.)
+            if is_compressible(media_type):
+                accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+                for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+                    if encoding not in accepted:
+                        continue
+                    try:
+                        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+                    except (OSError, ValueError):
+                        continue
+                    if stat_result and stat.S_ISREG(stat_result.st_mode):
+                        response = self.file_response(full_path, stat_result, scope)
+                        response.headers["Content-Type"] = media_type
+                        response.headers["Content-Encoding"] = encoding
+                        response.headers["Vary"] = "Accept-Encoding"
+                        return response
+        return await super().get_response(path, scope)
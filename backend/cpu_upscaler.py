@@ -0,0 +1,249 @@
+import io
+import math
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# CPU Upscale Engine Configuration
+# Bands are processed in parallel threads (PIL resampling/filters and zlib release the GIL)
+CPU_UPSCALE_WORKERS = int(os.getenv("CPU_UPSCALE_WORKERS", str(os.cpu_count() or 1)))
+# Output rows per band: bounds peak memory to ~ (workers * 2) bands of output
+CPU_UPSCALE_BAND_ROWS = int(os.getenv("CPU_UPSCALE_BAND_ROWS", "256"))
+PNG_COMPRESS_LEVEL = 6
+MAX_DIMENSION = 10000
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_ADLER_BASE = 65521
+
+
+def _adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+    """Port of zlib's adler32_combine (not exposed by Python's zlib module)."""
+    rem = len2 % _ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % _ADLER_BASE
+    sum1 += (adler2 & 0xFFFF) + _ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xFFFF) + ((adler2 >> 16) & 0xFFFF) + _ADLER_BASE - rem
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum2 >= (_ADLER_BASE << 1):
+        sum2 -= (_ADLER_BASE << 1)
+    if sum2 >= _ADLER_BASE:
+        sum2 -= _ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def compress_rows(rows: np.ndarray, level: int = PNG_COMPRESS_LEVEL) -> tuple:
+    """
+    PNG-filters (Sub) and deflates a strip of rows as an independent raw deflate segment.
+    Segments are byte-aligned (Z_SYNC_FLUSH) so they can be concatenated in order, pigz-style.
+    Returns (compressed_bytes, adler32_of_filtered_data, filtered_length).
+    Thread-safe: used by the band workers so compression also scales with cores.
+    """
+    h, w = rows.shape[:2]
+    bpp = rows.shape[2] if rows.ndim == 3 else 1
+    flat = np.ascontiguousarray(rows).reshape(h, w * bpp)
+
+    filtered = np.empty((h, w * bpp + 1), dtype=np.uint8)
+    filtered[:, 0] = 1  # Filter type 1 (Sub): each byte minus the byte bpp to the left
+    filtered[:, 1:bpp + 1] = flat[:, :bpp]
+    filtered[:, bpp + 1:] = flat[:, bpp:] - flat[:, :-bpp]
+    raw = filtered.tobytes()
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(raw) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(raw), len(raw)
+
+
+class StreamingPNGWriter:
+    """
+    Writes a PNG row strip by row strip to a file object without holding the full image.
+    Strips must be written top to bottom, either as arrays (write_rows) or as
+    segments already produced by compress_rows (write_segment).
+    """
+
+    def __init__(self, fp, width: int, height: int, channels: int):
+        color_types = {1: 0, 3: 2, 4: 6}  # L, RGB, RGBA
+        if channels not in color_types:
+            raise ValueError(f"Unsupported channel count for PNG: {channels}")
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.rows_written = 0
+        self._adler = 1
+        self._started = False
+
+        ihdr = struct.pack(">IIBBBBB", width, height, 8, color_types[channels], 0, 0, 0)
+        fp.write(_PNG_SIGNATURE)
+        fp.write(_png_chunk(b"IHDR", ihdr))
+
+    def write_rows(self, rows: np.ndarray):
+        self.write_segment(*compress_rows(rows), row_count=rows.shape[0])
+
+    def write_segment(self, data: bytes, adler: int, length: int, row_count: int):
+        if not self._started:
+            # zlib header (deflate, 32K window, default compression)
+            data = b"\x78\x9c" + data
+            self._started = True
+        self._adler = _adler32_combine(self._adler, adler, length)
+        self.rows_written += row_count
+        if data:
+            self.fp.write(_png_chunk(b"IDAT", data))
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG incomplete: wrote {self.rows_written} of {self.height} rows")
+        tail = zlib.compressobj(PNG_COMPRESS_LEVEL, zlib.DEFLATED, -15).flush(zlib.Z_FINISH)
+        tail += struct.pack(">I", self._adler)
+        if not self._started:
+            tail = b"\x78\x9c" + tail
+        self.fp.write(_png_chunk(b"IDAT", tail))
+        self.fp.write(_png_chunk(b"IEND", b""))
+
+
+def _row_step(height: int, new_height: int, band_rows: int):
+    """
+    Smallest output row stride that maps onto whole source rows (new_height / gcd), or None
+    when it is longer than a band (e.g. an odd height at 1.5x): bands are then unaligned.
+    """
+    step = new_height // math.gcd(height, new_height)
+    return step if step <= band_rows else None
+
+
+def _plan_bands(new_height: int, band_rows: int, step: int = None):
+    # Aligned band starts stay on the step grid (see _process_band)
+    if step:
+        band_rows = band_rows // step * step
+    return [(y, min(y + band_rows, new_height)) for y in range(0, new_height, band_rows)]
+
+
+def _process_band(img_pil: Image.Image, oy0: int, oy1: int, new_size: tuple,
+                  median: bool, sharpen: tuple, step: int = None) -> tuple:
+    """
+    Computes output rows [oy0, oy1) as the full-image pipeline would.
+    Both the source crop and the resized strip carry a halo so the median filter,
+    the Lanczos kernel and the unsharp blur never see a band edge inside the kept rows,
+    which are cropped out of the strip afterwards.
+    With a step (see _row_step) the strip's first and last rows are snapped to that grid: its
+    resize box then has integer bounds and the same scale as the full image, so PIL computes
+    the same kernel weights and the rows are identical. Without one the box is fractional;
+    its scale drifts by an ulp, which rounds a few resampled values off by one (UnsharpMask's
+    threshold can widen that to a few levels).
+    """
+    width, height = img_pil.size
+    new_width, new_height = new_size
+    sy = height / new_height
+
+    # Output halo for UnsharpMask (gaussian extent ~3 sigma, rounded up)
+    out_halo = int(math.ceil(4 * sharpen[0])) + 2 if sharpen else 0
+    if step:
+        hy0 = max(0, (oy0 - out_halo) // step * step)
+        hy1 = min(new_height, -(-(oy1 + out_halo) // step) * step)
+        src0 = hy0 * height // new_height  # Exact: aligned rows land on whole source rows
+        src1 = hy1 * height // new_height
+    else:
+        hy0 = max(0, oy0 - out_halo)
+        hy1 = min(new_height, oy1 + out_halo)
+        src0 = hy0 * sy
+        src1 = hy1 * sy
+
+    # Source halo: Lanczos support (3 taps, widened when downscaling) + median + rounding
+    src_halo = int(math.ceil(3 * max(1.0, sy))) + (1 if median else 0) + 2
+    sy0 = max(0, int(src0) - src_halo)
+    sy1 = min(height, int(math.ceil(src1)) + src_halo)
+
+    crop = img_pil.crop((0, sy0, width, sy1))
+    if median:
+        crop = crop.filter(ImageFilter.MedianFilter(size=3))
+
+    # 'box' keeps the exact full-image sampling grid; pixels outside it feed the kernel
+    box = (0, src0 - sy0, width, src1 - sy0)
+    strip = crop.resize((new_width, hy1 - hy0), Image.Resampling.LANCZOS, box=box)
+
+    if sharpen:
+        radius, percent = sharpen
+        strip = strip.filter(ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=3))
+
+    rows = np.asarray(strip)[oy0 - hy0:oy1 - hy0]
+    return compress_rows(rows) + (oy1 - oy0,)
+
+
+def upscale_to_stream(img_pil: Image.Image, fp, factor=2, detail_boost=1.5, workers: int = None, band_rows: int = None,
+                      progress=None):
+    """
+    Band-parallel Lanczos upscale (median denoise + unsharp mask) streamed into a PNG file object.
+    Peak memory is bounded by the number of bands in flight rather than by the output size.
+    Output is pixel-identical to the single-threaded pipeline when band edges can sit on whole
+    source rows (integer factors, and fractional ones whose row stride fits in a band); otherwise
+    a few pixels in ten thousand differ by a few levels (see _process_band).
+    progress(done, total) is called after each band is written.
+    """
+    workers = workers or CPU_UPSCALE_WORKERS
+    band_rows = band_rows or CPU_UPSCALE_BAND_ROWS
+
+    width, height = img_pil.size
+    new_width = int(width * factor)
+    new_height = int(height * factor)
+
+    if new_width > MAX_DIMENSION or new_height > MAX_DIMENSION:
+        raise ValueError(f"Upscale factor too large. Resulting image would exceed {MAX_DIMENSION}x{MAX_DIMENSION} pixels.")
+    if new_width < 1 or new_height < 1:
+        raise ValueError("Upscale factor too small. Resulting image would be empty.")
+
+    # Make sure the source is decoded once, before threads share it
+    img_pil.load()
+    median = width < 1000
+    sharpen = (1 + (factor / 4), int(100 * detail_boost)) if detail_boost > 0 else None
+
+    writer = StreamingPNGWriter(fp, new_width, new_height, len(img_pil.getbands()))
+    step = _row_step(height, new_height, band_rows)
+    bands = _plan_bands(new_height, band_rows, step)
+    max_in_flight = max(1, workers * 2)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        next_band = 0
+        while next_band < len(bands) or pending:
+            # Keep a bounded window of bands in flight, consumed strictly in order
+            while next_band < len(bands) and len(pending) < max_in_flight:
+                oy0, oy1 = bands[next_band]
+                pending.append(executor.submit(_process_band, img_pil, oy0, oy1, (new_width, new_height), median, sharpen, step))
+                next_band += 1
+            data, adler, length, row_count = pending.pop(0).result()
+            writer.write_segment(data, adler, length, row_count)
+            if progress is not None:
+                progress(next_band - len(pending), len(bands))
+
+    writer.close()
+    logger.info(f"💻 CPU upscale {width}x{height} -> {new_width}x{new_height} in {len(bands)} bands ({workers} workers)")
+
+
+def upscale_to_bytes(img_pil: Image.Image, factor=2, detail_boost=1.5) -> bytes:
+    buffer = io.BytesIO()
+    upscale_to_stream(img_pil, buffer, factor, detail_boost)
+    return buffer.getvalue()
+
+
+def upscale_to_file(img_pil: Image.Image, file_path: str, factor=2, detail_boost=1.5, progress=None):
+    """Streams the upscaled PNG straight to disk; the partial file is removed on failure."""
+    try:
+        with open(file_path, "wb") as f:
+            upscale_to_stream(img_pil, f, factor, detail_boost, progress=progress)
+    except Exception:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
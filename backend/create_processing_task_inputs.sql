@@ -0,0 +1,28 @@
+-- Script to keep the inputs of queued processing tasks in the database
+-- =============================================================
+-- Requires update_processing_tasks_queue.sql.
+-- Workers run in their own processes (python -m backend.worker), usually on another machine
+-- than the web process that accepted the upload, so inputs cannot stay on local disk.
+-- A row is written in the same transaction as its task and deleted once the task
+-- completes or fails for good.
+
+CREATE TABLE IF NOT EXISTS processing_task_inputs (
+    ref VARCHAR(255) PRIMARY KEY,
+    data BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Inputs were files under TASK_INPUT_DIR before: queued tasks still pointing at one cannot run
+UPDATE processing_tasks SET status = 'FAILED', error = 'Input lost in the move to database storage'
+WHERE status IN ('PENDING', 'RUNNING') AND input_ref IS NOT NULL
+  AND input_ref NOT IN (SELECT ref FROM processing_task_inputs);
+
+-- Comments for documentation
+COMMENT ON TABLE processing_task_inputs IS 'Inputs of queued processing tasks (see backend/services/task_queue.py)';
+COMMENT ON COLUMN processing_task_inputs.ref IS 'processing_tasks.input_ref';
+COMMENT ON COLUMN processing_task_inputs.data IS 'Uncompressed zip of the task inputs: image, optional mask';
+COMMENT ON COLUMN processing_tasks.input_ref IS 'Key of the task inputs in processing_task_inputs';
+
+-- Permissions
+-- Grant access to the application user
+GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE processing_task_inputs TO dimo_app_user;
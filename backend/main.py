@@ -1,16 +1,42 @@
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import os
+from contextlib import asynccontextmanager
 
 from . import models, database
 from .routers import projects, auth, users, processing, finance, orders, payments, clients
 from .database import engine
+from .services.gpu_client import gpu_client
+from .services.gpu_warmer import gpu_warmer
+from .services.task_queue import task_worker, TASK_WORKER_EMBEDDED
+from .services.task_events import task_events
+from .services.retention import result_sweeper
+from .services.result_store import STATIC_DIR
 
 # Create DB tables
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="PhotoEdit Suite API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled GPU client for the whole process (keeps TCP/TLS connections warm)
+    await gpu_client.start()
+    # Predictive warm-keeping of the scale-to-zero GPU worker (no-op without GPU backends)
+    gpu_warmer.start()
+    # Task status push (SSE); LISTEN for events from worker processes when on PostgreSQL
+    task_events.start(listen=True)
+    # Queued processing tasks, unless separate worker processes run them (backend/worker.py, TASK_WORKER_EMBEDDED=false)
+    if TASK_WORKER_EMBEDDED:
+        task_worker.start()
+    # TTL / size-cap garbage collection of task results and finished task rows
+    result_sweeper.start()
+    yield
+    await result_sweeper.stop()
+    await task_worker.stop()
+    task_events.stop()
+    await gpu_warmer.stop()
+    await gpu_client.close()
+
+app = FastAPI(title="PhotoEdit Suite API", lifespan=lifespan)
 
 # Include Routers
 app.include_router(auth.router)
@@ -33,15 +59,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the editor read the auto_trim offset of cropped results
+    expose_headers=["X-Trim-X", "X-Trim-Y", "X-Original-Width", "X-Original-Height"],
 )
 
-from fastapi.middleware.gzip import GZipMiddleware
-app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Content-type aware compression (skips PNG/JPEG/WebP, brotli or gzip for JSON)
+from .compression import CompressionMiddleware, PrecompressedStaticFiles
+app.add_middleware(CompressionMiddleware)
 
-STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 os.makedirs(STATIC_DIR, exist_ok=True)
 
-app.mount("/api/static", StaticFiles(directory=STATIC_DIR), name="static")
+app.mount("/api/static", PrecompressedStaticFiles(directory=STATIC_DIR), name="static")
 
 import uvicorn
 if __name__ == "__main__":
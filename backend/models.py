@@ -1,5 +1,5 @@
 from sqlalchemy import UniqueConstraint
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime, Numeric, func, Table
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime, Numeric, LargeBinary, func, Table, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSON
 from .database import Base
@@ -193,10 +193,40 @@ class ProcessingTask(Base):
     __tablename__ = "processing_tasks"
 
     id = Column(String, primary_key=True, index=True)
-    status = Column(String, default="PENDING") # PENDING, COMPLETED, FAILED
+    status = Column(String, default="PENDING") # PENDING, RUNNING, COMPLETED, FAILED
     result_url = Column(String, nullable=True)
     error = Column(String, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
+    # Job queue (see services/task_queue.py)
+    kind = Column(String, default="upscale")
+    params = Column(JSON, default={})
+    input_ref = Column(String, nullable=True) # processing_task_inputs.ref
+    dedup_key = Column(String, nullable=True) # Identical in-flight submissions share one task
+    result_meta = Column(JSON, nullable=True) # e.g. the auto_trim offset
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(DateTime(timezone=True), nullable=True)
+    locked_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('uq_processing_tasks_in_flight', 'dedup_key', unique=True,
+              postgresql_where=text("status IN ('PENDING', 'RUNNING')"),
+              sqlite_where=text("status IN ('PENDING', 'RUNNING')")),
+    )
+
+
+class ProcessingTaskInput(Base):
+    # Inputs of queued tasks, kept in the database so any worker can read them;
+    # deleted once the task completes or fails for good
+    __tablename__ = "processing_task_inputs"
+
+    ref = Column(String, primary_key=True) # processing_tasks.input_ref
+    data = Column(LargeBinary, nullable=False) # Uncompressed zip: image, optional mask
+    created_at = Column(DateTime, server_default=func.now())
+
 
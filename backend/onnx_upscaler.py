@@ -0,0 +1,158 @@
+import io
+import math
+import os
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .cpu_upscaler import StreamingPNGWriter, MAX_DIMENSION
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# CPU AI Upscale Configuration
+# ONNX export of Real-ESRGAN (gpu-worker/export_onnx.py; fp32 or int8). Unset = engine disabled.
+CPU_AI_UPSCALE_MODEL = os.getenv("CPU_AI_UPSCALE_MODEL")
+CPU_AI_UPSCALE_THREADS = int(os.getenv("CPU_AI_UPSCALE_THREADS", str(os.cpu_count() or 1)))
+CPU_AI_TILE = int(os.getenv("CPU_AI_TILE", "192"))  # Input pixels per tile side
+CPU_AI_TILE_PAD = int(os.getenv("CPU_AI_TILE_PAD", "10"))  # Overlap so tile seams don't show
+# Larger inputs go to Lanczos: AI upscaling on CPU grows with input pixels (~seconds per megapixel)
+CPU_AI_MAX_MEGAPIXELS = float(os.getenv("CPU_AI_MAX_MEGAPIXELS", "1.5"))
+OUTPUT_BAND_ROWS = 256
+
+
+class OnnxUpscaler:
+    """
+    Real-ESRGAN on onnxruntime's CPU provider. The image is reflect-padded to a grid of equally
+    shaped tiles (one shape = one optimized plan), each tile runs with all intra-op threads, and
+    the model output is resized to the exact requested factor.
+    """
+
+    def __init__(self, model_path: str, threads: int = CPU_AI_UPSCALE_THREADS):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = max(1, threads)
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.model_path = model_path
+        self.scale = None  # Native scale, measured on the first tile
+
+    def _run(self, tile: np.ndarray) -> np.ndarray:
+        output = self.session.run(None, {self.input_name: tile[None]})[0][0]
+        if self.scale is None:
+            self.scale = round(output.shape[1] / tile.shape[1])
+        return output
+
+    def upscale_rgb(self, rgb: np.ndarray, tile: int = CPU_AI_TILE, pad: int = CPU_AI_TILE_PAD, progress=None) -> np.ndarray:
+        """
+        HxWx3 uint8 RGB -> (H*scale)x(W*scale)x3 uint8 at the model's native scale.
+        progress(done, total) is called after each tile.
+        """
+        h, w = rgb.shape[:2]
+        tile_h, tile_w = min(tile, h), min(tile, w)
+        rows, cols = math.ceil(h / tile_h), math.ceil(w / tile_w)
+        mode = "reflect" if min(h, w) > 1 else "edge"
+        padded = np.pad(rgb.astype(np.float32) / 255.0,
+                        ((pad, rows * tile_h - h + pad), (pad, cols * tile_w - w + pad), (0, 0)), mode=mode)
+        padded = np.ascontiguousarray(padded.transpose(2, 0, 1))
+
+        canvas = None
+        for r in range(rows):
+            for c in range(cols):
+                y, x = r * tile_h, c * tile_w
+                output = self._run(np.ascontiguousarray(padded[:, y:y + tile_h + 2 * pad, x:x + tile_w + 2 * pad]))
+                s = self.scale
+                if canvas is None:
+                    canvas = np.empty((rows * tile_h * s, cols * tile_w * s, 3), dtype=np.uint8)
+                # Drop the overlap margin, keep the tile body
+                body = output[:, pad * s:(pad + tile_h) * s, pad * s:(pad + tile_w) * s]
+                canvas[y * s:(y + tile_h) * s, x * s:(x + tile_w) * s] = \
+                    (np.clip(body, 0, 1).transpose(1, 2, 0) * 255.0).round().astype(np.uint8)
+                if progress is not None:
+                    progress(r * cols + c + 1, rows * cols)
+        return canvas[:h * self.scale, :w * self.scale]
+
+    def upscale(self, img_pil: Image.Image, factor: float, progress=None) -> np.ndarray:
+        """Upscales an RGB/RGBA image by factor. Alpha is resized (the model only sees color)."""
+        width, height = img_pil.size
+        size = (int(width * factor), int(height * factor))
+        pixels = np.asarray(img_pil)
+        output = self.upscale_rgb(pixels[:, :, :3], progress=progress)
+        if (output.shape[1], output.shape[0]) != size:
+            interpolation = cv2.INTER_AREA if size[0] < output.shape[1] else cv2.INTER_CUBIC
+            output = cv2.resize(output, size, interpolation=interpolation)
+        if pixels.shape[2] == 4:
+            alpha = cv2.resize(pixels[:, :, 3], size, interpolation=cv2.INTER_LINEAR)
+            output = np.dstack([output, alpha])
+        return output
+
+
+_upscaler = None
+_upscaler_lock = threading.Lock()
+_disabled_reason = None
+
+
+def get_upscaler():
+    """Loads the ONNX session once (lazily). Returns None when the engine is not usable here."""
+    global _upscaler, _disabled_reason
+    if _upscaler is not None or _disabled_reason is not None:
+        return _upscaler
+    with _upscaler_lock:
+        if _upscaler is None and _disabled_reason is None:
+            if not CPU_AI_UPSCALE_MODEL:
+                _disabled_reason = "CPU_AI_UPSCALE_MODEL not set"
+            elif not os.path.exists(CPU_AI_UPSCALE_MODEL):
+                _disabled_reason = f"model not found at {CPU_AI_UPSCALE_MODEL}"
+                logger.warning(f"⚠️ CPU AI upscaler disabled: {_disabled_reason}")
+            else:
+                try:
+                    _upscaler = OnnxUpscaler(CPU_AI_UPSCALE_MODEL)
+                    logger.info(f"✅ CPU AI upscaler loaded: {CPU_AI_UPSCALE_MODEL} ({CPU_AI_UPSCALE_THREADS} threads)")
+                except Exception as e:
+                    _disabled_reason = str(e)
+                    logger.warning(f"⚠️ CPU AI upscaler disabled: {e}")
+    return _upscaler
+
+
+def accepts(img_pil: Image.Image, factor) -> bool:
+    """True when the AI engine is configured and the job is within its CPU budget."""
+    if not CPU_AI_UPSCALE_MODEL or _disabled_reason is not None:
+        return False
+    width, height = img_pil.size
+    if factor <= 1 or width * height / 1_000_000 > CPU_AI_MAX_MEGAPIXELS:
+        return False
+    return int(width * factor) <= MAX_DIMENSION and int(height * factor) <= MAX_DIMENSION
+
+
+def upscale_to_stream(img_pil: Image.Image, fp, factor=2, upscaler: OnnxUpscaler = None, progress=None):
+    upscaler = upscaler or get_upscaler()
+    if upscaler is None:
+        raise RuntimeError(f"CPU AI upscaler not available: {_disabled_reason}")
+    img_pil.load()
+    output = upscaler.upscale(img_pil, factor, progress)
+    writer = StreamingPNGWriter(fp, output.shape[1], output.shape[0], output.shape[2])
+    for y in range(0, output.shape[0], OUTPUT_BAND_ROWS):
+        writer.write_rows(output[y:y + OUTPUT_BAND_ROWS])
+    writer.close()
+
+
+def upscale_to_bytes(img_pil: Image.Image, factor=2, upscaler: OnnxUpscaler = None) -> bytes:
+    buffer = io.BytesIO()
+    upscale_to_stream(img_pil, buffer, factor, upscaler)
+    return buffer.getvalue()
+
+
+def upscale_to_file(img_pil: Image.Image, file_path: str, factor=2, progress=None):
+    """Writes the upscaled PNG to disk; the partial file is removed on failure."""
+    try:
+        with open(file_path, "wb") as f:
+            upscale_to_stream(img_pil, f, factor, progress=progress)
+    except Exception:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
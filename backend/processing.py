@@ -1,10 +1,19 @@
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image, ImageEnhance
 import io
 import os
-import httpx
+import math
+import time
 import asyncio
+import hashlib
+import contextlib
+from urllib.parse import urlsplit, urlunsplit
+
+from .services.gpu_client import GPUServiceUnavailable
+from .services.gpu_router import gpu_router
+from .services.gpu_warmer import gpu_warmer
+from .services.gpu_jobs import gpu_jobs
 
 import logging
 
@@ -15,32 +24,92 @@ logger = logging.getLogger(__name__)
 # We support distinct URLs for each microservice (Modal/Serverless style)
 GPU_UPSCALE_URL = os.getenv("GPU_UPSCALE_URL") 
 GPU_REMOVER_URL = os.getenv("GPU_REMOVER_URL") 
-GPU_SERVICE_SECRET = os.getenv("GPU_SERVICE_SECRET")
 # Legacy/Koyeb Fallback URL
 GPU_SERVICE_URL = os.getenv("GPU_SERVICE_URL")
+# Health endpoint probed while a GPU circuit is open (defaults to GPU_SERVICE_URL/health)
+GPU_HEALTH_URL = os.getenv("GPU_HEALTH_URL")
+# Multiple backends per capability (comma separated), routed by load/latency
+GPU_UPSCALE_URLS = os.getenv("GPU_UPSCALE_URLS")
+GPU_REMOVER_URLS = os.getenv("GPU_REMOVER_URLS")
+
+# Transfer encoding: 'webp' re-encodes PNG uploads as lossless WebP (smaller, same pixels);
+# results come back as 'png' or lossless 'webp' (masks are always PNG)
+GPU_UPLOAD_FORMAT = os.getenv("GPU_UPLOAD_FORMAT", "original")
+GPU_RESULT_FORMAT = os.getenv("GPU_RESULT_FORMAT", "png")
 
 # App Environment
 APP_ENV = os.getenv("APP_ENV", "local")
 
+def _gpu_service_urls(service_type: str) -> list:
+    """All configured GPU backends for a capability, most specific configuration first."""
+    url_list = {"upscale": GPU_UPSCALE_URLS, "remove-background": GPU_REMOVER_URLS}.get(service_type)
+    if url_list:
+        return [url.strip() for url in url_list.split(",") if url.strip()]
+    if service_type == "upscale" and GPU_UPSCALE_URL:
+        return [GPU_UPSCALE_URL]
+    if service_type == "remove-background" and GPU_REMOVER_URL:
+        return [GPU_REMOVER_URL]
+    # If specific URL not found, check if legacy monolithic URL is set (Koyeb fallback)
+    if GPU_SERVICE_URL:
+        return [f"{GPU_SERVICE_URL}/{service_type}"]
+    return []
+
+gpu_router.configure("upscale", _gpu_service_urls("upscale"))
+gpu_router.configure("remove-background", _gpu_service_urls("remove-background"))
+
 def _should_use_gpu(capability: str = None) -> bool:
     """
     Determines if we should use the GPU Service based on functionality available.
+    Per-request load/latency routing (GPU vs CPU) happens later in gpu_router.
     """
     # 0. Force local processing if APP_ENV is local to avoid cloud costs
     if APP_ENV == "local":
         return False
 
-    # 1. Check if we have a specific URL (e.g. upscaler-specific)
-    if capability == "upscale" and GPU_UPSCALE_URL:
-        return True
-    if capability == "remove-background" and GPU_REMOVER_URL:
-        return True
-        
-    # 2. Check generic service URL
-    if GPU_SERVICE_URL:
-        return True
-        
-    return False
+    # 1. Check if we have backends for this capability (specific URLs, lists or generic service)
+    if capability:
+        return len(gpu_router.backends(capability)) > 0
+
+    return any(gpu_router.backends(cap) for cap in ("upscale", "remove-background"))
+
+def _gpu_health_url(url: str, service_type: str):
+    """
+    Health endpoint next to a capability endpoint, or None for an unknown layout:
+    - GPU_SERVICE_URL/<capability> -> GPU_SERVICE_URL/health
+    - Modal per-method hosts: https://<workspace>--<app>-<class>-<capability>.modal.run
+      -> https://<workspace>--<app>-<class>-health.modal.run (same class, same container)
+    """
+    parts = urlsplit(url)
+    path = parts.path.rstrip("/")
+    if path.endswith("/" + service_type):
+        return urlunsplit(parts._replace(path=path[:-len(service_type)] + "health"))
+    label, dot, domain = parts.netloc.partition(".")
+    if label.endswith("-" + service_type) and path == "":
+        return urlunsplit(parts._replace(netloc=label[:-len(service_type)] + "health" + dot + domain))
+    return None
+
+def _gpu_warm_urls() -> list:
+    """Warm-up targets: GPU_WARM_URLS, else GPU_HEALTH_URL, else the health endpoint of every GPU backend."""
+    if GPU_WARM_URLS:
+        return [url.strip() for url in GPU_WARM_URLS.split(",") if url.strip()]
+    if GPU_HEALTH_URL:
+        return [GPU_HEALTH_URL]
+    warm_urls = []
+    for service_type in ("upscale", "remove-background"):
+        for backend in gpu_router.backends(service_type):
+            health_url = _gpu_health_url(backend.url, service_type)
+            if health_url is None:
+                logger.warning(f"⚠️ No health URL can be derived from {backend.url}; set GPU_WARM_URLS to warm it")
+            else:
+                warm_urls.append(health_url)
+    return warm_urls
+
+# Warm-up pings go to the worker health endpoint(s)
+GPU_WARM_URLS = os.getenv("GPU_WARM_URLS")
+if _should_use_gpu():
+    gpu_warmer.configure(_gpu_warm_urls())
+    if not gpu_warmer.enabled:
+        logger.warning("⚠️ GPU WARMING DISABLED: no warm-up URL (set GPU_WARM_URLS or GPU_HEALTH_URL)")
 
 # Log startup mode
 if _should_use_gpu():
@@ -48,45 +117,78 @@ if _should_use_gpu():
 else:
     logger.info(f"💻 PROCESSING MODE: LOCAL CPU FALLBACK (Env: {APP_ENV}) - Optimized for Apple Silicon/Local Dev")
 
-async def call_gpu_service(service_type: str, image_bytes: bytes, params: dict = None, data: dict = None) -> bytes:
+def image_megapixels(image_bytes: bytes) -> float:
+    """Image size in megapixels, read from the header only (no full decode)."""
+    width, height = Image.open(io.BytesIO(image_bytes)).size
+    return width * height / 1_000_000
+
+def image_media_type(image_bytes: bytes) -> str:
+    """Sniffs the media type of encoded image bytes from the magic number."""
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    if image_bytes[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    return "image/png"
+
+def _gpu_upload(image_bytes: bytes) -> tuple:
+    """
+    Multipart file tuple for the GPU worker, labelled with its real type.
+    With GPU_UPLOAD_FORMAT=webp, PNG sources are sent as lossless WebP when that is smaller
+    (JPEG/WebP are already compressed and are sent untouched).
+    """
+    media_type = image_media_type(image_bytes)
+    if GPU_UPLOAD_FORMAT == "webp" and media_type == "image/png":
+        img_pil = Image.open(io.BytesIO(image_bytes))
+        if img_pil.mode not in ("RGB", "RGBA"):
+            has_alpha = img_pil.mode in ("LA", "PA") or "transparency" in img_pil.info
+            img_pil = img_pil.convert("RGBA" if has_alpha else "RGB")
+        buffer = io.BytesIO()
+        img_pil.save(buffer, format="WEBP", lossless=True, method=4)
+        if buffer.tell() < len(image_bytes):
+            return ("image.webp", buffer.getvalue(), "image/webp")
+    extension = media_type.split("/")[1]
+    return (f"image.{extension}", image_bytes, media_type)
+
+async def call_gpu_service(service_type: str, image_bytes: bytes, params: dict = None, data: dict = None,
+                           megapixels: float = None) -> bytes:
     """
     Helper to call the GPU worker service.
     service_type: 'upscale' or 'remove-background'
+    megapixels: work size used by the router's GPU/CPU estimates (defaults to the input size)
+    The router picks the least loaded backend, or raises RouteToCPU (a GPUServiceUnavailable)
+    when local CPU is estimated faster; the pooled client adds retries + circuit breaker.
+    Inputs already sent to a backend are referenced by content hash instead of re-uploaded.
     """
-    url = None
-    if service_type == "upscale":
-        url = GPU_UPSCALE_URL
-    elif service_type == "remove-background":
-        url = GPU_REMOVER_URL
-    
-    if not url:
-        # If specific URL not found, check if legacy monolithic URL is set (Koyeb fallback)
-        base_url = os.getenv("GPU_SERVICE_URL")
-        if base_url:
-             url = f"{base_url}/{service_type}"
-        else:
-             raise ValueError(f"No configured URL for GPU service: {service_type}")
+    if megapixels is None:
+        megapixels = image_megapixels(image_bytes)
+    health_url = GPU_HEALTH_URL or (f"{GPU_SERVICE_URL}/health" if GPU_SERVICE_URL else None)
 
-    headers = {"x-api-key": GPU_SERVICE_SECRET} if GPU_SERVICE_SECRET else {}
-    
-    # 60s timeout for Cold Starts
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        # Prepare multipart/form-data
-        files = {"file": ("image.png", image_bytes, "image/png")}
-        
-        # httpx merges params into query string or form? 
-        # For our GPU service, we defined params as query params in main.py?
-        # main.py: upscale(file=..., scale=...) -> scale is query param (default) or Form.
-        # Let's check main.py... `scale: float = 2.0` in FastAPI is Query by default unless File/Form used.
-        # Since we use File(...), other args usually become Query unless explicitly Form.
-        # Use query params for simplicity.
-        
-        response = await client.post(url, files=files, params=params, data=data, headers=headers)
-        
-        if response.status_code != 200:
-            raise Exception(f"GPU Service Failed: {response.status_code} - {response.text}")
-            
-        return response.content
+    params = dict(params or {})
+    if GPU_RESULT_FORMAT != "png":
+        params["response_format"] = GPU_RESULT_FORMAT
+
+    # Prepare multipart/form-data; extra args go as query params (params) or form fields (data)
+    upload = await asyncio.to_thread(_gpu_upload, image_bytes)
+    files = {"file": upload}
+    content_hash = hashlib.sha256(upload[1]).hexdigest()
+    gpu_warmer.record_request()
+    response = await gpu_router.call(service_type, megapixels, files=files, params=params or None, data=data,
+                                     health_url=health_url, content_hash=content_hash)
+    return response.content
+
+async def call_gpu_job(service_type: str, image_bytes: bytes, params: dict = None) -> bytes:
+    """
+    Same request as call_gpu_service, run through the worker's job API (GPU_JOBS_URL):
+    submitted, long-polled and downloaded, so no read timeout limits how long the job may take.
+    For background tasks; the job backend is not load-routed or hedged.
+    """
+    params = dict(params or {})
+    if GPU_RESULT_FORMAT != "png":
+        params["response_format"] = GPU_RESULT_FORMAT
+    upload = await asyncio.to_thread(_gpu_upload, image_bytes)
+    content_hash = hashlib.sha256(upload[1]).hexdigest()
+    gpu_warmer.record_request()
+    return await gpu_jobs.run(service_type, files={"file": upload}, params=params, content_hash=content_hash)
 
 def read_image_file(file_bytes: bytes) -> Image.Image:
     """Reads image bytes and returns a PIL Image. Preserves Alpha if present."""
@@ -113,22 +215,92 @@ def cv2_to_pil(image: np.ndarray) -> Image.Image:
         return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA))
     return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
 
+CV_MAX_THICKNESS = 32767  # cv2.line rejects thicker strokes
+
+def validate_vector_mask(vector_mask):
+    """
+    Checks a VectorMask before anything is allocated for it (raises ValueError).
+    The canvas is capped at MAX_DIMENSION per side and RLE runs must cover it exactly;
+    every stroke point must be a finite [x, y] pair.
+    """
+    if vector_mask.width <= 0 or vector_mask.height <= 0:
+        raise ValueError("Vector mask canvas size must be positive")
+    if vector_mask.width > cpu_upscaler.MAX_DIMENSION or vector_mask.height > cpu_upscaler.MAX_DIMENSION:
+        raise ValueError(f"Vector mask canvas exceeds {cpu_upscaler.MAX_DIMENSION}x{cpu_upscaler.MAX_DIMENSION} pixels")
+    if vector_mask.rle is not None:
+        if any(count < 0 for count in vector_mask.rle) or sum(vector_mask.rle) != vector_mask.width * vector_mask.height:
+            raise ValueError(f"RLE mask does not cover a {vector_mask.width}x{vector_mask.height} canvas")
+    for stroke in vector_mask.strokes or []:
+        if not math.isfinite(stroke.width) or stroke.width < 0:
+            raise ValueError("Stroke width must be a non-negative number")
+        for point in stroke.points:
+            if len(point) != 2 or not all(math.isfinite(v) for v in point):
+                raise ValueError("Stroke points must be [x, y] pairs")
+
+def rasterize_vector_mask(vector_mask, width: int, height: int) -> np.ndarray:
+    """
+    Rasterizes a VectorMask (brush strokes or RLE) directly at image resolution.
+    Returns a binary uint8 mask (0/255) of shape (height, width).
+    """
+    validate_vector_mask(vector_mask)
+
+    if vector_mask.rle is not None:
+        # Runs are expanded at canvas size: never more than the image itself
+        if vector_mask.width * vector_mask.height > width * height:
+            raise ValueError(f"RLE mask canvas {vector_mask.width}x{vector_mask.height} is larger than the {width}x{height} image")
+        counts = np.asarray(vector_mask.rle, dtype=np.int64)
+        # Even runs are background, odd runs are foreground
+        values = np.zeros(len(counts), dtype=np.uint8)
+        values[1::2] = 255
+        mask = np.repeat(values, counts).reshape(vector_mask.height, vector_mask.width)
+        if mask.shape != (height, width):
+            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+        return mask
+
+    mask = np.zeros((height, width), dtype=np.uint8)
+    sx = width / vector_mask.width
+    sy = height / vector_mask.height
+    for stroke in vector_mask.strokes or []:
+        if not stroke.points:
+            continue
+        pts = np.array(stroke.points, dtype=np.float64).reshape(-1, 2)
+        pts = np.round(pts * (sx, sy)).astype(np.int32)
+        thickness = min(CV_MAX_THICKNESS, max(1, int(round(stroke.width * (sx + sy) / 2))))
+        if len(pts) == 1:
+            cv2.circle(mask, tuple(int(v) for v in pts[0]), max(1, thickness // 2), 255, -1)
+            continue
+        # Thick cv2.line segments have round caps, so joints come out like a brush
+        for p0, p1 in zip(pts[:-1], pts[1:]):
+            cv2.line(mask, tuple(int(v) for v in p0), tuple(int(v) for v in p1), 255, thickness)
+    return mask
+
+def load_mask(mask, width: int, height: int) -> np.ndarray:
+    """
+    Returns a single-channel mask at (height, width) from either PNG bytes or a VectorMask.
+    """
+    if isinstance(mask, (bytes, bytearray)):
+        mask_cv = np.array(read_image_file(mask).convert('L'))
+        if mask_cv.shape[:2] != (height, width):
+            mask_cv = cv2.resize(mask_cv, (width, height), interpolation=cv2.INTER_NEAREST)
+        return mask_cv
+    return rasterize_vector_mask(mask, width, height)
+
 # 1. Remover Objetos (Inpainting Avanzado)
-def remove_objects(image_bytes: bytes, mask_bytes: bytes) -> bytes:
+def remove_objects(image_bytes: bytes, mask_bytes) -> bytes:
     """
     Removes objects using a high-precision approach:
     1. Adaptive masking to cover shadows.
     2. Background pre-filling to prevent color bleeding from the object.
     3. Multi-stage inpainting for better texture.
     4. Texture/Grain restoration.
+    mask_bytes: PNG mask bytes or a VectorMask (rasterized at image resolution).
     """
     # Read image and mask
     img_pil = read_image_file(image_bytes)
-    mask_pil = read_image_file(mask_bytes).convert('L')
 
     img_cv = pil_to_cv2(img_pil)
-    mask_cv = np.array(mask_pil)
     h, w = img_cv.shape[:2]
+    mask_cv = load_mask(mask_bytes, w, h)
 
     # 1. Adaptive Dilation: Adjust based on image resolution
     # Larger images need more dilation to cover anti-aliased edges
@@ -222,11 +394,12 @@ def create_mask_from_point(image_bytes: bytes, x: int, y: int, tolerance: int =
     return pil_to_bytes(mask_pil)
 
 
-def remove_specific_colors(image_bytes: bytes, colors: list, tolerance: int = 30) -> bytes:
+def remove_specific_colors(image_bytes: bytes, colors: list, tolerance: int = 30, output: str = "rgba") -> bytes:
     """
     Removes specific colors from the image by making them transparent.
     colors: list of [R, G, B]
     tolerance: distance threshold
+    output: 'rgba' for the cut-out, 'mask' for the alpha channel only
     """
     img_pil = read_image_file(image_bytes).convert("RGBA")
     data = np.array(img_pil)
@@ -247,17 +420,107 @@ def remove_specific_colors(image_bytes: bytes, colors: list, tolerance: int = 30
     # Set alpha to 0 where mask matches
     data[mask_accumulated, 3] = 0
     
+    if output == "mask":
+        return pil_to_bytes(Image.fromarray(data[:, :, 3]))
     return pil_to_bytes(Image.fromarray(data))
 
 # 2. Quitar Fondo
-async def remove_background(image_bytes: bytes) -> bytes:
+# Output modes for background removal:
+# - 'rgba': full cut-out PNG (original size, transparent background)
+# - 'mask': single-channel PNG with only the alpha matte (much smaller to encode/transfer)
+BG_OUTPUT_MODES = ("rgba", "mask")
+# Model tiers the GPU worker accepts as 'quality' (names of its REMOVER_TIERS)
+BG_QUALITY_TIERS = tuple(t.strip() for t in os.getenv("BG_QUALITY_TIERS", "fast,balanced,standard,high").split(",") if t.strip())
+
+def remove_background_with_mask(image_bytes: bytes, mask, refine: bool = False) -> bytes:
+    """
+    Manual background removal: the mask (PNG bytes or a VectorMask) marks what to keep;
+    everything else becomes transparent. Grey mask values give partial transparency.
+    refine: drops isolated specks and feathers the edge, like contour_clip's refine pass.
+    """
+    img_pil = read_image_file(image_bytes).convert("RGBA")
+    width, height = img_pil.size
+    keep = load_mask(mask, width, height)
+    if refine:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        keep = cv2.morphologyEx(keep, cv2.MORPH_OPEN, kernel, iterations=1)
+        keep = cv2.GaussianBlur(keep, (3, 3), 0)
+    img_rgba = np.array(img_pil)
+    # Already transparent pixels stay transparent: the mask only removes
+    img_rgba[:, :, 3] = np.minimum(img_rgba[:, :, 3], keep)
+    return pil_to_bytes(Image.fromarray(img_rgba))
+
+def alpha_to_mask_bytes(image_bytes: bytes) -> bytes:
+    """
+    Extracts the alpha channel of an encoded image as a single-channel PNG.
+    Already single-channel images are passed through untouched.
+    """
+    img_pil = Image.open(io.BytesIO(image_bytes))
+    if img_pil.mode == "L":
+        return image_bytes
+    if img_pil.mode != "RGBA":
+        img_pil = img_pil.convert("RGBA")
+    return pil_to_bytes(img_pil.getchannel("A"))
+
+def trim_to_alpha(image_bytes: bytes, padding: int = 0) -> tuple:
+    """
+    Crops an encoded cut-out (RGBA) or mask (L) to the bounding box of its non-transparent pixels.
+    padding: extra transparent margin kept around the subject (clamped to the canvas).
+    Returns (png_bytes, offset) where offset = {x, y, width, height, original_width, original_height}
+    so the editor can place the trimmed result back on the original canvas.
+    """
+    img_pil = Image.open(io.BytesIO(image_bytes))
+    w, h = img_pil.size
+    if img_pil.mode == "L":
+        alpha = img_pil
+    elif img_pil.mode in ("RGBA", "LA", "PA") or "transparency" in img_pil.info:
+        alpha = img_pil.convert("RGBA").getchannel("A")
+    else:
+        alpha = None
+
+    bbox = alpha.getbbox() if alpha is not None else None
+    if bbox is None:
+        # Opaque (nothing to trim) or fully transparent (nothing to keep): return as is
+        return image_bytes, {"x": 0, "y": 0, "width": w, "height": h, "original_width": w, "original_height": h}
+
+    padding = max(0, padding)
+    left = max(0, bbox[0] - padding)
+    top = max(0, bbox[1] - padding)
+    right = min(w, bbox[2] + padding)
+    bottom = min(h, bbox[3] + padding)
+    offset = {"x": left, "y": top, "width": right - left, "height": bottom - top, "original_width": w, "original_height": h}
+
+    if (left, top, right, bottom) == (0, 0, w, h):
+        # Subject already touches every edge, skip the re-encode
+        return image_bytes, offset
+    return pil_to_bytes(img_pil.crop((left, top, right, bottom))), offset
+
+async def remove_background(image_bytes: bytes, output: str = "rgba", quality: str = None) -> bytes:
     """
     Removes background. Tries GPU service first, falls back to CPU (rembg).
+    output: 'rgba' returns the cut-out, 'mask' returns only the alpha matte.
+    quality: GPU worker model tier ('fast' for previews, 'high' for final exports; worker default if None).
+    The CPU fallback always uses u2net.
     """
+    if output not in BG_OUTPUT_MODES:
+        raise ValueError(f"Invalid output mode '{output}'. Expected one of {BG_OUTPUT_MODES}")
+    if quality is not None and quality not in BG_QUALITY_TIERS:
+        # The worker would reject it and the request would silently fall back to CPU u2net
+        raise ValueError(f"Invalid quality '{quality}'. Expected one of {BG_QUALITY_TIERS}")
+    only_mask = output == "mask"
+    megapixels = image_megapixels(image_bytes)
+
     if _should_use_gpu("remove-background"):
         try:
-            logger.info("🎨 Removing background via Cloud GPU...")
-            return await call_gpu_service("remove-background", image_bytes)
+            logger.info(f"🎨 Removing background via Cloud GPU (output={output}, quality={quality or 'default'})...")
+            params = {"output": output, **({"quality": quality} if quality else {})}
+            result = await call_gpu_service("remove-background", image_bytes, params=params, megapixels=megapixels)
+            if only_mask:
+                # Older workers ignore 'output' and always return RGBA
+                result = await asyncio.to_thread(alpha_to_mask_bytes, result)
+            return result
+        except GPUServiceUnavailable as e:
+            logger.info(f"⏭️ {e}. Using Local CPU.")
         except Exception as e:
             logger.error(f"❌ GPU BG Removal failed: {e}. Falling back to Local CPU.")
             pass
@@ -282,100 +545,244 @@ async def remove_background(image_bytes: bytes) -> bytes:
 
     from rembg import remove
     # Run blocking task in thread
-    output_bytes = await asyncio.to_thread(remove, image_bytes, session=_LOCAL_REMBG_SESSION)
+    started = time.monotonic()
+    output_bytes = await asyncio.to_thread(remove, image_bytes, session=_LOCAL_REMBG_SESSION, only_mask=only_mask)
+    # Feed the router's CPU estimate for this host
+    gpu_router.record_cpu("remove-background", megapixels, time.monotonic() - started)
     return output_bytes
 
 # ... (omitted unrelated code)
 
-from .database import SessionLocal
-from . import models
+from . import cpu_upscaler, onnx_upscaler, schemas
+from .services import task_queue
+from .services.result_store import result_store, result_key
+from .services.task_events import task_events
+
+@task_queue.handler("upscale")
+async def run_upscale_job(task_id: str, inputs: dict, params: dict) -> str:
+    """
+    Queued upscale (run by the task worker, see services/task_queue). Returns the result URL;
+    raising lets the queue retry the task with backoff.
+    """
+    image_bytes = inputs["image"]
+    spool_path = result_store.spool_path(result_key("upscale", task_id))
+    # CPU path streams straight into the spool file (the static file itself with local storage);
+    # progress goes to the task's SSE subscribers
+    progress = lambda stage, done=None, total=None: task_events.progress(task_id, stage, done, total)
+    try:
+        file_path = await upscale_image_to_file(image_bytes, spool_path, params["factor"], params["detail_boost"], progress)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(spool_path)
+        raise
+    # We return the static URL relative to /api/static
+    key = result_key("upscale", task_id, os.path.splitext(file_path)[1])
+    return await asyncio.to_thread(result_store.save_file, key, file_path)
 
-# Define static directory for processed results
-STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
-os.makedirs(STATIC_DIR, exist_ok=True)
+# 4. Aumentar Resolución (Upscaling)
+def _upscale_megapixels(image_bytes: bytes, factor) -> float:
+    # Upscale cost follows the output size
+    return image_megapixels(image_bytes) * factor * factor
 
-async def run_upscale_task(task_id: str, image_bytes: bytes, factor: float, detail_boost: float):
+async def _upscale_via_gpu(image_bytes: bytes, factor, detail_boost, as_job: bool = False):
     """
-    Background worker for upscaling task.
+    Tries the GPU service. Returns None when it is not configured or fails (caller falls back to CPU).
+    as_job: use the worker's job API when configured (no time limit), then the synchronous endpoint.
     """
-    db = SessionLocal()
+    if not _should_use_gpu("upscale"):
+        return None
+    if as_job and gpu_jobs.enabled():
+        try:
+            logger.info(f"🔍 Upscaling image x{factor} via Cloud GPU job")
+            return await call_gpu_job("upscale", image_bytes, params={"scale": factor})
+        except Exception as e:
+            logger.error(f"❌ GPU upscale job failed: {e}. Trying the synchronous GPU endpoint.")
     try:
-        # Perform work
-        result_bytes = await upscale_image(image_bytes, factor, detail_boost)
-        
-        # Save to static file
-        filename = f"upscale_{task_id}.png"
-        file_path = os.path.join(STATIC_DIR, filename)
-        with open(file_path, "wb") as f:
-            f.write(result_bytes)
-            
-        # Update DB
-        task = db.query(models.ProcessingTask).filter(models.ProcessingTask.id == task_id).first()
-        if task:
-            task.status = "COMPLETED"
-            # We return the static URL relative to /api/static
-            task.result_url = f"/api/static/{filename}"
-            db.commit()
-            
+        # Send both 'scale' and 'factor' to be safe, plus detail_boost
+        form_data = {
+            "scale": factor, 
+            "factor": factor,
+            "detail_boost": detail_boost
+        }
+        logger.info(f"🔍 Upscaling image x{factor} via Cloud GPU with params: {form_data}")
+        # The worker reads 'scale' from the query string and picks its 2x or 4x model from it
+        return await call_gpu_service("upscale", image_bytes, params={"scale": factor}, data=form_data,
+                                      megapixels=_upscale_megapixels(image_bytes, factor))
+    except GPUServiceUnavailable as e:
+        logger.info(f"⏭️ {e}. Using Local CPU.")
+        return None
     except Exception as e:
-        logger.error(f"Error in run_upscale_task for task {task_id}: {str(e)}")
-        task = db.query(models.ProcessingTask).filter(models.ProcessingTask.id == task_id).first()
-        if task:
-            task.status = "FAILED"
-            task.error = str(e)
-            db.commit()
-    finally:
-        db.close()
+        logger.error(f"❌ GPU Upscale failed: {e}. Falling back to Local CPU.")
+        return None
+
+async def _upscale_via_cpu_ai(image_bytes: bytes, factor, file_path: str = None, progress=None):
+    """
+    Tries Real-ESRGAN on the local CPU (ONNX Runtime, see onnx_upscaler) when CPU_AI_UPSCALE_MODEL
+    is set and the image fits its budget. Returns the PNG bytes (or file_path once written),
+    or None so the caller falls back to Lanczos. progress(done, total) counts tiles (file output only).
+    """
+    img_pil = read_image_file(image_bytes)
+    if not onnx_upscaler.accepts(img_pil, factor):
+        return None
+    logger.info(f"💻 Upscaling image x{factor} via Local CPU (ONNX Real-ESRGAN)...")
+    started = time.monotonic()
+    try:
+        if file_path:
+            await asyncio.to_thread(onnx_upscaler.upscale_to_file, img_pil, file_path, factor, progress)
+            result = file_path
+        else:
+            result = await asyncio.to_thread(onnx_upscaler.upscale_to_bytes, img_pil, factor)
+    except Exception as e:
+        logger.error(f"❌ CPU AI upscale failed: {e}. Falling back to Lanczos.")
+        return None
+    gpu_router.record_cpu("upscale", _upscale_megapixels(image_bytes, factor), time.monotonic() - started)
+    return result
 
-# 4. Aumentar Resolución (Upscaling)
 async def upscale_image(image_bytes: bytes, factor=2, detail_boost=1.5) -> bytes:
     """
     Upscales image using AI (Real-ESRGAN) via GPU Service.
-    Falls back to legacy Lanczos if GPU_UPSCALE_URL is not set.
+    Falls back to Real-ESRGAN on the local CPU (ONNX, if configured), then to the
+    band-parallel CPU engine (Lanczos).
     """
-    if _should_use_gpu("upscale"):
-        try:
-            logger.info(f"🔍 Upscaling image x{factor} via Cloud GPU...")
-            # Send both 'scale' and 'factor' to be safe, plus detail_boost
-            form_data = {
-                "scale": factor, 
-                "factor": factor,
-                "detail_boost": detail_boost
-            }
-            logger.info(f"🔍 Upscaling image x{factor} via Cloud GPU with params: {form_data}")
-            return await call_gpu_service("upscale", image_bytes, data=form_data)
-        except Exception as e:
-            logger.error(f"❌ GPU Upscale failed: {e}. Falling back to Local CPU.")
-            # Fallback to local (CPU)
-            pass
+    result = await _upscale_via_gpu(image_bytes, factor, detail_boost)
+    if result is not None:
+        return result
+
+    result = await _upscale_via_cpu_ai(image_bytes, factor)
+    if result is not None:
+        return result
             
     # Legacy Fallback (CPU)
     logger.info(f"💻 Upscaling image x{factor} via Local CPU (Lanczos)...")
-    return await asyncio.to_thread(upscale_image_legacy, image_bytes, factor, detail_boost)
+    started = time.monotonic()
+    result = await asyncio.to_thread(upscale_image_legacy, image_bytes, factor, detail_boost)
+    gpu_router.record_cpu("upscale", _upscale_megapixels(image_bytes, factor), time.monotonic() - started)
+    return result
+
+async def upscale_image_to_file(image_bytes: bytes, file_path: str, factor=2, detail_boost=1.5, progress=None) -> str:
+    """
+    Same as upscale_image but writes the PNG to file_path.
+    The CPU fallback streams output bands to disk, so the full result is never held in memory.
+    Returns the path written: a WebP result from the GPU worker gets a .webp extension.
+    Runs as a GPU job (see call_gpu_job): background tasks can wait for large upscales.
+    progress(stage, done, total): 'gpu' (no counts), 'cpu-ai' tiles or 'cpu' bands; called from threads.
+    """
+    report = progress or (lambda stage, done=None, total=None: None)
+    if _should_use_gpu("upscale"):
+        report("gpu")
+    result = await _upscale_via_gpu(image_bytes, factor, detail_boost, as_job=True)
+    if result is not None:
+        if image_media_type(result) == "image/webp":
+            file_path = os.path.splitext(file_path)[0] + ".webp"
+        with open(file_path, "wb") as f:
+            f.write(result)
+        return file_path
+
+    if await _upscale_via_cpu_ai(image_bytes, factor, file_path, lambda done, total: report("cpu-ai", done, total)) is not None:
+        return file_path
+
+    logger.info(f"💻 Upscaling image x{factor} via Local CPU (Lanczos, streaming)...")
+    img_pil = read_image_file(image_bytes)
+    started = time.monotonic()
+    await asyncio.to_thread(cpu_upscaler.upscale_to_file, img_pil, file_path, factor, detail_boost,
+                            lambda done, total: report("cpu", done, total))
+    gpu_router.record_cpu("upscale", _upscale_megapixels(image_bytes, factor), time.monotonic() - started)
+    return file_path
 
 def upscale_image_legacy(image_bytes: bytes, factor=2, detail_boost=1.5) -> bytes:
-    """Legacy CPU upscaling using Lanczos."""
+    """Legacy CPU upscaling using Lanczos (band-parallel, see cpu_upscaler)."""
     img_pil = read_image_file(image_bytes)
-    width, height = img_pil.size
-    MAX_DIMENSION = 10000
-    
-    new_width = int(width * factor)
-    new_height = int(height * factor)
-    
-    if new_width > MAX_DIMENSION or new_height > MAX_DIMENSION:
-        raise ValueError(f"Upscale factor too large. Resulting image would exceed {MAX_DIMENSION}x{MAX_DIMENSION} pixels.")
-    
-    if width < 1000:
-        img_pil = img_pil.filter(ImageFilter.MedianFilter(size=3))
+    return cpu_upscaler.upscale_to_bytes(img_pil, factor, detail_boost)
 
-    res_pil = img_pil.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    
-    if detail_boost > 0:
-        radius = 1 + (factor / 4)
-        percent = int(100 * detail_boost)
-        res_pil = res_pil.filter(ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=3))
-    
-    return pil_to_bytes(res_pil)
+# Paleta de Tintas (Separación para Serigrafía)
+PALETTE_LUT_BITS = 5  # 32 levels per channel -> 32768-entry nearest-centroid table
+
+def _nearest_centroid(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """Index of the closest center for each point (squared Euclidean, vectorized)."""
+    d = (points * points).sum(1)[:, None] - 2.0 * points @ centers.T + (centers * centers).sum(1)[None, :]
+    return np.argmin(d, axis=1)
+
+def _kmeans_pp_init(sample: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    centers = [sample[rng.integers(len(sample))]]
+    closest = ((sample - centers[0]) ** 2).sum(1)
+    for _ in range(1, k):
+        total = closest.sum()
+        if total <= 0:
+            break
+        centers.append(sample[rng.choice(len(sample), p=closest / total)])
+        closest = np.minimum(closest, ((sample - centers[-1]) ** 2).sum(1))
+    return np.array(centers, dtype=np.float64)
+
+def extract_palette(image_bytes: bytes, n_colors: int = 6, sample_size: int = 20000,
+                    batch_size: int = 2048, iterations: int = 30, alpha_threshold: int = 10) -> dict:
+    """
+    Extracts the dominant N ink colors of a design for screen-print separation.
+    1. Mini-batch k-means (k-means++ init) on a random subsample of opaque pixels,
+       finished with one exact Lloyd step on the sample.
+    2. Every pixel is assigned through a quantized RGB lookup table of nearest centroids
+       (one vectorized pass over a 32^3 histogram instead of per-pixel distances).
+    Returns {"colors": [[r, g, b], ...], "coverage": [...]} sorted by coverage; 'colors'
+    plugs straight into the 'colors' parameter of /api/halftone and /api/remove-background.
+    """
+    if n_colors < 1:
+        raise ValueError("n_colors must be at least 1")
+
+    img_pil = read_image_file(image_bytes)
+    data = np.asarray(img_pil)
+    rgb = data[:, :, :3].reshape(-1, 3)
+    if data.shape[2] == 4:
+        rgb = rgb[data[:, :, 3].reshape(-1) > alpha_threshold]
+    if len(rgb) == 0:
+        return {"colors": [], "coverage": []}
+
+    rng = np.random.default_rng(0)
+    sample_idx = rng.choice(len(rgb), size=min(sample_size, len(rgb)), replace=False)
+    sample = rgb[sample_idx].astype(np.float64)
+    k = min(n_colors, len(np.unique(sample, axis=0)))
+
+    # 1. Mini-batch k-means (Sculley): per-center learning rate 1 / points seen
+    centers = _kmeans_pp_init(sample, k, rng)
+    k = len(centers)
+    seen = np.zeros(k)
+    for _ in range(iterations):
+        batch = sample[rng.integers(len(sample), size=min(batch_size, len(sample)))]
+        labels = _nearest_centroid(batch, centers)
+        counts = np.bincount(labels, minlength=k).astype(np.float64)
+        active = counts > 0
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, batch)
+        seen += counts
+        rate = np.where(active, counts / np.maximum(seen, 1), 0)[:, None]
+        means = sums / np.maximum(counts, 1)[:, None]
+        centers += rate * (means - centers)
+
+    # 2. Final Lloyd step on the exact sample colors (cheap, removes mini-batch jitter)
+    labels = _nearest_centroid(sample, centers)
+    counts = np.bincount(labels, minlength=k)
+    sums = np.zeros_like(centers)
+    np.add.at(sums, labels, sample)
+    nonempty = counts > 0
+    centers[nonempty] = sums[nonempty] / counts[nonempty, None]
+
+    # 3. Assign every pixel through a nearest-centroid LUT over the quantized RGB cube
+    shift = 8 - PALETTE_LUT_BITS
+    q = rgb >> shift
+    bins = (q[:, 0].astype(np.uint16) << (2 * PALETTE_LUT_BITS)) | (q[:, 1].astype(np.uint16) << PALETTE_LUT_BITS) | q[:, 2]
+    hist = np.bincount(bins, minlength=1 << (3 * PALETTE_LUT_BITS)).astype(np.float64)
+    occupied = np.nonzero(hist)[0]
+    bin_centers = np.stack([
+        (occupied >> (2 * PALETTE_LUT_BITS)) & ((1 << PALETTE_LUT_BITS) - 1),
+        (occupied >> PALETTE_LUT_BITS) & ((1 << PALETTE_LUT_BITS) - 1),
+        occupied & ((1 << PALETTE_LUT_BITS) - 1),
+    ], axis=1).astype(np.float64) * (1 << shift) + (1 << shift) / 2
+    lut = _nearest_centroid(bin_centers, centers)
+    coverage = np.bincount(lut, weights=hist[occupied], minlength=k) / len(rgb)
+
+    order = [i for i in np.argsort(-coverage) if coverage[i] > 0]
+    return {
+        "colors": [[int(v) for v in np.clip(np.round(centers[i]), 0, 255)] for i in order],
+        "coverage": [round(float(coverage[i]), 4) for i in order],
+    }
 
 def generate_halftone(image_bytes: bytes, dot_size: int = 10, scale: float = 1.0, remove_colors: list = None, tolerance: int = 30, spacing: int = 0) -> bytes:
     """
@@ -463,7 +870,8 @@ def generate_halftone(image_bytes: bytes, dot_size: int = 10, scale: float = 1.0
 async def contour_clip(image_bytes: bytes, mask_bytes: bytes = None, mode: str = 'manual', refine: bool = False, colors: list = None, tolerance: int = 30) -> bytes:
     """
     Advanced Contour Clipping (GrabCut or Automatic).
-    - If mode == 'manual', uses user strokes as 'Definite Foreground'.
+    - If mode == 'manual', uses user strokes as 'Definite Foreground'
+      (mask_bytes: PNG bytes or a VectorMask).
     - If mode == 'auto', uses 'rembg' (via GPU service if avail) (with optional color hints).
     - If refine == True, uses GrabCut snapped refinement.
     """
@@ -473,16 +881,18 @@ async def contour_clip(image_bytes: bytes, mask_bytes: bytes = None, mode: str =
 
     if mode == 'auto':
         # 1. Get initial mask from rembg (Use our async wrapper which tries GPU)
-        rembg_res = await remove_background(image_bytes)
+        # Mask-only output: we already hold the original, no need to round-trip the RGBA cut-out
+        mask_res = await remove_background(image_bytes, output="mask")
         
-        rembg_pil = Image.open(io.BytesIO(rembg_res)).convert("L")
+        rembg_pil = Image.open(io.BytesIO(mask_res)).convert("L")
         rembg_mask = np.array(rembg_pil)
         
         if rembg_mask.shape[:2] != (h, w):
             rembg_mask = cv2.resize(rembg_mask, (w, h), interpolation=cv2.INTER_NEAREST)
             
         if not colors:
-            return rembg_res
+            img_rgba = np.dstack([np.array(img_pil), rembg_mask])
+            return pil_to_bytes(Image.fromarray(img_rgba))
 
         # 2. Hybrid Mode: Refine rembg mask with specific color hints
         # Create GrabCut mask from rembg mask
@@ -504,10 +914,7 @@ async def contour_clip(image_bytes: bytes, mask_bytes: bytes = None, mode: str =
         if not mask_bytes:
             return await remove_background(image_bytes)
 
-        mask_pil = read_image_file(mask_bytes).convert("L")
-        mask_cv = np.array(mask_pil)
-        if mask_cv.shape[:2] != (h, w):
-            mask_cv = cv2.resize(mask_cv, (w, h), interpolation=cv2.INTER_NEAREST)
+        mask_cv = load_mask(mask_bytes, w, h)
         _, mask_binary = cv2.threshold(mask_cv, 127, 255, cv2.THRESH_BINARY)
         
         if np.sum(mask_binary) == 0:
@@ -644,3 +1051,62 @@ def apply_watermark(base_bytes: bytes, watermark_bytes: bytes, x: int, y: int, s
     combined_img = Image.alpha_composite(base_img, transparent_layer)
     
     return pil_to_bytes(combined_img)
+
+# Modo Asíncrono (async=true en los endpoints pesados)
+# The endpoint queues {"image": ..., "mask": ...} plus its form fields; a task worker runs the same
+# code as the synchronous path and stores the result in static storage like run_upscale_job.
+async def run_remove_objects(image_bytes: bytes, mask, x: int = None, y: int = None, tolerance: int = 30) -> bytes:
+    """Inpaints the masked area, or the flood-filled region around (x, y) when no mask is given."""
+    if mask is None:
+        mask = await asyncio.to_thread(create_mask_from_point, image_bytes, x, y, tolerance)
+    return await asyncio.to_thread(remove_objects, image_bytes, mask)
+
+async def run_remove_background(image_bytes: bytes, mask=None, colors: list = None, threshold: int = 30,
+                                refine: bool = False, output: str = "rgba", quality: str = None) -> bytes:
+    """The three /remove-background modes: manual mask (PNG or VectorMask), specific colors, automatic."""
+    if mask is not None:
+        # A VectorMask is rasterized straight into the alpha mask (see load_mask)
+        result = await asyncio.to_thread(remove_background_with_mask, image_bytes, mask, refine)
+        if output == "mask":
+            result = await asyncio.to_thread(alpha_to_mask_bytes, result)
+        return result
+    if colors:
+        try:
+            return await asyncio.to_thread(remove_specific_colors, image_bytes, colors, threshold, output)
+        except Exception as e:
+            raise ValueError(f"Invalid color format: {str(e)}")
+    return await remove_background(image_bytes, output=output, quality=quality)
+
+def _task_mask(inputs: dict, params: dict):
+    if "mask" in inputs:
+        return inputs["mask"]
+    if params.get("mask_vector"):
+        return schemas.VectorMask.model_validate(params["mask_vector"])
+    return None
+
+def save_result(kind: str, task_id: str, result: bytes) -> str:
+    """Writes a task result to the result store (see services/result_store); returns its URL."""
+    extension = ".webp" if image_media_type(result) == "image/webp" else ".png"
+    return result_store.save(result_key(kind, task_id, extension), result)
+
+def _result_task(kind: str, compute):
+    """Queued variant of an endpoint: compute(inputs, params) -> image bytes, auto_trim applied like _png_response."""
+    @task_queue.handler(kind)
+    async def run(task_id: str, inputs: dict, params: dict):
+        result = await compute(inputs, params)
+        offset = None
+        if params.get("auto_trim"):
+            result, offset = await asyncio.to_thread(trim_to_alpha, result, params.get("trim_padding", 0))
+        return await asyncio.to_thread(save_result, kind, task_id, result), offset
+    return run
+
+_result_task("remove-objects", lambda inputs, params: run_remove_objects(
+    inputs["image"], _task_mask(inputs, params), params.get("x"), params.get("y"), params["tolerance"]))
+_result_task("remove-background", lambda inputs, params: run_remove_background(
+    inputs["image"], _task_mask(inputs, params), params.get("colors"), params["threshold"], params["refine"],
+    params["output"], params.get("quality")))
+_result_task("contour-clip", lambda inputs, params: contour_clip(
+    inputs["image"], _task_mask(inputs, params), params["mode"], params["refine"], params.get("colors"), params["threshold"]))
+_result_task("halftone", lambda inputs, params: asyncio.to_thread(
+    generate_halftone, inputs["image"], params["dot_size"], params["scale"], params.get("colors"),
+    params["threshold"], params["spacing"]))
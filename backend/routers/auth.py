@@ -14,7 +14,7 @@ router = APIRouter(
 )
 
 # Determine static directory relative to this file
-STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static")
+STATIC_DIR = os.getenv("STATIC_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static"))
 os.makedirs(STATIC_DIR, exist_ok=True)
 
 @router.post("/register")
@@ -1,53 +1,111 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Response, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Response
+from fastapi.responses import StreamingResponse, FileResponse, RedirectResponse
 from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-import uuid
+import os
+import asyncio
+import json
+import time
 
 from typing import Optional
 from .. import models, processing, schemas
-from ..deps import get_approved_user, get_db
+from ..deps import get_approved_user, get_admin_user, get_db
+from ..services.gpu_router import gpu_router
+from ..services.gpu_warmer import gpu_warmer
+from ..services import task_queue
+from ..services.task_events import task_events, TASK_EVENTS_KEEPALIVE, TASK_EVENTS_RECHECK
+from ..services.retention import result_sweeper
+from ..services.result_store import result_store, RESULT_NAME
 
 router = APIRouter(
     prefix="/api",
     tags=["processing"]
 )
 
+def _parse_vector_mask(mask_vector: Optional[str]) -> Optional[schemas.VectorMask]:
+    """Parses the JSON 'mask_vector' form field (brush strokes or RLE) into a VectorMask."""
+    if not mask_vector:
+        return None
+    try:
+        vector_mask = schemas.VectorMask.model_validate_json(mask_vector)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid mask_vector format: {str(e)}")
+    if vector_mask.strokes is None and vector_mask.rle is None:
+        raise HTTPException(status_code=400, detail="mask_vector requires 'strokes' or 'rle'")
+    try:
+        processing.validate_vector_mask(vector_mask)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=f"Invalid mask_vector: {str(ve)}")
+    return vector_mask
+
+async def _png_response(result: bytes, auto_trim: bool = False, trim_padding: int = 0) -> Response:
+    """
+    Builds the PNG response. With auto_trim the result is cropped to its alpha bounding box
+    and the crop offset is returned in X-Trim-* headers so the editor can reposition it.
+    """
+    if not auto_trim:
+        # GPU results may come back as lossless WebP (GPU_RESULT_FORMAT)
+        return Response(content=result, media_type=processing.image_media_type(result))
+    trimmed, offset = await run_in_threadpool(processing.trim_to_alpha, result, trim_padding)
+    headers = {
+        "X-Trim-X": str(offset["x"]),
+        "X-Trim-Y": str(offset["y"]),
+        "X-Original-Width": str(offset["original_width"]),
+        "X-Original-Height": str(offset["original_height"]),
+    }
+    # Nothing to trim returns the result untouched (possibly WebP)
+    return Response(content=trimmed, media_type=processing.image_media_type(trimmed), headers=headers)
+
+async def _enqueue_task(db: Session, kind: str, image_bytes: bytes, mask_bytes: Optional[bytes], params: dict) -> dict:
+    """
+    async=true: queues the work (processing 'Modo Asíncrono') and returns a TaskResponse right away.
+    The result lands in static storage; follow /processing/tasks/{task_id}(/events).
+    Identical submissions still in flight get the same task_id.
+    """
+    inputs = {"image": image_bytes}
+    if mask_bytes is not None:
+        inputs["mask"] = mask_bytes
+    task_id = await run_in_threadpool(task_queue.enqueue, db, kind, inputs, params)
+    return {"task_id": task_id}
+
 @router.post("/remove-objects")
 async def api_remove_objects(
     image: UploadFile = File(...),
     mask: Optional[UploadFile] = File(None),
+    mask_vector: Optional[str] = Form(None),
     x: Optional[int] = Form(None),
     y: Optional[int] = Form(None),
     tolerance: int = Form(30),
-    user: models.User = Depends(get_approved_user)
+    run_async: bool = Form(False, alias="async"),
+    user: models.User = Depends(get_approved_user),
+    db: Session = Depends(get_db)
 ):
     """
     Remove objects from image using one of two modes:
-    1. Manual mask mode: Provide 'mask' file (from canvas drawing)
+    1. Manual mask mode: Provide 'mask' file (from canvas drawing) or 'mask_vector'
+       (JSON brush strokes / RLE, rasterized server-side at image resolution)
     2. Flood fill mode: Provide 'x' and 'y' coordinates (magic wand)
+    async: return a task_id instead of the image (see _enqueue_task).
     """
+    vector_mask = _parse_vector_mask(mask_vector)
+    if mask is None and vector_mask is None and (x is None or y is None):
+        raise HTTPException(
+            status_code=400, 
+            detail="Either 'mask' file, 'mask_vector' or both 'x' and 'y' coordinates must be provided"
+        )
     try:
         image_bytes = await image.read()
-        
-        # Mode 1: Manual mask provided
-        if mask is not None:
-            mask_bytes = await mask.read()
-            result = await run_in_threadpool(processing.remove_objects, image_bytes, mask_bytes)
-            return Response(content=result, media_type="image/png")
-        
-        # Mode 2: Coordinates provided (flood fill)
-        elif x is not None and y is not None:
-            # Generate mask from point
-            mask_bytes = await run_in_threadpool(processing.create_mask_from_point, image_bytes, x, y, tolerance)
-            # Apply inpainting with generated mask
-            result = await run_in_threadpool(processing.remove_objects, image_bytes, mask_bytes)
-            return Response(content=result, media_type="image/png")
-        
-        else:
-            raise HTTPException(
-                status_code=400, 
-                detail="Either 'mask' file or both 'x' and 'y' coordinates must be provided"
-            )
+        mask_bytes = await mask.read() if mask is not None else None
+
+        if run_async:
+            params = {"x": x, "y": y, "tolerance": tolerance,
+                      "mask_vector": vector_mask.model_dump() if vector_mask is not None else None}
+            return await _enqueue_task(db, "remove-objects", image_bytes, mask_bytes, params)
+
+        # Mode 1: manual mask (file or vector); Mode 2: flood fill from (x, y)
+        mask_input = mask_bytes if mask_bytes is not None else vector_mask
+        result = await processing.run_remove_objects(image_bytes, mask_input, x, y, tolerance)
+        return Response(content=result, media_type="image/png")
             
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
@@ -58,36 +116,57 @@ async def api_remove_objects(
 async def api_remove_background(
     image: UploadFile = File(...),
     mask: Optional[UploadFile] = File(None),
+    mask_vector: Optional[str] = Form(None),
     colors: Optional[str] = Form(None),
     threshold: int = Form(30),
     refine: bool = Form(False),
-    user: models.User = Depends(get_approved_user)
+    output: str = Form("rgba"),
+    auto_trim: bool = Form(False),
+    trim_padding: int = Form(0),
+    quality: Optional[str] = Form(None),
+    run_async: bool = Form(False, alias="async"),
+    user: models.User = Depends(get_approved_user),
+    db: Session = Depends(get_db)
 ):
+    """
+    output: 'rgba' returns the cut-out image, 'mask' returns only the single-channel alpha
+    so the client can apply it to the original it already holds.
+    auto_trim: crop the result to the subject (+ trim_padding), offset returned in X-Trim-* headers
+    (in the task's result_meta with async).
+    mask_vector: JSON brush strokes / RLE, alternative to the full-resolution 'mask' PNG.
+    quality: automatic mode model tier on the GPU worker ('fast' previews ... 'high' final exports).
+    async: return a task_id instead of the image (see _enqueue_task).
+    """
+    if output not in processing.BG_OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid output mode. Expected one of {processing.BG_OUTPUT_MODES}")
+    if quality is not None and quality not in processing.BG_QUALITY_TIERS:
+        raise HTTPException(status_code=400, detail=f"Invalid quality. Expected one of {processing.BG_QUALITY_TIERS}")
+    vector_mask = _parse_vector_mask(mask_vector)
+
+    # Mode 2 (specific colors): expecting a JSON string of list of lists/tuples, e.g. "[[255, 0, 0]]"
+    colors_list = None
+    if colors and mask is None and vector_mask is None:
+        try:
+            colors_list = json.loads(colors)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid color format: {str(e)}")
+
     try:
         image_bytes = await image.read()
-        
-        # Mode 1: Manual mask provided
-        if mask is not None:
-            mask_bytes = await mask.read()
-            result = await run_in_threadpool(processing.remove_background_with_mask, image_bytes, mask_bytes, refine)
-            return Response(content=result, media_type="image/png")
-            
-        # Mode 2: Specific colors provided
-        elif colors:
-            import json
-            # Expecting colors as a JSON string of list of lists/tuples, e.g. "[[255, 0, 0]]"
-            try:
-                colors_list = json.loads(colors)
-                result = await run_in_threadpool(processing.remove_specific_colors, image_bytes, colors_list, threshold)
-            except Exception as e:
-                 raise HTTPException(status_code=400, detail=f"Invalid color format: {str(e)}")
-        
-        # Mode 3: Automatic background removal (rembg)
-        else:
-            # Auto mode calls remove_background which is async
-            result = await processing.remove_background(image_bytes)
-            
-        return Response(content=result, media_type="image/png")
+        mask_bytes = await mask.read() if mask is not None else None
+
+        if run_async:
+            params = {"colors": colors_list, "threshold": threshold, "refine": refine, "output": output,
+                      "quality": quality, "auto_trim": auto_trim, "trim_padding": trim_padding,
+                      "mask_vector": vector_mask.model_dump() if vector_mask is not None else None}
+            return await _enqueue_task(db, "remove-background", image_bytes, mask_bytes, params)
+
+        # Mode 1: manual mask; Mode 2: specific colors; Mode 3: automatic (rembg, GPU first)
+        mask_input = mask_bytes if mask_bytes is not None else vector_mask
+        result = await processing.run_remove_background(image_bytes, mask_input, colors_list, threshold, refine, output, quality)
+        return await _png_response(result, auto_trim, trim_padding)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -108,7 +187,6 @@ async def api_enhance_quality(
 
 @router.post("/upscale", response_model=schemas.TaskResponse)
 async def api_upscale(
-    background_tasks: BackgroundTasks,
     image: UploadFile = File(...), 
     factor: float = Form(2.0),
     detail_boost: float = Form(1.5),
@@ -119,27 +197,46 @@ async def api_upscale(
         if factor <= 0:
             raise HTTPException(status_code=400, detail="Upscale factor must be greater than 0")
             
-        task_id = str(uuid.uuid4())
         image_bytes = await image.read()
         
-        # Create task in DB
-        task = models.ProcessingTask(id=task_id, status="PENDING")
-        db.add(task)
-        db.commit()
-        
-        # Start background task
-        background_tasks.add_task(
-            processing.run_upscale_task, 
-            task_id, 
-            image_bytes, 
-            factor, 
-            detail_boost
+        # Queue the job; a task worker runs it (outside the web process in production)
+        task_id = await run_in_threadpool(
+            task_queue.enqueue, db, "upscale", {"image": image_bytes},
+            {"factor": factor, "detail_boost": detail_boost}
         )
         
         return {"task_id": task_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/processing/router-metrics")
+async def get_router_metrics(user: models.User = Depends(get_admin_user)):
+    """GPU/CPU routing decisions, hedges and per-backend load/latency estimates."""
+    return gpu_router.metrics()
+
+@router.post("/processing/warmup")
+async def warmup_gpu(reason: str = "editor", user: models.User = Depends(get_approved_user)):
+    """
+    Called by the editor when it opens or an image is loaded, so the GPU worker is
+    (likely) warm by the time the user runs a heavy operation. Returns immediately.
+    """
+    return {"enabled": gpu_warmer.enabled, "warming": gpu_warmer.touch(reason)}
+
+@router.get("/processing/warmer-metrics")
+async def get_warmer_metrics(user: models.User = Depends(get_admin_user)):
+    """Warm-up pings, cold-start rate (pings and real requests) and estimated warm-keeping cost."""
+    return gpu_warmer.metrics()
+
+@router.get("/processing/queue-metrics")
+async def get_queue_metrics(user: models.User = Depends(get_admin_user)):
+    """Queued processing tasks by status, oldest due job and this process's embedded worker (if any)."""
+    return await run_in_threadpool(task_queue.metrics)
+
+@router.get("/processing/retention-metrics")
+async def get_retention_metrics(user: models.User = Depends(get_admin_user)):
+    """Result storage in use, TTLs and size cap, last sweep and bytes/rows reclaimed so far."""
+    return result_sweeper.metrics()
+
 @router.get("/processing/tasks/{task_id}", response_model=schemas.TaskStatus)
 async def get_task_status(task_id: str, db: Session = Depends(get_db)):
     task = db.query(models.ProcessingTask).filter(models.ProcessingTask.id == task_id).first()
@@ -147,6 +244,76 @@ async def get_task_status(task_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _task_event_stream(task_id: str):
+    """'status' events on every change and 'progress' events while running; ends with the task."""
+    # Subscribed only once the response streams (a client gone before that leaves nothing behind),
+    # and before reading the task so no change can slip in between
+    queue = task_events.subscribe(task_id)
+    try:
+        current = await run_in_threadpool(task_queue.get_status, task_id)
+        if current is None:
+            return
+        yield _sse("status", current)
+        last_check = time.monotonic()
+        while current["status"] not in ("COMPLETED", "FAILED"):
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=TASK_EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                event = None
+            if event is not None and "stage" in event:
+                yield _sse("progress", event)
+                continue
+            if event is not None:
+                current = {**current, "result_url": None, "error": None, **event}
+                yield _sse("status", current)
+                continue
+            if time.monotonic() - last_check >= TASK_EVENTS_RECHECK:
+                # Safety net for events lost between processes
+                last_check = time.monotonic()
+                latest = await run_in_threadpool(task_queue.get_status, task_id)
+                if latest is not None and latest["status"] != current["status"]:
+                    current = latest
+                    yield _sse("status", current)
+                    continue
+            yield ": keepalive\n\n"
+    finally:
+        task_events.unsubscribe(task_id, queue)
+
+@router.get("/processing/tasks/{task_id}/events")
+async def stream_task_status(task_id: str):
+    """
+    Server-Sent Events for one task: the current status first, then pushed status changes and
+    progress (GPU stage, CPU tiles/bands) until it completes or fails. Replaces polling.
+    """
+    if await run_in_threadpool(task_queue.get_status, task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return StreamingResponse(
+        _task_event_stream(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/static/results/{shard}/{name}", include_in_schema=False)
+async def get_result(shard: str, name: str):
+    """
+    Task result (a task's result_url). Local storage serves the file; object storage redirects to a
+    short-lived presigned URL, so downloads do not go through this process. Registered before the
+    /api/static mount, which still serves avatars and results written before sharding.
+    """
+    match = RESULT_NAME.match(name)
+    if match is None or match["task_id"][:2] != shard:
+        raise HTTPException(status_code=404, detail="Result not found")
+    key = f"results/{shard}/{name}"
+    if result_store.name == "s3":
+        return RedirectResponse(result_store.download_url(key), status_code=307)
+    path = result_store.path(key)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Result not found")
+    return FileResponse(path, media_type="image/webp" if name.endswith(".webp") else "image/png")
+
 @router.post("/halftone")
 async def api_halftone(
     image: UploadFile = File(...),
@@ -155,7 +322,9 @@ async def api_halftone(
     colors: Optional[str] = Form(None),
     threshold: int = Form(30),
     spacing: int = Form(0),
-    user: models.User = Depends(get_approved_user)
+    run_async: bool = Form(False, alias="async"),
+    user: models.User = Depends(get_approved_user),
+    db: Session = Depends(get_db)
 ):
     try:
         image_bytes = await image.read()
@@ -167,6 +336,10 @@ async def api_halftone(
                 colors_list = json.loads(colors)
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Invalid color format: {str(e)}")
+
+        if run_async:
+            params = {"dot_size": dot_size, "scale": scale, "colors": colors_list, "threshold": threshold, "spacing": spacing}
+            return await _enqueue_task(db, "halftone", image_bytes, None, params)
         
         result = await run_in_threadpool(
             processing.generate_halftone,
@@ -181,19 +354,45 @@ async def api_halftone(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/palette", response_model=schemas.PaletteResponse)
+async def api_palette(
+    image: UploadFile = File(...),
+    n_colors: int = Form(6),
+    user: models.User = Depends(get_approved_user)
+):
+    """
+    Extracts the dominant ink colors of a design. The returned 'colors' can be sent
+    as-is (JSON) in the 'colors' field of /api/halftone and /api/remove-background.
+    """
+    if n_colors < 1 or n_colors > 32:
+        raise HTTPException(status_code=400, detail="n_colors must be between 1 and 32")
+    try:
+        image_bytes = await image.read()
+        return await run_in_threadpool(processing.extract_palette, image_bytes, n_colors)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/contour-clip")
 async def api_contour_clip(
     image: UploadFile = File(...),
     mask: Optional[UploadFile] = File(None),
+    mask_vector: Optional[str] = Form(None),
     mode: str = Form('manual'),
     refine: bool = Form(False),
     colors: Optional[str] = Form(None),
     threshold: int = Form(30),
-    user: models.User = Depends(get_approved_user)
+    auto_trim: bool = Form(False),
+    trim_padding: int = Form(0),
+    run_async: bool = Form(False, alias="async"),
+    user: models.User = Depends(get_approved_user),
+    db: Session = Depends(get_db)
 ):
+    vector_mask = _parse_vector_mask(mask_vector)
     try:
         image_bytes = await image.read()
-        mask_bytes = None
+        mask_bytes = vector_mask
         if mask:
             mask_bytes = await mask.read()
             
@@ -204,10 +403,21 @@ async def api_contour_clip(
                 colors_list = json.loads(colors)
             except Exception as e:
                 raise HTTPException(status_code=400, detail=f"Invalid color format: {str(e)}")
+
+        if run_async:
+            params = {"mode": mode, "refine": refine, "colors": colors_list, "threshold": threshold,
+                      "auto_trim": auto_trim, "trim_padding": trim_padding,
+                      "mask_vector": vector_mask.model_dump() if vector_mask is not None else None}
+            file_mask = mask_bytes if isinstance(mask_bytes, bytes) else None
+            return await _enqueue_task(db, "contour-clip", image_bytes, file_mask, params)
             
         # contour_clip is now async
         result = await processing.contour_clip(image_bytes, mask_bytes, mode, refine, colors_list, threshold)
-        return Response(content=result, media_type="image/png")
+        return await _png_response(result, auto_trim, trim_padding)
+    except HTTPException:
+        raise
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 @router.post("/watermark")
@@ -224,7 +224,27 @@ class TaskStatus(BaseModel):
     id: str
     status: str
     result_url: Optional[str] = None
+    result_meta: Optional[dict] = None  # auto_trim offset: {"x", "y", "width", "height", "original_width", "original_height"}
     error: Optional[str] = None
 
     class Config:
         from_attributes = True
+
+# --- Vector Masks ---
+# Compact alternative to uploading a full-resolution PNG mask.
+# Coordinates are in the drawing canvas space (width x height); the server rescales to the image.
+class MaskStroke(BaseModel):
+    points: List[List[float]]  # Polyline [[x, y], ...]
+    width: float = 20.0        # Brush diameter in canvas pixels
+
+class VectorMask(BaseModel):
+    width: int
+    height: int
+    strokes: Optional[List[MaskStroke]] = None
+    # Row-major run-length encoding, alternating runs starting with background (0)
+    rle: Optional[List[int]] = None
+
+# --- Palette ---
+class PaletteResponse(BaseModel):
+    colors: List[List[int]]  # [[r, g, b], ...] ready for the 'colors' form field
+    coverage: List[float]    # Fraction of opaque pixels assigned to each color
@@ -0,0 +1,293 @@
+import os
+import time
+import random
+import asyncio
+import importlib.util
+import logging
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# GPU Client Configuration
+GPU_CONNECT_TIMEOUT = float(os.getenv("GPU_CONNECT_TIMEOUT", "5"))
+GPU_READ_TIMEOUT = float(os.getenv("GPU_READ_TIMEOUT", "60"))  # Covers Modal cold starts
+GPU_MAX_RETRIES = int(os.getenv("GPU_MAX_RETRIES", "2"))
+GPU_RETRY_BASE_DELAY = float(os.getenv("GPU_RETRY_BASE_DELAY", "0.5"))
+GPU_MAX_CONNECTIONS = int(os.getenv("GPU_MAX_CONNECTIONS", "20"))
+# Circuit breaker: open after N consecutive failures, probe /health while open
+GPU_BREAKER_THRESHOLD = int(os.getenv("GPU_BREAKER_THRESHOLD", "3"))
+GPU_BREAKER_RESET = float(os.getenv("GPU_BREAKER_RESET", "30"))
+GPU_HEALTH_INTERVAL = float(os.getenv("GPU_HEALTH_INTERVAL", "15"))
+# Inputs recently uploaded to an endpoint are re-sent by hash only (worker keeps an input cache)
+GPU_HASH_REUSE = os.getenv("GPU_HASH_REUSE", "true").lower() == "true"
+GPU_HASH_TTL = float(os.getenv("GPU_HASH_TTL", "300"))  # ~ container scaledown window
+GPU_HASH_MAX_ENTRIES = int(os.getenv("GPU_HASH_MAX_ENTRIES", "1000"))
+
+# Only failures that happen before the worker got the request are retried. A read timeout
+# already cost GPU_READ_TIMEOUT: retrying it would multiply the wait before the CPU fallback.
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class GPUServiceUnavailable(Exception):
+    """Raised without touching the network when the circuit for an endpoint is open."""
+
+
+class GPUServiceBusy(GPUServiceUnavailable):
+    """The worker shed load (503 + Retry-After): healthy, but don't send it work for a while."""
+
+    def __init__(self, url: str, retry_after: float):
+        super().__init__(f"GPU worker busy at {url} (retry after {retry_after:.0f}s)")
+        self.url = url
+        self.retry_after = retry_after
+
+
+class GPUServiceError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"GPU Service Failed: {status_code} - {detail}")
+        self.status_code = status_code
+
+
+def _retry_after_seconds(value: str) -> float:
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # HTTP-date form: not used by our workers, fall back to a short pause
+        return GPU_RETRY_BASE_DELAY * 4
+
+
+class CircuitBreaker:
+    """
+    CLOSED -> (threshold consecutive failures) -> OPEN -> (health probe ok or reset timeout) -> HALF_OPEN
+    HALF_OPEN lets a single trial request through: success closes, failure re-opens.
+    """
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, threshold: int = GPU_BREAKER_THRESHOLD, reset_timeout: float = GPU_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow_request(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Returns True when this failure (re-)opened the circuit."""
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            was_open = self.state == self.OPEN
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            return not was_open
+        return False
+
+    def release_trial(self):
+        """Frees the HALF_OPEN slot when the trial request ended without a verdict (e.g. cancelled)."""
+        self._trial_in_flight = False
+
+    def half_open(self):
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+
+
+class GPUServiceClient:
+    """
+    Long-lived, connection-pooled client for the GPU worker(s).
+    - One httpx.AsyncClient (HTTP/2 when 'h2' is installed) shared by all requests.
+    - Separate connect/read timeouts.
+    - Retries with exponential backoff + jitter for idempotent calls (connect/pool errors, 5xx).
+    - One circuit breaker per endpoint; while open, calls fail fast so callers go straight
+      to the CPU path and the endpoint's /health is re-probed in the background.
+    """
+
+    def __init__(self, secret: str = None):
+        self.secret = secret
+        self._client: httpx.AsyncClient = None
+        self._breakers = {}
+        self._health_urls = {}
+        self._probes = {}
+        self._known_hashes = {}
+
+    async def start(self):
+        if self._client is not None:
+            return
+        http2 = importlib.util.find_spec("h2") is not None
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(GPU_READ_TIMEOUT, connect=GPU_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=GPU_MAX_CONNECTIONS, max_keepalive_connections=GPU_MAX_CONNECTIONS),
+        )
+        logger.info(f"🔌 GPU client started (http2={http2}, connect={GPU_CONNECT_TIMEOUT}s, read={GPU_READ_TIMEOUT}s)")
+
+    async def close(self):
+        for task in self._probes.values():
+            task.cancel()
+        self._probes.clear()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        if url not in self._breakers:
+            self._breakers[url] = CircuitBreaker()
+        return self._breakers[url]
+
+    def _hash_known(self, url: str, content_hash: str) -> bool:
+        seen = self._known_hashes.get((url, content_hash))
+        return seen is not None and time.monotonic() - seen < GPU_HASH_TTL
+
+    def _remember_hash(self, url: str, content_hash: str):
+        if len(self._known_hashes) >= GPU_HASH_MAX_ENTRIES:
+            # Drop the oldest entries (dicts keep insertion order)
+            for key in list(self._known_hashes)[:GPU_HASH_MAX_ENTRIES // 10 + 1]:
+                del self._known_hashes[key]
+        self._known_hashes.pop((url, content_hash), None)
+        self._known_hashes[(url, content_hash)] = time.monotonic()
+
+    async def post(self, url: str, files: dict = None, params: dict = None, data: dict = None,
+                   health_url: str = None, idempotent: bool = True, content_hash: str = None) -> httpx.Response:
+        """
+        POSTs to a GPU endpoint and returns the (200, or 202 for a job submit) response.
+        With content_hash, an input already uploaded to this endpoint is referenced instead of
+        re-sent; if the worker no longer has it (404), the bytes are sent right away.
+        Raises GPUServiceUnavailable when the circuit is open, GPUServiceError / httpx errors otherwise.
+        """
+        if content_hash and GPU_HASH_REUSE and files and self._hash_known(url, content_hash):
+            hashed_params = {**(params or {}), "content_hash": content_hash}
+            try:
+                return await self._post(url, None, hashed_params, data, health_url, idempotent)
+            except GPUServiceError as e:
+                if e.status_code != 404:
+                    raise
+                # Container was recycled (or another replica answered): upload the bytes
+                self._known_hashes.pop((url, content_hash), None)
+
+        response = await self._post(url, files, params, data, health_url, idempotent)
+        if content_hash and GPU_HASH_REUSE and files:
+            self._remember_hash(url, content_hash)
+        return response
+
+    async def _post(self, url: str, files: dict, params: dict, data: dict,
+                    health_url: str, idempotent: bool) -> httpx.Response:
+        if self._client is None:
+            # Scripts/background tasks running outside the app lifespan
+            await self.start()
+        if health_url:
+            self._health_urls[url] = health_url
+
+        breaker = self.breaker(url)
+        if not breaker.allow_request():
+            raise GPUServiceUnavailable(f"Circuit open for {url}")
+        trial = breaker.state == CircuitBreaker.HALF_OPEN
+        try:
+            return await self._post_attempts(breaker, url, files, params, data, idempotent)
+        finally:
+            if trial:
+                # No-op after a verdict; frees the slot on cancellation or unexpected errors
+                breaker.release_trial()
+
+    async def _post_attempts(self, breaker: CircuitBreaker, url: str, files: dict, params: dict, data: dict,
+                             idempotent: bool) -> httpx.Response:
+        headers = {"x-api-key": self.secret} if self.secret else {}
+        attempts = 1 + (GPU_MAX_RETRIES if idempotent else 0)
+        last_error = None
+        for attempt in range(attempts):
+            try:
+                response = await self._client.post(url, files=files, params=params, data=data, headers=headers)
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                # The request may have reached the worker (read timeout, dropped response)
+                last_error = e
+                break
+            else:
+                if response.status_code in (200, 202):
+                    breaker.record_success()
+                    return response
+                if response.status_code == 503 and "retry-after" in response.headers:
+                    # Full queue, not a failure: no retry and no breaker strike, the caller re-routes
+                    breaker.record_success()
+                    raise GPUServiceBusy(url, _retry_after_seconds(response.headers["retry-after"]))
+                if response.status_code < 500:
+                    # Client error: the worker is healthy, retrying won't help
+                    breaker.record_success()
+                    raise GPUServiceError(response.status_code, response.text)
+                last_error = GPUServiceError(response.status_code, response.text)
+
+            if attempt < attempts - 1:
+                # Full jitter backoff
+                delay = random.uniform(0, GPU_RETRY_BASE_DELAY * (2 ** attempt))
+                logger.warning(f"⚠️ GPU call to {url} failed ({last_error}); retry {attempt + 1} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+        if breaker.record_failure():
+            logger.error(f"🔴 GPU circuit OPEN for {url} after {breaker.failures} failures. Routing to CPU.")
+            self._start_probe(url)
+        raise last_error
+
+    async def get(self, url: str, params: dict = None, timeout: float = None) -> httpx.Response:
+        """Authenticated GET (job status/results). No retries or breaker: callers own the polling loop."""
+        if self._client is None:
+            await self.start()
+        headers = {"x-api-key": self.secret} if self.secret else {}
+        request_timeout = httpx.Timeout(timeout or GPU_READ_TIMEOUT, connect=GPU_CONNECT_TIMEOUT)
+        return await self._client.get(url, params=params, headers=headers, timeout=request_timeout)
+
+    async def ping(self, url: str) -> float:
+        """GETs a health/warm-up URL and returns the latency in seconds (raises on failure)."""
+        if self._client is None:
+            await self.start()
+        started = time.monotonic()
+        response = await self._client.get(url)
+        response.raise_for_status()
+        return time.monotonic() - started
+
+    def _start_probe(self, url: str):
+        health_url = self._health_urls.get(url)
+        if not health_url:
+            # No health endpoint: breaker half-opens by itself after GPU_BREAKER_RESET
+            return
+        task = self._probes.get(url)
+        if task is not None and not task.done():
+            return
+        self._probes[url] = asyncio.create_task(self._probe_loop(url, health_url))
+
+    async def _probe_loop(self, url: str, health_url: str):
+        breaker = self.breaker(url)
+        while breaker.state == CircuitBreaker.OPEN:
+            await asyncio.sleep(GPU_HEALTH_INTERVAL)
+            try:
+                response = await self._client.get(health_url, timeout=httpx.Timeout(GPU_READ_TIMEOUT, connect=GPU_CONNECT_TIMEOUT))
+                if response.status_code == 200:
+                    logger.info(f"🟡 GPU health probe ok for {url}. Circuit HALF_OPEN.")
+                    breaker.half_open()
+                    return
+            except Exception as e:
+                logger.info(f"GPU health probe failed for {url}: {e}")
+
+    def status(self) -> dict:
+        return {
+            url: {"state": breaker.state, "failures": breaker.failures}
+            for url, breaker in self._breakers.items()
+        }
+
+
+gpu_client = GPUServiceClient(secret=os.getenv("GPU_SERVICE_SECRET"))
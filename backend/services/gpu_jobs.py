@@ -0,0 +1,85 @@
+import os
+import time
+import random
+import asyncio
+import logging
+
+import httpx
+
+from .gpu_client import gpu_client, GPUServiceError, GPUServiceUnavailable, GPU_RETRY_BASE_DELAY
+
+logger = logging.getLogger(__name__)
+
+# GPU Job API Configuration
+# Worker job endpoints (gpu-worker/core/jobs.py): <GPU_JOBS_URL>/upscale, <GPU_JOBS_URL>/{job_id}, ...
+# Defaults to GPU_SERVICE_URL/jobs; on Modal point it at the jobs_api app (.../jobs).
+GPU_JOBS_URL = os.getenv("GPU_JOBS_URL") or (f"{os.getenv('GPU_SERVICE_URL')}/jobs" if os.getenv("GPU_SERVICE_URL") else None)
+GPU_JOBS_ENABLED = os.getenv("GPU_JOBS_ENABLED", "true").lower() == "true"
+GPU_JOB_POLL_WAIT = float(os.getenv("GPU_JOB_POLL_WAIT", "25"))  # Long-poll per status request (worker caps it)
+# Safeguard only: a job still running after this is abandoned (CPU fallback)
+GPU_JOB_MAX_SECONDS = float(os.getenv("GPU_JOB_MAX_SECONDS", "1800"))
+GPU_JOB_POLL_ERRORS = int(os.getenv("GPU_JOB_POLL_ERRORS", "5"))  # Consecutive failed polls before giving up
+
+
+class GPUJobClient:
+    """
+    Runs work through the worker's submit/poll job API instead of one long request:
+    submit returns a job id at once, status is long-polled (each poll a short request, so no
+    read timeout caps the job's duration), then the result is downloaded.
+    Uses the pooled gpu_client (same connections, secret and circuit breaker for submits).
+    """
+
+    def __init__(self, jobs_url: str = None):
+        self.jobs_url = jobs_url.rstrip("/") if jobs_url else None
+
+    def enabled(self) -> bool:
+        return GPU_JOBS_ENABLED and bool(self.jobs_url)
+
+    async def submit(self, capability: str, files: dict, params: dict = None, content_hash: str = None) -> str:
+        # Not idempotent: a retried submit could start the same job twice
+        response = await gpu_client.post(f"{self.jobs_url}/{capability}", files=files, params=params,
+                                         idempotent=False, content_hash=content_hash)
+        return response.json()["job_id"]
+
+    async def wait(self, job_id: str) -> dict:
+        """Long-polls until the job finished; returns its final status."""
+        deadline = time.monotonic() + GPU_JOB_MAX_SECONDS
+        errors = 0
+        while time.monotonic() < deadline:
+            try:
+                response = await gpu_client.get(f"{self.jobs_url}/{job_id}", params={"wait": GPU_JOB_POLL_WAIT},
+                                                timeout=GPU_JOB_POLL_WAIT + 30)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                errors += 1
+                if errors >= GPU_JOB_POLL_ERRORS:
+                    raise
+                delay = random.uniform(0, GPU_RETRY_BASE_DELAY * (2 ** errors))
+                logger.warning(f"⚠️ Polling GPU job {job_id} failed ({e}); retry in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            errors = 0
+            if response.status_code != 200:
+                # 404: unknown or expired (e.g. the worker restarted)
+                raise GPUServiceError(response.status_code, response.text)
+            info = response.json()
+            if info["status"] in ("completed", "failed"):
+                return info
+        raise GPUServiceUnavailable(f"GPU job {job_id} still running after {GPU_JOB_MAX_SECONDS:.0f}s")
+
+    async def result(self, job_id: str) -> bytes:
+        response = await gpu_client.get(f"{self.jobs_url}/{job_id}/result")
+        if response.status_code != 200:
+            raise GPUServiceError(response.status_code, response.text)
+        return response.content
+
+    async def run(self, capability: str, files: dict, params: dict = None, content_hash: str = None) -> bytes:
+        """Submit, wait and download. Raises GPUServiceError when the job failed on the worker."""
+        job_id = await self.submit(capability, files, params, content_hash)
+        logger.info(f"📮 GPU job {job_id} submitted ({capability})")
+        info = await self.wait(job_id)
+        if info["status"] == "failed":
+            raise GPUServiceError(500, info.get("error") or "job failed")
+        return await self.result(job_id)
+
+
+gpu_jobs = GPUJobClient(GPU_JOBS_URL)
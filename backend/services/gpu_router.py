@@ -0,0 +1,255 @@
+import os
+import time
+import asyncio
+import logging
+from collections import defaultdict
+
+from .gpu_client import gpu_client, CircuitBreaker, GPUServiceUnavailable, GPUServiceBusy
+
+logger = logging.getLogger(__name__)
+
+# Router Configuration
+# Estimates are in seconds per megapixel of work (callers decide what a megapixel means per capability)
+GPU_EWMA_ALPHA = float(os.getenv("GPU_EWMA_ALPHA", "0.3"))
+GPU_COLD_START_ESTIMATE = float(os.getenv("GPU_COLD_START_ESTIMATE", "25"))
+GPU_IDLE_SCALEDOWN = float(os.getenv("GPU_IDLE_SCALEDOWN", "300"))  # Modal scaledown_window
+GPU_HEDGE_ENABLED = os.getenv("GPU_HEDGE_ENABLED", "true").lower() == "true"
+GPU_HEDGE_FACTOR = float(os.getenv("GPU_HEDGE_FACTOR", "2.0"))  # Hedge after N x the estimate
+GPU_HEDGE_MIN_DELAY = float(os.getenv("GPU_HEDGE_MIN_DELAY", "2.0"))
+# Minimum request overhead (network + decode/encode), added to every GPU estimate
+GPU_BASE_LATENCY = float(os.getenv("GPU_BASE_LATENCY", "0.5"))
+# A request (or warm-up ping) this much slower than its warm estimate hit a cold start
+GPU_COLD_THRESHOLD = float(os.getenv("GPU_COLD_THRESHOLD", "5"))
+
+DEFAULT_GPU_SECONDS_PER_MP = {"upscale": 1.0, "remove-background": 0.5}
+DEFAULT_CPU_SECONDS_PER_MP = {"upscale": 1.5, "remove-background": 4.0}
+
+
+class RouteToCPU(GPUServiceUnavailable):
+    """The router estimated local CPU to be faster than any GPU backend."""
+
+
+def _ewma(current: float, sample: float) -> float:
+    return sample if current is None else (1 - GPU_EWMA_ALPHA) * current + GPU_EWMA_ALPHA * sample
+
+
+class Backend:
+    def __init__(self, capability: str, url: str):
+        self.capability = capability
+        self.url = url
+        self.in_flight = 0
+        self.seconds_per_mp = None
+        self.cold_start = None
+        self.last_completed = None
+        self.busy_until = 0.0
+
+    def is_cold(self, now: float) -> bool:
+        # Idle long enough for the platform to scale to zero. A backend we never called is
+        # assumed warm (other instances may be keeping it up) until proven otherwise.
+        return self.last_completed is not None and now - self.last_completed > GPU_IDLE_SCALEDOWN
+
+    def service_time(self, megapixels: float) -> float:
+        per_mp = self.seconds_per_mp if self.seconds_per_mp is not None else DEFAULT_GPU_SECONDS_PER_MP.get(self.capability, 1.0)
+        return GPU_BASE_LATENCY + per_mp * megapixels
+
+    def estimate(self, megapixels: float, now: float) -> float:
+        service = self.service_time(megapixels)
+        # Requests already in flight on this backend are ahead of us
+        wait = self.in_flight * service
+        cold = (self.cold_start if self.cold_start is not None else GPU_COLD_START_ESTIMATE) if self.is_cold(now) else 0.0
+        return wait + service + cold
+
+    def available(self) -> bool:
+        if time.monotonic() < self.busy_until:
+            # The worker answered 503 + Retry-After: its queue is full
+            return False
+        breaker = gpu_client.breaker(self.url)
+        if breaker.state != CircuitBreaker.OPEN:
+            return True
+        return time.monotonic() - breaker.opened_at >= breaker.reset_timeout
+
+
+class GPURouter:
+    """
+    Routes each GPU job to the best of several backends per capability, or to local CPU:
+    - Tracks in-flight requests and EWMA latency (s/MP) per backend; picks the fewest outstanding.
+    - Sends the job to CPU when the estimated GPU time (queue + cold start) exceeds the CPU estimate.
+    - Optionally hedges a slow request to a second backend; the first answer wins.
+    Decisions are counted and exposed through metrics().
+    """
+
+    def __init__(self):
+        self._backends = {}
+        self._cpu_seconds_per_mp = {}
+        self._decisions = defaultdict(lambda: defaultdict(int))
+        self._hedges = defaultdict(lambda: {"fired": 0, "won": 0})
+        self._requests = defaultdict(lambda: {"total": 0, "cold": 0})
+
+    def configure(self, capability: str, urls: list):
+        self._backends[capability] = [Backend(capability, url) for url in urls if url]
+
+    def backends(self, capability: str) -> list:
+        return self._backends.get(capability, [])
+
+    def mark_warm(self):
+        """A warm-up ping succeeded: the shared worker containers are up right now."""
+        now = time.monotonic()
+        for backends in self._backends.values():
+            for backend in backends:
+                backend.last_completed = now
+
+    def record_cpu(self, capability: str, megapixels: float, seconds: float):
+        """Feeds actual CPU timings back so the GPU/CPU decision tracks this host."""
+        if megapixels > 0:
+            self._cpu_seconds_per_mp[capability] = _ewma(self._cpu_seconds_per_mp.get(capability), seconds / megapixels)
+
+    def cpu_estimate(self, capability: str, megapixels: float) -> float:
+        per_mp = self._cpu_seconds_per_mp.get(capability, DEFAULT_CPU_SECONDS_PER_MP.get(capability, 2.0))
+        return per_mp * megapixels
+
+    def _ranked(self, capability: str, megapixels: float, now: float) -> list:
+        candidates = [b for b in self.backends(capability) if b.available()]
+        # Fewest outstanding requests first, then the lowest estimate
+        return sorted(candidates, key=lambda b: (b.in_flight, b.estimate(megapixels, now)))
+
+    def choose(self, capability: str, megapixels: float):
+        """
+        Returns (backend or None for CPU, gpu_estimate, cpu_estimate).
+        """
+        now = time.monotonic()
+        ranked = self._ranked(capability, megapixels, now)
+        cpu_estimate = self.cpu_estimate(capability, megapixels)
+        if not ranked:
+            self._decisions[capability]["cpu:no-backend"] += 1
+            return None, None, cpu_estimate
+        best = ranked[0]
+        gpu_estimate = best.estimate(megapixels, now)
+        if gpu_estimate > cpu_estimate:
+            self._decisions[capability]["cpu:faster"] += 1
+            return None, gpu_estimate, cpu_estimate
+        self._decisions[capability][best.url] += 1
+        return best, gpu_estimate, cpu_estimate
+
+    async def _call_backend(self, backend: Backend, megapixels: float, queued_ahead: int, **kwargs):
+        """
+        Runs one request on a backend. The caller has already counted it in backend.in_flight
+        (synchronously, so concurrent choose() calls see it) and this releases it.
+        queued_ahead: requests already in flight on the backend when this one was dispatched.
+        """
+        was_cold = backend.is_cold(time.monotonic())
+        # Warm latency of this request: the ones ahead of it, then its own service time
+        warm_estimate = backend.service_time(megapixels) * (queued_ahead + 1)
+        started = time.monotonic()
+        try:
+            response = await gpu_client.post(backend.url, **kwargs)
+        except GPUServiceBusy as e:
+            backend.busy_until = time.monotonic() + e.retry_after
+            self._decisions[backend.capability]["busy"] += 1
+            raise
+        except asyncio.CancelledError:
+            # Lost a hedge race: the time so far is a lower bound of this backend's latency
+            if not was_cold and megapixels > 0:
+                elapsed = time.monotonic() - started
+                backend.seconds_per_mp = _ewma(backend.seconds_per_mp, max(0.0, elapsed - GPU_BASE_LATENCY) / megapixels)
+            raise
+        finally:
+            backend.in_flight -= 1
+        elapsed = time.monotonic() - started
+        backend.last_completed = time.monotonic()
+        self._requests[backend.capability]["total"] += 1
+        if was_cold or elapsed > warm_estimate + GPU_COLD_THRESHOLD:
+            self._requests[backend.capability]["cold"] += 1
+        if was_cold:
+            # Attribute the excess over a warm request to the cold start instead of skewing the EWMA
+            backend.cold_start = _ewma(backend.cold_start, max(0.0, elapsed - warm_estimate))
+        elif megapixels > 0:
+            backend.seconds_per_mp = _ewma(backend.seconds_per_mp, max(0.0, elapsed - GPU_BASE_LATENCY) / megapixels)
+        return response
+
+    def _dispatch(self, backend: Backend, megapixels: float, **kwargs) -> asyncio.Task:
+        queued_ahead = backend.in_flight
+        backend.in_flight += 1
+        return asyncio.create_task(self._call_backend(backend, megapixels, queued_ahead, **kwargs))
+
+    async def call(self, capability: str, megapixels: float, **kwargs):
+        """
+        Runs the job on the chosen backend (hedging if it is slow).
+        Raises RouteToCPU when local CPU is estimated faster or no backend is available.
+        kwargs are passed to gpu_client.post (files, params, data, health_url, content_hash).
+        """
+        try:
+            return await self._call(capability, megapixels, **kwargs)
+        except GPUServiceBusy as e:
+            # That backend is now skipped until its Retry-After: route once more (other backend or CPU)
+            logger.info(f"⏳ {e}. Re-routing {capability}.")
+            return await self._call(capability, megapixels, **kwargs)
+
+    async def _call(self, capability: str, megapixels: float, **kwargs):
+        backend, gpu_estimate, cpu_estimate = self.choose(capability, megapixels)
+        if backend is None:
+            raise RouteToCPU(f"{capability}: routed to CPU (CPU estimate {cpu_estimate:.1f}s, GPU estimate {gpu_estimate}s)")
+
+        primary = self._dispatch(backend, megapixels, **kwargs)
+        secondary_candidates = [b for b in self._ranked(capability, megapixels, time.monotonic()) if b is not backend]
+        if not GPU_HEDGE_ENABLED or not secondary_candidates:
+            return await primary
+
+        hedge_delay = max(GPU_HEDGE_MIN_DELAY, GPU_HEDGE_FACTOR * gpu_estimate)
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            return primary.result()
+
+        # Primary is slow: race it against the next best backend
+        hedge_backend = secondary_candidates[0]
+        self._hedges[capability]["fired"] += 1
+        logger.info(f"🏁 Hedging {capability} to {hedge_backend.url} after {hedge_delay:.1f}s")
+        hedge = self._dispatch(hedge_backend, megapixels, **kwargs)
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._hedges[capability]["won"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        return {
+            "decisions": {cap: dict(counts) for cap, counts in self._decisions.items()},
+            "hedges": dict(self._hedges),
+            "requests": {
+                cap: {**counts, "cold_rate": counts["cold"] / counts["total"] if counts["total"] else 0.0}
+                for cap, counts in self._requests.items()
+            },
+            "cpu_seconds_per_mp": dict(self._cpu_seconds_per_mp),
+            "backends": {
+                cap: [
+                    {
+                        "url": b.url,
+                        "in_flight": b.in_flight,
+                        "seconds_per_mp": b.seconds_per_mp,
+                        "cold_start": b.cold_start,
+                        "cold": b.is_cold(now),
+                        "busy_for": max(0.0, b.busy_until - now),
+                        "circuit": gpu_client.breaker(b.url).state,
+                    }
+                    for b in backends
+                ]
+                for cap, backends in self._backends.items()
+            },
+        }
+
+
+gpu_router = GPURouter()
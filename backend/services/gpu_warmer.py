@@ -0,0 +1,174 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from .gpu_client import gpu_client
+from .gpu_router import gpu_router, GPU_COLD_THRESHOLD, GPU_IDLE_SCALEDOWN
+
+logger = logging.getLogger(__name__)
+
+# GPU Warm-keeping Configuration
+# Ping the worker when a user opens the editor or loads an image (debounced)
+GPU_WARM_ON_ACTIVITY = os.getenv("GPU_WARM_ON_ACTIVITY", "true").lower() == "true"
+GPU_WARM_DEBOUNCE = float(os.getenv("GPU_WARM_DEBOUNCE", "30"))
+# Keep a container warm this long after the last user activity (0 = off)
+GPU_WARM_ACTIVITY_WINDOW = float(os.getenv("GPU_WARM_ACTIVITY_WINDOW", "900"))
+# Keep a container warm during business hours, e.g. "8-20" on days "0,1,2,3,4" (Mon-Fri). Empty = off.
+GPU_WARM_HOURS = os.getenv("GPU_WARM_HOURS", "")
+GPU_WARM_DAYS = os.getenv("GPU_WARM_DAYS", "0,1,2,3,4")
+GPU_WARM_TIMEZONE = os.getenv("GPU_WARM_TIMEZONE", "America/Bogota")
+# Must stay below the worker's scaledown window or the container idles out between pings
+GPU_WARM_INTERVAL = float(os.getenv("GPU_WARM_INTERVAL", str(max(30.0, GPU_IDLE_SCALEDOWN * 0.8))))
+# Price of one warm container (Modal T4 by default), used for the warm-keeping cost estimate
+GPU_COST_PER_HOUR = float(os.getenv("GPU_COST_PER_HOUR", "0.59"))
+
+
+def _parse_hours(value: str):
+    if not value:
+        return None
+    start, _, end = value.partition("-")
+    return int(start), int(end)
+
+
+def _parse_days(value: str) -> set:
+    return {int(day) for day in value.split(",") if day.strip()}
+
+
+class GPUWarmer:
+    """
+    Keeps the scale-to-zero GPU worker warm when it is likely to be needed:
+    - touch(): a cheap, debounced ping when a user opens the editor or loads an image.
+    - A background scheduler that re-pings every GPU_WARM_INTERVAL during business hours
+      (GPU_WARM_HOURS/DAYS) or while users were active in the last GPU_WARM_ACTIVITY_WINDOW.
+    Pings that take longer than GPU_COLD_THRESHOLD count as cold starts. Scheduler time spent
+    keeping a container up without real traffic is reported as warm-keeping cost.
+    """
+
+    def __init__(self):
+        self._urls = []
+        self._task: asyncio.Task = None
+        self._ping_task: asyncio.Task = None
+        self._last_ping = None
+        self._last_activity = None
+        self._last_request = None
+        self._hours = _parse_hours(GPU_WARM_HOURS)
+        self._days = _parse_days(GPU_WARM_DAYS)
+        self._timezone = ZoneInfo(GPU_WARM_TIMEZONE)
+        self._stats = {
+            "pings": 0,
+            "ping_failures": 0,
+            "cold_pings": 0,
+            "cold_start_seconds": 0.0,
+            "activity_pings": 0,
+            "scheduled_pings": 0,
+            "warm_keep_seconds": 0.0,
+        }
+
+    def configure(self, urls: list):
+        """Health/warm-up URLs of the worker(s); an empty list disables warming."""
+        self._urls = [url for url in dict.fromkeys(urls) if url]
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._urls)
+
+    def record_request(self):
+        """A real GPU request went out: the container is (or is being) warmed by traffic."""
+        self._last_request = time.monotonic()
+
+    def touch(self, reason: str = "activity") -> bool:
+        """
+        Records user activity and fires a warm-up ping in the background (debounced).
+        Returns True when a ping was started.
+        """
+        now = time.monotonic()
+        self._last_activity = now
+        if not self.enabled or not GPU_WARM_ON_ACTIVITY:
+            return False
+        if self._ping_task is not None and not self._ping_task.done():
+            return False
+        if self._last_ping is not None and now - self._last_ping < GPU_WARM_DEBOUNCE:
+            return False
+        self._stats["activity_pings"] += 1
+        self._ping_task = asyncio.create_task(self.ping(reason))
+        return True
+
+    async def ping(self, reason: str = "scheduled"):
+        self._last_ping = time.monotonic()
+        results = await asyncio.gather(*(self._ping_one(url, reason) for url in self._urls))
+        if any(results):
+            gpu_router.mark_warm()
+
+    async def _ping_one(self, url: str, reason: str) -> bool:
+        self._stats["pings"] += 1
+        try:
+            latency = await gpu_client.ping(url)
+        except Exception as e:
+            self._stats["ping_failures"] += 1
+            logger.warning(f"⚠️ GPU warm-up ping to {url} failed ({reason}): {e}")
+            return False
+        if latency > GPU_COLD_THRESHOLD:
+            self._stats["cold_pings"] += 1
+            self._stats["cold_start_seconds"] += latency
+            logger.info(f"🔥 GPU warm-up ({reason}) hit a cold start: {url} answered in {latency:.1f}s")
+        return True
+
+    def in_business_hours(self, now: datetime = None) -> bool:
+        if self._hours is None:
+            return False
+        now = now or datetime.now(self._timezone)
+        start, end = self._hours
+        return now.weekday() in self._days and start <= now.hour < end
+
+    def should_keep_warm(self) -> bool:
+        if self.in_business_hours():
+            return True
+        if self._last_activity is None or GPU_WARM_ACTIVITY_WINDOW <= 0:
+            return False
+        return time.monotonic() - self._last_activity < GPU_WARM_ACTIVITY_WINDOW
+
+    def start(self):
+        if self._task is None and self.enabled:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🌡️ GPU warmer started (interval={GPU_WARM_INTERVAL:.0f}s, hours={GPU_WARM_HOURS or 'off'})")
+
+    async def stop(self):
+        for task in (self._task, self._ping_task):
+            if task is not None:
+                task.cancel()
+        self._task = None
+        self._ping_task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(GPU_WARM_INTERVAL)
+            if not self.should_keep_warm():
+                continue
+            if self._last_request is not None and time.monotonic() - self._last_request < GPU_WARM_INTERVAL:
+                # Real traffic is already keeping the container up
+                continue
+            # Without this ping the container could idle out: count the interval as warm-keeping cost
+            self._stats["warm_keep_seconds"] += GPU_WARM_INTERVAL
+            self._stats["scheduled_pings"] += 1
+            try:
+                await self.ping("scheduled")
+            except Exception as e:
+                logger.warning(f"⚠️ GPU warm-up failed: {e}")
+
+    def metrics(self) -> dict:
+        stats = dict(self._stats)
+        successful = stats["pings"] - stats["ping_failures"]
+        stats["cold_ping_rate"] = stats["cold_pings"] / successful if successful else 0.0
+        stats["warm_keep_cost"] = round(stats["warm_keep_seconds"] / 3600 * GPU_COST_PER_HOUR, 4)
+        stats["keeping_warm"] = self.should_keep_warm()
+        stats["in_business_hours"] = self.in_business_hours()
+        stats["urls"] = self._urls
+        # Cold-start rate seen by real requests, from the router
+        stats["requests"] = gpu_router.metrics()["requests"]
+        return stats
+
+
+gpu_warmer = GPUWarmer()
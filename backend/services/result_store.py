@@ -0,0 +1,194 @@
+import os
+import re
+import time
+import tempfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Result Storage Configuration
+# Task results are written by whichever process runs the task (the web process with the embedded
+# worker, or python -m backend.worker) and downloaded through the web process, so both must see them:
+# - local: files under STATIC_DIR, served by the /api/static mount. Only visible to the web process
+#   when the worker is embedded, or when STATIC_DIR is a volume mounted by both (RESULT_LOCAL_SHARED=true).
+# - s3: an S3-compatible bucket (AWS S3, Cloudflare R2, MinIO...) shared by every process;
+#   /api/static/results/... redirects to a presigned URL. Needs boto3; credentials come from the
+#   usual AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY. Browsers fetch the result cross-origin,
+#   so the bucket needs a CORS rule allowing GET from the frontend origin.
+# Served at /api/static by main.py (results, avatars)
+STATIC_DIR = os.getenv("STATIC_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static"))
+RESULT_STORAGE = os.getenv("RESULT_STORAGE", "local").lower()
+RESULT_LOCAL_SHARED = os.getenv("RESULT_LOCAL_SHARED", "false").lower() == "true"
+RESULT_S3_BUCKET = os.getenv("RESULT_S3_BUCKET", "")
+RESULT_S3_PREFIX = os.getenv("RESULT_S3_PREFIX", "")  # Prepended to every key, e.g. "dimo/"
+RESULT_S3_ENDPOINT = os.getenv("RESULT_S3_ENDPOINT") or None  # Non-AWS providers
+RESULT_S3_REGION = os.getenv("RESULT_S3_REGION") or None
+RESULT_URL_EXPIRY = int(os.getenv("RESULT_URL_EXPIRY", "3600"))  # Lifetime of presigned download URLs
+
+# <kind>_<task id>.<ext>, also matches results written to the static root before sharding
+RESULT_NAME = re.compile(r"^(?P<kind>[a-z-]+)_(?P<task_id>[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\.(png|webp)$")
+TMP_MAX_AGE = 3600  # Leftovers of interrupted writes
+S3_DELETE_BATCH = 1000  # DeleteObjects limit
+
+
+def result_key(kind: str, task_id: str, extension: str = ".png") -> str:
+    """results/<2 hex chars of the task id>/<kind>_<task id>.<ext> (256 shards keep directories small)."""
+    return f"results/{task_id[:2]}/{kind}_{task_id}{extension}"
+
+
+def result_url(key: str) -> str:
+    """URL of a stored result, relative to the API host (see routers/processing.get_result)."""
+    return "/api/static/" + key
+
+
+def _content_type(key: str) -> str:
+    return "image/webp" if key.endswith(".webp") else "image/png"
+
+
+class LocalResultStore:
+    """Results as files under STATIC_DIR."""
+
+    name = "local"
+
+    def __init__(self):
+        self.shared = RESULT_LOCAL_SHARED
+        os.makedirs(STATIC_DIR, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(STATIC_DIR, *key.split("/"))
+
+    def spool_path(self, key: str) -> str:
+        """Local file a result is written to before save_file(); here, directly its final place."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def save_file(self, key: str, file_path: str) -> str:
+        """Stores a finished spool file as key; returns the result URL."""
+        path = self.spool_path(key)
+        if os.path.abspath(file_path) != path:
+            os.replace(file_path, path)
+        return result_url(key)
+
+    def save(self, key: str, data: bytes) -> str:
+        path = self.spool_path(key)
+        # Written then renamed, so a partial file is never served
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        return result_url(key)
+
+    def scan(self) -> list:
+        """[(key, kind, task_id, size, mtime, last_access)] for every result; drops stale temp files."""
+        found = []
+        now = time.time()
+        results_dir = os.path.join(STATIC_DIR, "results")
+        directories = [STATIC_DIR]
+        if os.path.isdir(results_dir):
+            directories += [entry.path for entry in os.scandir(results_dir) if entry.is_dir()]
+        for directory in directories:
+            for entry in os.scandir(directory):
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if entry.name.endswith(".tmp"):
+                    if now - stat.st_mtime > TMP_MAX_AGE:
+                        self._remove(entry.path)
+                    continue
+                match = RESULT_NAME.match(entry.name)
+                if match:
+                    key = os.path.relpath(entry.path, STATIC_DIR).replace(os.sep, "/")
+                    # Last access from atime, falling back to mtime on noatime mounts
+                    found.append((key, match["kind"], match["task_id"], stat.st_size,
+                                  stat.st_mtime, max(stat.st_atime, stat.st_mtime)))
+        return found
+
+    def delete(self, keys: list) -> list:
+        """Deletes results; returns the keys that were still there."""
+        return [key for key in keys if self._remove(self.path(key))]
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class S3ResultStore:
+    """Results as objects in RESULT_S3_BUCKET; producers spool to a temporary file first."""
+
+    name = "s3"
+
+    def __init__(self):
+        import boto3  # Optional dependency, only needed for RESULT_STORAGE=s3
+
+        self.shared = True
+        self.bucket = RESULT_S3_BUCKET
+        self.client = boto3.client("s3", endpoint_url=RESULT_S3_ENDPOINT, region_name=RESULT_S3_REGION)
+        self.spool_dir = os.path.join(tempfile.gettempdir(), "result-spool")
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def object_key(self, key: str) -> str:
+        return RESULT_S3_PREFIX + key
+
+    def spool_path(self, key: str) -> str:
+        return os.path.join(self.spool_dir, os.path.basename(key))
+
+    def save_file(self, key: str, file_path: str) -> str:
+        try:
+            # Multipart for large upscales, streamed from disk
+            self.client.upload_file(file_path, self.bucket, self.object_key(key),
+                                    ExtraArgs={"ContentType": _content_type(key)})
+        finally:
+            os.remove(file_path)
+        return result_url(key)
+
+    def save(self, key: str, data: bytes) -> str:
+        self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=data, ContentType=_content_type(key))
+        return result_url(key)
+
+    def scan(self) -> list:
+        """[(key, kind, task_id, size, mtime, last_access)]; objects have no access time, so LRU is by upload time."""
+        found = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.object_key("results/")):
+            for item in page.get("Contents", ()):
+                key = item["Key"][len(RESULT_S3_PREFIX):]
+                match = RESULT_NAME.match(key.rsplit("/", 1)[-1])
+                if match:
+                    modified = item["LastModified"].timestamp()
+                    found.append((key, match["kind"], match["task_id"], item["Size"], modified, modified))
+        return found
+
+    def delete(self, keys: list) -> list:
+        deleted = []
+        for start in range(0, len(keys), S3_DELETE_BATCH):
+            batch = keys[start:start + S3_DELETE_BATCH]
+            response = self.client.delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": self.object_key(key)} for key in batch], "Quiet": False,
+            })
+            deleted += [item["Key"][len(RESULT_S3_PREFIX):] for item in response.get("Deleted", ())]
+            for error in response.get("Errors", ()):
+                logger.warning(f"⚠️ Could not delete result {error.get('Key')}: {error.get('Message')}")
+        return deleted
+
+    def download_url(self, key: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.object_key(key)}, ExpiresIn=RESULT_URL_EXPIRY,
+        )
+
+
+def _create_store():
+    if RESULT_STORAGE == "s3":
+        if not RESULT_S3_BUCKET:
+            raise RuntimeError("RESULT_STORAGE=s3 requires RESULT_S3_BUCKET")
+        logger.info(f"🪣 Task results stored in s3://{RESULT_S3_BUCKET}/{RESULT_S3_PREFIX}results")
+        return S3ResultStore()
+    if RESULT_STORAGE != "local":
+        raise RuntimeError(f"Unknown RESULT_STORAGE '{RESULT_STORAGE}' (expected local or s3)")
+    return LocalResultStore()
+
+
+result_store = _create_store()
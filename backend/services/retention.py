@@ -0,0 +1,177 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_, and_
+
+from ..database import SessionLocal
+from .. import models
+from .result_store import result_store
+
+logger = logging.getLogger(__name__)
+
+# Result Retention Configuration
+# Task results live in the result store under results/<2 hex chars of the task id>/<kind>_<task id>.<ext>
+# (see result_store.py: STATIC_DIR or an S3 bucket). A periodic sweep deletes results older than their
+# kind's TTL, then the least recently used ones while the store is over RESULT_MAX_GB,
+# and bulk-deletes finished processing_tasks rows (a task whose result is gone is gone too).
+RESULT_TTL_DEFAULT = float(os.getenv("RESULT_TTL_DEFAULT", "86400"))
+# Per result type, seconds: "upscale=172800,remove-background=21600"
+RESULT_TTLS = os.getenv("RESULT_TTLS", "upscale=172800,halftone=86400,remove-background=21600,remove-objects=21600,contour-clip=21600")
+RESULT_FAILED_TTL = float(os.getenv("RESULT_FAILED_TTL", "86400"))  # Rows of failed tasks
+RESULT_MAX_GB = float(os.getenv("RESULT_MAX_GB", "5"))
+# Over the cap, evict down to this fraction of it (so one new result does not trigger another eviction)
+RESULT_LOW_WATERMARK = float(os.getenv("RESULT_LOW_WATERMARK", "0.9"))
+RESULT_SWEEP_ENABLED = os.getenv("RESULT_SWEEP_ENABLED", "true").lower() == "true"
+RESULT_SWEEP_INTERVAL = float(os.getenv("RESULT_SWEEP_INTERVAL", "600"))
+RESULT_SWEEP_BATCH = int(os.getenv("RESULT_SWEEP_BATCH", "1000"))  # Rows per DELETE statement
+
+
+def _parse_ttls(value: str) -> dict:
+    ttls = {}
+    for item in value.split(","):
+        kind, _, seconds = item.partition("=")
+        if kind.strip() and seconds.strip():
+            ttls[kind.strip()] = float(seconds)
+    return ttls
+
+
+class ResultSweeper:
+    """
+    Garbage collection for processing results:
+    - TTL per result type (RESULT_TTLS, by file age).
+    - Size cap: beyond RESULT_MAX_GB the least recently used results go first (last access
+      from atime on disk, upload time in a bucket).
+    - processing_tasks rows: finished tasks past their TTL and tasks whose result was evicted
+      are deleted in batches; pending/running tasks are never touched.
+    Runs in the web process every RESULT_SWEEP_INTERVAL; the listing and deletes run in a thread.
+    The web process sees every result: its embedded worker writes to its own STATIC_DIR, and
+    separate workers only start with shared storage (see worker.py).
+    """
+
+    def __init__(self):
+        self.ttls = _parse_ttls(RESULT_TTLS)
+        self.max_bytes = int(RESULT_MAX_GB * 1024 ** 3)
+        self._task: asyncio.Task = None
+        self._last_sweep = None
+        self._usage = {"files": 0, "bytes": 0}
+        self._totals = {"sweeps": 0, "files": 0, "bytes": 0, "rows": 0}
+
+    def ttl(self, kind: str) -> float:
+        return self.ttls.get(kind, RESULT_TTL_DEFAULT)
+
+    def start(self):
+        if self._task is None and RESULT_SWEEP_ENABLED:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🧹 Result sweeper started (every {RESULT_SWEEP_INTERVAL:.0f}s, cap {RESULT_MAX_GB:g} GB)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logger.error(f"❌ Result sweep failed: {e}")
+            await asyncio.sleep(RESULT_SWEEP_INTERVAL)
+
+    def sweep(self) -> dict:
+        started = time.monotonic()
+        now = time.time()
+        files = result_store.scan()
+
+        # 1. TTL per result type
+        expired, kept = [], []
+        for item in files:
+            (expired if now - item[4] > self.ttl(item[1]) else kept).append(item)
+
+        # 2. Size cap, least recently used first
+        evicted = []
+        total = sum(item[3] for item in kept)
+        if total > self.max_bytes:
+            target = self.max_bytes * RESULT_LOW_WATERMARK
+            kept.sort(key=lambda item: item[5])
+            while kept and total > target:
+                item = kept.pop(0)
+                evicted.append(item)
+                total -= item[3]
+
+        sizes = {item[0]: item[3] for item in expired + evicted}
+        deleted = result_store.delete(list(sizes))
+        reclaimed_files, reclaimed_bytes = len(deleted), sum(sizes[key] for key in deleted)
+
+        # 3. Task rows: past their TTL, or whose result was just evicted
+        rows = self._delete_rows([item[2] for item in evicted])
+
+        self._usage = {"files": len(kept), "bytes": total}
+        self._last_sweep = {
+            "at": datetime.now(timezone.utc).isoformat(),
+            "seconds": round(time.monotonic() - started, 3),
+            "expired_files": len(expired),
+            "evicted_files": len(evicted),
+            "reclaimed_bytes": reclaimed_bytes,
+            "deleted_rows": rows,
+        }
+        self._totals["sweeps"] += 1
+        self._totals["files"] += reclaimed_files
+        self._totals["bytes"] += reclaimed_bytes
+        self._totals["rows"] += rows
+        if reclaimed_files or rows:
+            logger.info(f"🧹 Swept {reclaimed_files} results ({reclaimed_bytes / 1024 ** 2:.1f} MB reclaimed, "
+                        f"{len(evicted)} over the size cap) and {rows} task rows; {total / 1024 ** 2:.1f} MB in use")
+        return self._last_sweep
+
+    def _delete_rows(self, evicted_ids: list) -> int:
+        Task = models.ProcessingTask
+        now = datetime.now(timezone.utc)
+        expired_kinds = [
+            and_(Task.status == "COMPLETED", Task.kind == kind, Task.created_at < now - timedelta(seconds=ttl))
+            for kind, ttl in self.ttls.items()
+        ]
+        expired = or_(
+            *expired_kinds,
+            and_(Task.status == "COMPLETED", Task.kind.notin_(list(self.ttls)),
+                 Task.created_at < now - timedelta(seconds=RESULT_TTL_DEFAULT)),
+            and_(Task.status == "FAILED", Task.created_at < now - timedelta(seconds=RESULT_FAILED_TTL)),
+        )
+        deleted = 0
+        db = SessionLocal()
+        try:
+            # Batches keep each transaction (and its locks) short
+            for start in range(0, len(evicted_ids), RESULT_SWEEP_BATCH):
+                batch = evicted_ids[start:start + RESULT_SWEEP_BATCH]
+                deleted += (
+                    db.query(Task).filter(Task.id.in_(batch), Task.status == "COMPLETED")
+                    .delete(synchronize_session=False)
+                )
+                db.commit()
+            while True:
+                ids = db.query(Task.id).filter(expired).limit(RESULT_SWEEP_BATCH).subquery()
+                count = db.query(Task).filter(Task.id.in_(ids.select())).delete(synchronize_session=False)
+                db.commit()
+                deleted += count
+                if count < RESULT_SWEEP_BATCH:
+                    break
+        finally:
+            db.close()
+        return deleted
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": RESULT_SWEEP_ENABLED,
+            "storage": result_store.name,
+            "interval": RESULT_SWEEP_INTERVAL,
+            "max_bytes": self.max_bytes,
+            "ttls": {**self.ttls, "default": RESULT_TTL_DEFAULT, "failed": RESULT_FAILED_TTL},
+            "usage": self._usage,
+            "last_sweep": self._last_sweep,
+            "reclaimed": self._totals,
+        }
+
+
+result_sweeper = ResultSweeper()
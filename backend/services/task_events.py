@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import uuid
+import select
+import asyncio
+import logging
+import threading
+
+from sqlalchemy import text
+
+from ..database import engine
+
+logger = logging.getLogger(__name__)
+
+# Task Events Configuration
+# Status changes and progress of processing tasks are pushed to subscribers (the SSE endpoint)
+# in-process; with PostgreSQL they also go through LISTEN/NOTIFY so events published by
+# separate worker processes reach the web process. 'auto' = on when the database is PostgreSQL.
+TASK_EVENTS_NOTIFY = os.getenv("TASK_EVENTS_NOTIFY", "auto").lower()
+TASK_EVENTS_CHANNEL = os.getenv("TASK_EVENTS_CHANNEL", "processing_task_events")
+TASK_PROGRESS_INTERVAL = float(os.getenv("TASK_PROGRESS_INTERVAL", "0.5"))  # Min seconds between progress events per task
+TASK_EVENTS_QUEUE_SIZE = int(os.getenv("TASK_EVENTS_QUEUE_SIZE", "100"))  # Per subscriber; slow clients drop progress
+# SSE streams send a comment line this often (proxies close idle connections) and re-read the
+# task from the database every TASK_EVENTS_RECHECK seconds in case a notification was missed
+TASK_EVENTS_KEEPALIVE = float(os.getenv("TASK_EVENTS_KEEPALIVE", "15"))
+TASK_EVENTS_RECHECK = float(os.getenv("TASK_EVENTS_RECHECK", "30"))
+
+
+class TaskEvents:
+    """
+    In-process pub/sub keyed by task id.
+    - publish() may be called from any thread (task worker, upscaler threads).
+    - subscribe() returns an asyncio.Queue of event dicts; unsubscribe() when done.
+    - With NOTIFY enabled every event is also sent with pg_notify, and a listener thread in
+      the web process feeds notifications from other processes into the local subscribers.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex  # Skips our own notifications coming back
+        self.notify = TASK_EVENTS_NOTIFY == "true" or (TASK_EVENTS_NOTIFY == "auto" and engine.dialect.name == "postgresql")
+        self._subscribers = {}
+        self._loop: asyncio.AbstractEventLoop = None
+        self._loop_thread = None
+        self._last_progress = {}
+        self._listener: threading.Thread = None
+        self._stopping = threading.Event()
+
+    def start(self, listen: bool = True):
+        """Binds to the running event loop; listen: receive other processes' events (web process)."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        if listen and self.notify and self._listener is None:
+            self._stopping.clear()
+            self._listener = threading.Thread(target=self._listen, name="task-events-listener", daemon=True)
+            self._listener.start()
+            logger.info(f"📡 Listening for task events on '{TASK_EVENTS_CHANNEL}'")
+
+    def stop(self):
+        self._stopping.set()
+        self._listener = None
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=TASK_EVENTS_QUEUE_SIZE)
+        self._subscribers.setdefault(task_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(task_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[task_id]
+
+    def subscribers(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def publish(self, task_id: str, event: dict):
+        event = {"id": task_id, **event}
+        if event.get("status") in ("COMPLETED", "FAILED"):
+            self._last_progress.pop(task_id, None)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._dispatch, event)
+        if self.notify:
+            if threading.get_ident() == self._loop_thread:
+                # Never block the event loop on the database
+                self._loop.run_in_executor(None, self._send_notify, event)
+            else:
+                self._send_notify(event)
+
+    def progress(self, task_id: str, stage: str, done: int = None, total: int = None):
+        """Throttled progress event (at most one per TASK_PROGRESS_INTERVAL, plus stage changes and the last step)."""
+        now = time.monotonic()
+        last_stage, last_time = self._last_progress.get(task_id, (None, 0.0))
+        if stage == last_stage and done != total and now - last_time < TASK_PROGRESS_INTERVAL:
+            return
+        self._last_progress[task_id] = (stage, now)
+        self.publish(task_id, {"status": "RUNNING", "stage": stage, "done": done, "total": total})
+
+    def _dispatch(self, event: dict):
+        for queue in list(self._subscribers.get(event["id"], ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Status events must get through; make room by dropping the oldest event
+                if "stage" not in event:
+                    queue.get_nowait()
+                    queue.put_nowait(event)
+
+    def _send_notify(self, event: dict):
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                   {"channel": TASK_EVENTS_CHANNEL, "payload": json.dumps({**event, "origin": self.origin})})
+                connection.commit()
+        except Exception as e:
+            # Subscribers still see the final state (the SSE endpoint re-reads the task)
+            logger.warning(f"⚠️ Task event notify failed: {e}")
+
+    def _listen(self):
+        while not self._stopping.is_set():
+            raw = None
+            try:
+                # Dedicated connection outside the pool, kept in autocommit for LISTEN
+                raw = engine.raw_connection()
+                raw.detach()
+                connection = raw.driver_connection
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {TASK_EVENTS_CHANNEL}")
+                while not self._stopping.is_set():
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self._receive(connection.notifies.pop(0).payload)
+            except Exception as e:
+                logger.warning(f"⚠️ Task event listener error: {e}. Reconnecting in 5s")
+                self._stopping.wait(5)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+    def _receive(self, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        if event.pop("origin", None) == self.origin or self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._dispatch, event)
+
+
+task_events = TaskEvents()
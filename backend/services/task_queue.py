@@ -0,0 +1,419 @@
+import io
+import os
+import json
+import uuid
+import hashlib
+import zipfile
+import random
+import socket
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_, and_, func
+from sqlalchemy.exc import IntegrityError
+
+from ..database import SessionLocal, engine
+from .. import models
+from .task_events import task_events
+
+logger = logging.getLogger(__name__)
+
+# Task Queue Configuration
+# Processing tasks are rows in processing_tasks (see update_processing_tasks_queue.sql); workers
+# (python -m backend.worker) claim them with SELECT ... FOR UPDATE SKIP LOCKED.
+# Inputs are kept in processing_task_inputs until the task finishes, so a worker on any machine
+# can run it; results go to the shared result store (services/result_store.py).
+TASK_WORKER_CONCURRENCY = int(os.getenv("TASK_WORKER_CONCURRENCY", "2"))  # Jobs run at once per worker process
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "1"))  # Idle wait between claims
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "3"))
+# A running job's lease is renewed every TASK_HEARTBEAT_SECONDS; when it expires
+# (worker killed) another worker claims the job again
+TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", "60"))
+TASK_HEARTBEAT_SECONDS = float(os.getenv("TASK_HEARTBEAT_SECONDS", "15"))
+TASK_RETRY_BASE_DELAY = float(os.getenv("TASK_RETRY_BASE_DELAY", "10"))  # Doubles per attempt
+TASK_RETRY_MAX_DELAY = float(os.getenv("TASK_RETRY_MAX_DELAY", "600"))
+TASK_SHUTDOWN_GRACE = float(os.getenv("TASK_SHUTDOWN_GRACE", "30"))  # Running jobs get this long to finish on stop
+# Run the worker inside the web process too. Turn it off only where separate workers run
+# (koyeb.yaml 'dimo-worker', Procfile 'worker') and results go to shared storage (RESULT_STORAGE=s3)
+TASK_WORKER_EMBEDDED = os.getenv("TASK_WORKER_EMBEDDED", "true").lower() == "true"
+
+# SQLite (local runs) has no row locks: claims in this process take turns instead
+_claim_lock = threading.Lock() if engine.dialect.name == "sqlite" else None
+
+# kind -> async handler(task_id, inputs, params) returning the result URL, or (result URL, result_meta)
+handlers = {}
+
+
+def handler(kind: str):
+    """Registers the coroutine that runs tasks of this kind (see processing.run_upscale_job)."""
+    def register(run):
+        handlers[kind] = run
+        return run
+    return register
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _drop_input(db, input_ref: str):
+    """Deletes a task's stored inputs in the caller's transaction."""
+    if input_ref:
+        db.query(models.ProcessingTaskInput).filter(models.ProcessingTaskInput.ref == input_ref).delete(synchronize_session=False)
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter for the attempt that just failed (1-based)."""
+    delay = min(TASK_RETRY_MAX_DELAY, TASK_RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+    return random.uniform(delay / 2, delay)
+
+
+def dedup_key(kind: str, inputs: dict, params: dict) -> str:
+    """Same kind, same input bytes and same parameters -> same key."""
+    digest = hashlib.sha256(kind.encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    for name in sorted(inputs):
+        digest.update(name.encode())
+        digest.update(hashlib.sha256(inputs[name]).digest())
+    return digest.hexdigest()
+
+
+def _in_flight(db, key: str):
+    return (
+        db.query(models.ProcessingTask.id)
+        .filter(models.ProcessingTask.dedup_key == key, models.ProcessingTask.status.in_(("PENDING", "RUNNING")))
+        .scalar()
+    )
+
+
+def _pack_inputs(inputs: dict) -> bytes:
+    # One uncompressed zip per task (image, optional mask): the images are already compressed
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for name, data in inputs.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def read_inputs(input_ref: str) -> dict:
+    """The task's inputs ({"image": bytes, ...}); LookupError once they are gone."""
+    db = SessionLocal()
+    try:
+        data = db.query(models.ProcessingTaskInput.data).filter(models.ProcessingTaskInput.ref == input_ref).scalar()
+    finally:
+        db.close()
+    if data is None:
+        raise LookupError(f"no stored input '{input_ref}'")
+    with zipfile.ZipFile(io.BytesIO(bytes(data))) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def enqueue(db, kind: str, inputs: dict, params: dict = None) -> str:
+    """
+    Stores the inputs ({"image": bytes, ...}) and a PENDING row in one transaction; a worker picks it up.
+    An identical task still pending or running is reused. Returns the task id.
+    """
+    params = params or {}
+    key = dedup_key(kind, inputs, params)
+    existing = _in_flight(db, key)
+    if existing is not None:
+        logger.info(f"♻️ Task {existing} ({kind}) reused for an identical submission")
+        return existing
+
+    task_id = str(uuid.uuid4())
+    input_ref = f"{task_id}.zip"
+    try:
+        db.add(models.ProcessingTaskInput(ref=input_ref, data=_pack_inputs(inputs)))
+        db.add(models.ProcessingTask(
+            id=task_id, status="PENDING", kind=kind, params=params, input_ref=input_ref, dedup_key=key,
+            attempts=0, max_attempts=TASK_MAX_ATTEMPTS, run_after=_now(),
+        ))
+        db.commit()
+    except IntegrityError:
+        # The same submission raced us in (unique in-flight dedup_key); the inputs roll back with it
+        db.rollback()
+        existing = _in_flight(db, key)
+        if existing is None:
+            raise
+        return existing
+    return task_id
+
+
+def claim(worker_id: str):
+    """
+    Claims the oldest due job (or one whose lease expired) for worker_id.
+    Returns (task_id, kind, params, input_ref) or None when the queue is empty.
+    SKIP LOCKED: concurrent workers never wait on, or take, the same row.
+    """
+    if _claim_lock is not None:
+        with _claim_lock:
+            return _claim(worker_id)
+    return _claim(worker_id)
+
+
+def _claim(worker_id: str):
+    Task = models.ProcessingTask
+    db = SessionLocal()
+    try:
+        while True:
+            now = _now()
+            task = (
+                db.query(Task)
+                .filter(or_(
+                    and_(Task.status == "PENDING", or_(Task.run_after.is_(None), Task.run_after <= now)),
+                    and_(Task.status == "RUNNING", Task.lease_expires_at < now),
+                ))
+                .order_by(Task.created_at)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if task is None:
+                db.commit()
+                return None
+            if task.status == "RUNNING":
+                logger.warning(f"⚠️ Task {task.id}: lease of {task.locked_by} expired, reclaiming")
+            if task.input_ref is None or task.attempts >= task.max_attempts:
+                # Nothing to run, or the worker died during the last attempt
+                task.status = "FAILED"
+                task.error = task.error or ("Input missing" if task.input_ref is None else "Worker lost while running the task")
+                task.locked_by = None
+                task.finished_at = now
+                error = task.error
+                _drop_input(db, task.input_ref)
+                db.commit()
+                task_events.publish(task.id, {"status": "FAILED", "error": error})
+                continue
+            task.status = "RUNNING"
+            task.attempts += 1
+            task.locked_by = worker_id
+            task.lease_expires_at = now + timedelta(seconds=TASK_LEASE_SECONDS)
+            task.started_at = now
+            claimed = (task.id, task.kind, dict(task.params or {}), task.input_ref)
+            attempt = task.attempts
+            db.commit()
+            task_events.publish(claimed[0], {"status": "RUNNING", "attempt": attempt})
+            return claimed
+    finally:
+        db.close()
+
+
+def _update_owned(task_id: str, worker_id: str, values: dict, drop_input: str = None) -> bool:
+    """
+    Updates the task only while worker_id still holds it (a reclaimed job is no longer ours);
+    drop_input deletes the task's inputs in the same transaction.
+    """
+    Task = models.ProcessingTask
+    db = SessionLocal()
+    try:
+        updated = (
+            db.query(Task)
+            .filter(Task.id == task_id, Task.locked_by == worker_id, Task.status == "RUNNING")
+            .update(values, synchronize_session=False)
+        )
+        if updated == 1:
+            _drop_input(db, drop_input)
+        db.commit()
+        return updated == 1
+    finally:
+        db.close()
+
+
+def heartbeat(task_id: str, worker_id: str) -> bool:
+    return _update_owned(task_id, worker_id, {"lease_expires_at": _now() + timedelta(seconds=TASK_LEASE_SECONDS)})
+
+
+def complete(task_id: str, worker_id: str, input_ref: str, result_url: str, result_meta: dict = None) -> bool:
+    done = _update_owned(task_id, worker_id, {
+        "status": "COMPLETED", "result_url": result_url, "result_meta": result_meta, "error": None,
+        "locked_by": None, "lease_expires_at": None, "finished_at": _now(),
+    }, drop_input=input_ref)
+    if done:
+        task_events.publish(task_id, {"status": "COMPLETED", "result_url": result_url, "result_meta": result_meta})
+    return done
+
+
+def fail(task_id: str, worker_id: str, input_ref: str, error: str) -> str:
+    """Schedules a retry with backoff, or marks the task FAILED after max_attempts. Returns the new status."""
+    db = SessionLocal()
+    try:
+        task = db.query(models.ProcessingTask).filter(models.ProcessingTask.id == task_id).first()
+        attempts, max_attempts = (task.attempts, task.max_attempts) if task else (0, 0)
+    finally:
+        db.close()
+    if attempts < max_attempts:
+        delay = retry_delay(attempts)
+        values = {"status": "PENDING", "run_after": _now() + timedelta(seconds=delay)}
+        status = "PENDING"
+        logger.warning(f"⚠️ Task {task_id} failed (attempt {attempts}/{max_attempts}): {error}. Retry in {delay:.0f}s")
+    else:
+        values = {"status": "FAILED", "finished_at": _now()}
+        status = "FAILED"
+        logger.error(f"❌ Task {task_id} failed after {attempts} attempts: {error}")
+    values.update({"error": error, "locked_by": None, "lease_expires_at": None})
+    if _update_owned(task_id, worker_id, values, drop_input=input_ref if status == "FAILED" else None):
+        task_events.publish(task_id, {"status": status, "error": error, "attempt": attempts})
+    return status
+
+
+def release(task_id: str, worker_id: str) -> bool:
+    """Hands a job back untouched (worker shutting down); the attempt does not count."""
+    Task = models.ProcessingTask
+    db = SessionLocal()
+    try:
+        updated = (
+            db.query(Task)
+            .filter(Task.id == task_id, Task.locked_by == worker_id, Task.status == "RUNNING")
+            .update({"status": "PENDING", "attempts": Task.attempts - 1, "run_after": _now(),
+                     "locked_by": None, "lease_expires_at": None}, synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+    if updated == 1:
+        task_events.publish(task_id, {"status": "PENDING"})
+    return updated == 1
+
+
+def get_status(task_id: str) -> dict:
+    """Current status as in GET /processing/tasks/{id}, or None for an unknown task."""
+    db = SessionLocal()
+    try:
+        task = db.query(models.ProcessingTask).filter(models.ProcessingTask.id == task_id).first()
+        if task is None:
+            return None
+        return {"id": task.id, "status": task.status, "result_url": task.result_url,
+                "result_meta": task.result_meta, "error": task.error}
+    finally:
+        db.close()
+
+
+def metrics() -> dict:
+    Task = models.ProcessingTask
+    db = SessionLocal()
+    try:
+        counts = dict(db.query(Task.status, func.count(Task.id)).group_by(Task.status).all())
+        oldest_due = db.query(func.min(Task.run_after)).filter(Task.status == "PENDING", Task.run_after <= _now()).scalar()
+    finally:
+        db.close()
+    return {
+        "tasks": counts,
+        "oldest_due": oldest_due.isoformat() if oldest_due else None,
+        "embedded_worker": task_worker.metrics() if TASK_WORKER_EMBEDDED else None,
+    }
+
+
+class TaskWorker:
+    """
+    Runs queued tasks with TASK_WORKER_CONCURRENCY slots. Each slot claims a job, runs its handler
+    while a heartbeat renews the lease, then completes or fails it (retry with backoff).
+    A job whose lease could not be renewed was reclaimed elsewhere and is cancelled here.
+    Database calls run in threads so the event loop (and the GPU client on it) is never blocked.
+    """
+
+    def __init__(self, concurrency: int = TASK_WORKER_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._slots = []
+        self._stopping: asyncio.Event = None
+        self._stats = {"completed": 0, "retried": 0, "failed": 0, "lost": 0}
+
+    def start(self):
+        if self._slots:
+            return
+        self._stopping = asyncio.Event()
+        self._slots = [asyncio.create_task(self._slot(f"{self.worker_id}/{index}")) for index in range(self.concurrency)]
+        logger.info(f"🧵 Task worker {self.worker_id} started ({self.concurrency} slots, kinds: {', '.join(handlers) or 'none'})")
+
+    async def stop(self):
+        """Stops claiming; running jobs get TASK_SHUTDOWN_GRACE seconds, then are released to the queue."""
+        if not self._slots:
+            return
+        self._stopping.set()
+        _, pending = await asyncio.wait(self._slots, timeout=TASK_SHUTDOWN_GRACE)
+        for slot in pending:
+            slot.cancel()
+        await asyncio.gather(*self._slots, return_exceptions=True)
+        self._slots = []
+        logger.info(f"🧵 Task worker {self.worker_id} stopped")
+
+    def metrics(self) -> dict:
+        return {"worker_id": self.worker_id, "slots": self.concurrency, **self._stats}
+
+    async def _idle(self):
+        # Jittered so idle slots of many workers do not poll in lockstep
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=random.uniform(0.5, 1.5) * TASK_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _slot(self, worker_id: str):
+        while not self._stopping.is_set():
+            try:
+                claimed = await asyncio.to_thread(claim, worker_id)
+            except Exception as e:
+                logger.error(f"❌ Claiming a task failed: {e}")
+                claimed = None
+            if claimed is None:
+                await self._idle()
+                continue
+            await self._run(worker_id, *claimed)
+
+    async def _run(self, worker_id: str, task_id: str, kind: str, params: dict, input_ref: str):
+        run_handler = handlers.get(kind)
+        if run_handler is None:
+            await asyncio.to_thread(fail, task_id, worker_id, input_ref, f"No handler for task kind '{kind}'")
+            return
+        logger.info(f"🧵 Task {task_id} ({kind}) claimed by {worker_id}")
+        try:
+            inputs = await asyncio.to_thread(read_inputs, input_ref)
+        except (LookupError, zipfile.BadZipFile) as e:
+            await asyncio.to_thread(fail, task_id, worker_id, input_ref, f"Input unavailable: {e}")
+            return
+
+        job = asyncio.create_task(run_handler(task_id, inputs, params))
+        lease = asyncio.create_task(self._heartbeat(task_id, worker_id, job))
+        try:
+            result = await job
+        except asyncio.CancelledError:
+            if lease.done():
+                # Lease lost: the job belongs to another worker now
+                self._stats["lost"] += 1
+                logger.warning(f"⚠️ Task {task_id}: lease lost, abandoned")
+                return
+            # Worker shutting down
+            await asyncio.to_thread(release, task_id, worker_id)
+            raise
+        except Exception as e:
+            status = await asyncio.to_thread(fail, task_id, worker_id, input_ref, str(e))
+            self._stats["retried" if status == "PENDING" else "failed"] += 1
+            return
+        finally:
+            lease.cancel()
+            if not job.done():
+                job.cancel()
+
+        result_url, result_meta = result if isinstance(result, tuple) else (result, None)
+        if await asyncio.to_thread(complete, task_id, worker_id, input_ref, result_url, result_meta):
+            self._stats["completed"] += 1
+            logger.info(f"✅ Task {task_id} completed")
+        else:
+            self._stats["lost"] += 1
+            logger.warning(f"⚠️ Task {task_id} finished after its lease was lost; result discarded")
+
+    async def _heartbeat(self, task_id: str, worker_id: str, job: asyncio.Task):
+        while True:
+            await asyncio.sleep(TASK_HEARTBEAT_SECONDS)
+            try:
+                renewed = await asyncio.to_thread(heartbeat, task_id, worker_id)
+            except Exception as e:
+                # Keep trying; the lease only runs out after TASK_LEASE_SECONDS
+                logger.warning(f"⚠️ Heartbeat for task {task_id} failed: {e}")
+                continue
+            if not renewed:
+                job.cancel()
+                return
+
+
+task_worker = TaskWorker()
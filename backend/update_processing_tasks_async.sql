@@ -0,0 +1,17 @@
+-- Script for asynchronous mode on the heavy processing endpoints (async=true)
+-- =============================================================
+-- Requires update_processing_tasks_queue.sql.
+-- dedup_key: identical submissions (same kind, inputs and parameters) share one task while
+-- it is pending or running. result_meta: extra result data, e.g. the auto_trim offset.
+
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS dedup_key VARCHAR(64);
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS result_meta JSONB;
+
+-- At most one in-flight task per key (concurrent identical submissions race on this)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_processing_tasks_in_flight ON processing_tasks (dedup_key)
+WHERE status IN ('PENDING', 'RUNNING');
+
+-- Comments for documentation
+COMMENT ON COLUMN processing_tasks.kind IS 'Job handler (see backend/services/task_queue.py): upscale, remove-background, remove-objects, contour-clip, halftone';
+COMMENT ON COLUMN processing_tasks.dedup_key IS 'SHA-256 of kind, inputs and parameters; unique among PENDING/RUNNING tasks';
+COMMENT ON COLUMN processing_tasks.result_meta IS 'Extra result data, e.g. the auto_trim offset {"x", "y", "width", "height", "original_width", "original_height"}';
@@ -0,0 +1,32 @@
+-- Script to turn processing_tasks into a durable job queue
+-- =============================================================
+-- Jobs are claimed by worker processes (python -m backend.worker) with
+-- SELECT ... FOR UPDATE SKIP LOCKED and kept alive with a renewed lease.
+-- A job whose lease expires (worker died) is claimed again; failed jobs
+-- are retried with backoff until max_attempts.
+
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS kind VARCHAR(50) NOT NULL DEFAULT 'upscale';
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS params JSONB DEFAULT '{}';
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS input_ref TEXT; -- Key in processing_task_inputs (create_processing_task_inputs.sql)
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS max_attempts INTEGER NOT NULL DEFAULT 3;
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS run_after TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS locked_by VARCHAR(255);
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS started_at TIMESTAMP WITH TIME ZONE;
+ALTER TABLE processing_tasks ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP WITH TIME ZONE;
+
+-- Tasks created before the queue existed ran inside the web process and are gone:
+-- leave them to the UI as failed instead of picking them up without an input.
+UPDATE processing_tasks SET status = 'FAILED', error = 'Interrupted by a restart'
+WHERE status = 'PENDING' AND input_ref IS NULL;
+
+-- Claim query: due pending jobs, and running jobs whose lease expired
+CREATE INDEX IF NOT EXISTS idx_processing_tasks_due ON processing_tasks (run_after) WHERE status = 'PENDING';
+CREATE INDEX IF NOT EXISTS idx_processing_tasks_leases ON processing_tasks (lease_expires_at) WHERE status = 'RUNNING';
+
+-- Comments for documentation
+COMMENT ON COLUMN processing_tasks.status IS 'Status of the task: PENDING, RUNNING, COMPLETED, FAILED';
+COMMENT ON COLUMN processing_tasks.kind IS 'Job handler (see backend/services/task_queue.py), e.g. upscale';
+COMMENT ON COLUMN processing_tasks.run_after IS 'Pending jobs are not claimed before this time (retry backoff)';
+COMMENT ON COLUMN processing_tasks.lease_expires_at IS 'Renewed by the worker heartbeat; once past, another worker may claim the job';
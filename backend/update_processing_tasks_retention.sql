@@ -0,0 +1,8 @@
+-- Script for result retention (backend/services/retention.py)
+-- =============================================================
+-- The sweeper bulk-deletes finished tasks past their TTL:
+--   DELETE FROM processing_tasks WHERE id IN (SELECT id ... WHERE status = 'COMPLETED' AND kind = ... AND created_at < ... LIMIT n)
+-- This index keeps that lookup off a full table scan as rows accumulate.
+
+CREATE INDEX IF NOT EXISTS idx_processing_tasks_finished ON processing_tasks (status, kind, created_at)
+WHERE status IN ('COMPLETED', 'FAILED');
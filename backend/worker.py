@@ -0,0 +1,49 @@
+"""
+Processing task worker, separate from the web process:
+
+    python -m backend.worker            # TASK_WORKER_CONCURRENCY jobs at once
+
+Claims queued tasks (services/task_queue.py) from processing_tasks, so several workers can run
+side by side and the web tier only enqueues. Set TASK_WORKER_EMBEDDED=false on the web process
+when workers run separately.
+Inputs come from the database; results must go where the web process can serve them:
+RESULT_STORAGE=s3, or a STATIC_DIR volume shared with it (RESULT_LOCAL_SHARED=true).
+"""
+import sys
+import asyncio
+import signal
+import logging
+
+from .services.gpu_client import gpu_client
+from .services.task_queue import task_worker
+from .services.task_events import task_events
+from .services.result_store import result_store
+from . import processing  # noqa: F401  (registers the task handlers)
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    if not result_store.shared:
+        # Results written to this machine's disk would never be found by the web process
+        logger.error("❌ RESULT_STORAGE=local is not shared with the web process: set RESULT_STORAGE=s3, "
+                     "or RESULT_LOCAL_SHARED=true when STATIC_DIR is a volume mounted by both")
+        sys.exit(1)
+    # Same pooled GPU client as the web process (breaker, retries, connection reuse)
+    await gpu_client.start()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    # Publish only: SSE subscribers live in the web process (reached via NOTIFY)
+    task_events.start(listen=False)
+    task_worker.start()
+    await stopping.wait()
+    logger.info("🛑 Stopping task worker...")
+    await task_worker.stop()
+    await gpu_client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main())
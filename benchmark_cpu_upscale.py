@@ -0,0 +1,105 @@
+"""
+Benchmarks the CPU upscale engines on this host: Lanczos (cpu_upscaler) vs Real-ESRGAN on
+ONNX Runtime (onnx_upscaler, fp32 and/or int8 exports from gpu-worker/export_onnx.py).
+
+A high-resolution reference image is resized so the input is --size px on its longest side
+(downscaled from the reference by --factor), every engine upscales it back, and the result is
+compared with the reference: latency (median of --runs) and quality (PSNR / SSIM on luma).
+
+    python benchmark_cpu_upscale.py --image photo.jpg --model weights/realesr-general-x4v3.onnx \
+        --model weights/realesr-general-x4v3.int8.onnx --factor 2 --size 1000
+"""
+import argparse
+import io
+import os
+import resource
+import statistics
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def ssim(a: np.ndarray, b: np.ndarray) -> float:
+    """Standard SSIM (11x11 gaussian window, sigma 1.5) on single-channel images."""
+    a, b = a.astype(np.float64), b.astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    cov = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+def luma(img: Image.Image) -> np.ndarray:
+    return np.asarray(img.convert("YCbCr"))[:, :, 0]
+
+
+def prepare(image_path: str, size: int, factor: float):
+    reference = Image.open(image_path).convert("RGB")
+    # Reference at size * factor on its longest side, input downscaled from it
+    ratio = size * factor / max(reference.size)
+    ref_size = (int(reference.width * ratio) // int(factor) * int(factor), int(reference.height * ratio) // int(factor) * int(factor))
+    reference = reference.resize(ref_size, Image.Resampling.LANCZOS)
+    small = reference.resize((int(ref_size[0] / factor), int(ref_size[1] / factor)), Image.Resampling.BICUBIC)
+    return reference, small
+
+
+def bench(name: str, run, reference: Image.Image, runs: int):
+    run()  # Warm-up (session creation, first-shape planning)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = run()
+        timings.append(time.perf_counter() - started)
+    output = Image.open(io.BytesIO(result)).convert("RGB")
+    if output.size != reference.size:
+        output = output.resize(reference.size, Image.Resampling.BICUBIC)
+    print(f"{name:<40} {statistics.median(timings):>8.2f}s {psnr(luma(output), luma(reference)):>8.2f} "
+          f"{ssim(luma(output), luma(reference)):>7.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", required=True, help="High-resolution reference image")
+    parser.add_argument("--model", action="append", default=[], help="ONNX model to benchmark (repeatable)")
+    parser.add_argument("--factor", type=float, default=2)
+    parser.add_argument("--size", type=int, default=1000, help="Input size (longest side, px)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    from backend import cpu_upscaler, onnx_upscaler
+
+    reference, small = prepare(args.image, args.size, args.factor)
+    print(f"Input {small.width}x{small.height} -> x{args.factor} ({reference.width}x{reference.height}), "
+          f"{os.cpu_count()} CPUs, {args.threads} threads, median of {args.runs}")
+    print(f"{'engine':<40} {'latency':>9} {'PSNR':>8} {'SSIM':>7}")
+
+    bench("bicubic (baseline)", lambda: _encode(small.resize(reference.size, Image.Resampling.BICUBIC)), reference, args.runs)
+    bench("lanczos + unsharp (cpu_upscaler)", lambda: cpu_upscaler.upscale_to_bytes(small, args.factor), reference, args.runs)
+    for model_path in args.model:
+        engine = onnx_upscaler.OnnxUpscaler(model_path, threads=args.threads)
+        # Same path as the backend: tiled inference + streaming PNG encode
+        bench(f"onnx {os.path.basename(model_path)}", lambda: onnx_upscaler.upscale_to_bytes(small, args.factor, engine),
+              reference, args.runs)
+
+    print(f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+def _encode(img: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+    main()
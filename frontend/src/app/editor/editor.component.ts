@@ -135,6 +135,7 @@ export class EditorComponent implements AfterViewInit {
 
   ngAfterViewInit() {
     this.loadGallery();
+    this.api.warmupGpu('editor');
   }
 
   async loadGallery() {
@@ -166,6 +167,7 @@ export class EditorComponent implements AfterViewInit {
     this.currentImageSource.set(url);
     this.processedImageSource.set(null);
     this.hasFile.set(true);
+    this.api.warmupGpu('upload');
 
     // Reset state
     this.lastClickCoords.set(null);
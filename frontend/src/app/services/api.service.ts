@@ -10,6 +10,15 @@ import { switchMap, filter, take, tap, map } from 'rxjs/operators';
 export class ApiService {
     private http = inject(HttpClient);
 
+    /**
+     * Fire-and-forget GPU warm-up so the first heavy operation doesn't pay the cold start.
+     * Errors are ignored: warming is only an optimization.
+     */
+    warmupGpu(reason: 'editor' | 'upload' = 'editor'): void {
+        this.http.post(`${environment.apiUrl}/processing/warmup`, null, { params: { reason } })
+            .subscribe({ error: () => { } });
+    }
+
     removeBackground(image: Blob, colors?: Array<[number, number, number]>, threshold?: number, mask?: Blob, refine: boolean = false): Observable<Blob> {
         const formData = new FormData();
         formData.append('image', image);
@@ -60,7 +69,7 @@ export class ApiService {
         formData.append('detail_boost', detailBoost.toString());
 
         return this.http.post<{ task_id: string }>(`${environment.apiUrl}/upscale`, formData).pipe(
-            switchMap(res => this.pollTask(res.task_id)),
+            switchMap(res => this.watchTask(res.task_id)),
             switchMap(task => {
                 // Determine absolute URL for the result. 
                 // task.result_url is like "/api/static/..."
@@ -76,6 +85,54 @@ export class ApiService {
         );
     }
 
+    /**
+     * Progress of the task being watched (GPU stage, CPU tiles/bands), null when idle.
+     */
+    taskProgress = signal<{ stage: string; done: number | null; total: number | null } | null>(null);
+
+    /**
+     * Waits for a processing task over Server-Sent Events (status pushed by the backend);
+     * falls back to polling when the stream is unavailable.
+     */
+    private watchTask(taskId: string): Observable<any> {
+        if (typeof EventSource === 'undefined') {
+            return this.pollTask(taskId);
+        }
+        return new Observable<any>(subscriber => {
+            const source = new EventSource(`${environment.apiUrl}/processing/tasks/${taskId}/events`);
+            let fallback: { unsubscribe(): void } | null = null;
+
+            source.addEventListener('progress', (event: MessageEvent) => {
+                const progress = JSON.parse(event.data);
+                this.taskProgress.set({ stage: progress.stage, done: progress.done, total: progress.total });
+            });
+            source.addEventListener('status', (event: MessageEvent) => {
+                const task = JSON.parse(event.data);
+                if (task.status === 'COMPLETED') {
+                    source.close();
+                    subscriber.next(task);
+                    subscriber.complete();
+                } else if (task.status === 'FAILED') {
+                    source.close();
+                    subscriber.error(new Error(task.error || 'Upscale task failed'));
+                }
+            });
+            source.onerror = () => {
+                // Stream dropped (proxy, network): finish by polling instead
+                source.close();
+                if (!fallback && !subscriber.closed) {
+                    fallback = this.pollTask(taskId).subscribe(subscriber);
+                }
+            };
+
+            return () => {
+                source.close();
+                fallback?.unsubscribe();
+                this.taskProgress.set(null);
+            };
+        });
+    }
+
     private pollTask(taskId: string): Observable<any> {
         return timer(1000, 2000).pipe(
             switchMap(() => this.http.get<any>(`${environment.apiUrl}/processing/tasks/${taskId}`)),
@@ -0,0 +1,71 @@
+import os
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+# Admission Control Configuration
+# Requests processed at once per model (their tiles/images share micro-batches)
+UPSCALE_CONCURRENCY = int(os.getenv("UPSCALE_CONCURRENCY", "2"))
+REMOVER_CONCURRENCY = int(os.getenv("REMOVER_CONCURRENCY", "8"))
+# Requests allowed to wait for a slot; beyond that the worker answers 503 + Retry-After
+UPSCALE_MAX_QUEUE = int(os.getenv("UPSCALE_MAX_QUEUE", "16"))
+REMOVER_MAX_QUEUE = int(os.getenv("REMOVER_MAX_QUEUE", "64"))
+
+
+class QueueFull(Exception):
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"{name} queue is full")
+        self.retry_after = retry_after
+
+
+class ModelGate:
+    """
+    Bounded admission queue in front of one model: at most `concurrency` requests run,
+    at most `max_queue` wait, and the rest are rejected right away with a Retry-After
+    estimated from the queue length and the recent service time.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.waiting = 0
+        self.in_flight = 0
+        self.rejected = 0
+        self.avg_seconds = None
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    def retry_after(self) -> int:
+        per_request = self.avg_seconds if self.avg_seconds is not None else 5.0
+        return max(1, math.ceil((self.waiting + self.in_flight) / self.concurrency * per_request))
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.waiting >= self.max_queue and self._semaphore.locked():
+            self.rejected += 1
+            raise QueueFull(self.name, self.retry_after())
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            elapsed = time.monotonic() - started
+            self.avg_seconds = elapsed if self.avg_seconds is None else 0.8 * self.avg_seconds + 0.2 * elapsed
+
+    def status(self) -> dict:
+        return {
+            "queued": self.waiting,
+            "in_flight": self.in_flight,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "avg_seconds": self.avg_seconds,
+        }
@@ -0,0 +1,116 @@
+import os
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.metrics import INFERENCE_SECONDS, BATCH_SIZE
+
+# Micro-batching Configuration
+# A batch is sent when it has BATCH_MAX_SIZE items or its oldest item waited BATCH_MAX_WAIT_MS.
+# While the model is busy, new requests keep accumulating, so batches grow with load.
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+UPSCALE_BATCH_SIZE = int(os.getenv("UPSCALE_BATCH_SIZE", "4"))  # Tiles per forward pass
+REMOVER_BATCH_SIZE = int(os.getenv("REMOVER_BATCH_SIZE", "8"))  # Images per forward pass
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent requests and runs them as one batched call.
+    Items are grouped by key (model + input shape): only items with the same key share a batch.
+    run_batch(key, items) -> results runs on a dedicated thread, one batch at a time,
+    and each result is handed back to the request that submitted the item.
+    """
+
+    def __init__(self, run_batch, max_size: int, max_wait_ms: float = BATCH_MAX_WAIT_MS, name: str = "batcher",
+                 model_label=None):
+        self.run_batch = run_batch
+        # key -> model name for the inference metrics (default: the batcher name)
+        self.model_label = model_label or (lambda key: name)
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._pending = {}
+        self._timers = {}
+        self._ready = []
+        self._running = False
+        self.stats = {"batches": 0, "items": 0, "max_batch": 0}
+
+    def _enqueue(self, key, item) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((item, future))
+        if len(pending) >= self.max_size:
+            self._mark_ready(key)
+        elif key not in self._timers and key not in self._ready:
+            self._timers[key] = loop.call_later(self.max_wait, self._mark_ready, key)
+        return future
+
+    async def submit(self, key, item):
+        return await self._enqueue(key, item)
+
+    async def submit_many(self, key, items: list) -> list:
+        """Submits all items at once (e.g. the tiles of one image) so they can share batches."""
+        futures = [self._enqueue(key, item) for item in items]
+        return await asyncio.gather(*futures)
+
+    async def run_exclusive(self, fn, *args):
+        """Runs a call that can't be batched on the model thread, serialized with the batches."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def depth(self) -> int:
+        """Items waiting for a batch."""
+        return sum(len(pending) for pending in self._pending.values())
+
+    def _mark_ready(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if key not in self._ready:
+            self._ready.append(key)
+        self._start_next()
+
+    def _start_next(self):
+        if self._running or not self._ready:
+            return
+        key = self._ready.pop(0)
+        pending = self._pending.get(key, [])
+        # Requests that gave up (client disconnected) don't take a batch slot
+        pending = [entry for entry in pending if not entry[1].done()]
+        batch, rest = pending[:self.max_size], pending[self.max_size:]
+        if rest:
+            self._pending[key] = rest
+            if len(rest) >= self.max_size:
+                self._ready.append(key)
+            else:
+                self._timers[key] = asyncio.get_running_loop().call_later(self.max_wait, self._mark_ready, key)
+        else:
+            self._pending.pop(key, None)
+        if not batch:
+            self._start_next()
+            return
+        self._running = True
+        asyncio.get_running_loop().create_task(self._run(key, batch))
+
+    async def _run(self, key, batch: list):
+        items = [item for item, _ in batch]
+        model = self.model_label(key)
+        BATCH_SIZE.labels(model=model).observe(len(items))
+        started = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self.run_batch, key, items)
+            INFERENCE_SECONDS.labels(model=model).observe(time.perf_counter() - started)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.stats["batches"] += 1
+            self.stats["items"] += len(batch)
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+            self._running = False
+            self._start_next()
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+
+from core.admission import ModelGate, UPSCALE_CONCURRENCY, UPSCALE_MAX_QUEUE, REMOVER_CONCURRENCY, REMOVER_MAX_QUEUE
+
+# Engine Configuration
+WEIGHTS_DIR = os.getenv("WEIGHTS_DIR", "weights")  # Real-ESRGAN .pth files (/weights in the Modal image)
+REMOVER_MODEL = os.getenv("REMOVER_MODEL", "u2net")
+# Background removal quality tiers (quality=<tier> on /remove-background): tier=rembg model, comma separated.
+# Only the default tier loads with the remover; the others on their first request.
+REMOVER_TIERS = dict(
+    pair.strip().split("=", 1)
+    for pair in os.getenv("REMOVER_TIERS", f"fast=u2netp,balanced=silueta,standard={REMOVER_MODEL},high=isnet-general-use").split(",")
+    if "=" in pair
+)
+REMOVER_DEFAULT_QUALITY = os.getenv("REMOVER_DEFAULT_QUALITY", "standard")
+# Capabilities loaded at startup (comma separated); the rest load on their first request
+ENGINE_PRELOAD = [c.strip() for c in os.getenv("ENGINE_PRELOAD", "").split(",") if c.strip()]
+
+
+def _load_upscaler():
+    # torch, basicsr and realesrgan are only imported when an upscale is actually needed
+    from core.upscaler import Upscaler
+    return Upscaler(
+        model_path=os.path.join(WEIGHTS_DIR, "RealESRGAN_x4plus.pth"),
+        model_path_x2=os.path.join(WEIGHTS_DIR, "RealESRGAN_x2plus.pth"),
+    )
+
+
+def _load_remover():
+    # rembg/onnxruntime only; the background remover never pays for torch
+    from core.remover import BackgroundRemover
+    return BackgroundRemover(REMOVER_TIERS, REMOVER_DEFAULT_QUALITY)
+
+
+class ModelEntry:
+    """One capability: how to load its model, the loaded instance and its admission gate."""
+
+    def __init__(self, capability: str, loader, gate: ModelGate):
+        self.capability = capability
+        self.loader = loader
+        self.gate = gate
+        self.model = None
+        self.load_seconds = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        # Concurrent first requests wait for the same load
+        with self._lock:
+            if self.model is None:
+                started = time.monotonic()
+                try:
+                    self.model = self.loader()
+                except Exception as e:
+                    # Not cached: the next request tries again
+                    self.error = str(e)
+                    print(f"WARNING: {self.capability} model failed to load. {e}")
+                    raise
+                self.load_seconds = time.monotonic() - started
+                self.error = None
+                print(f"Loaded {self.capability} model in {self.load_seconds:.1f}s")
+        return self.model
+
+    def load_in_background(self):
+        """Starts the load in a thread unless the model is loaded or already loading. Returns at once."""
+        if self.model is None and not self._lock.locked():
+            threading.Thread(target=self._load_quietly, name=f"load-{self.capability}", daemon=True).start()
+
+    def _load_quietly(self):
+        try:
+            self.load()
+        except Exception:
+            pass  # Already logged; the next warm-up or request tries again
+
+
+class ModelRegistry:
+    """
+    Models by capability ('upscale', 'remove-background'), loaded lazily on first use.
+    A container that only removes backgrounds never imports torch or loads Real-ESRGAN.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def register(self, capability: str, loader, gate: ModelGate):
+        self._entries[capability] = ModelEntry(capability, loader, gate)
+
+    def capabilities(self) -> list:
+        return list(self._entries)
+
+    def load(self, capability: str):
+        """Loads (once) and returns the model. Blocking: meant for container start hooks."""
+        return self._entries[capability].load()
+
+    async def get(self, capability: str):
+        """Returns the model, loading it off the event loop on first use."""
+        entry = self._entries[capability]
+        if entry.model is not None:
+            return entry.model
+        return await asyncio.to_thread(entry.load)
+
+    def loaded(self, capability: str):
+        """The model if already loaded, else None (never triggers a load)."""
+        return self._entries[capability].model
+
+    def gate(self, capability: str) -> ModelGate:
+        return self._entries[capability].gate
+
+    def preload(self, capabilities: list = None):
+        for capability in (ENGINE_PRELOAD if capabilities is None else capabilities):
+            try:
+                self.load(capability)
+            except Exception:
+                pass  # Already logged; the endpoint reports 503 until a load succeeds
+
+    def warm(self, capabilities: list = None):
+        """Background loads for models not loaded yet (warm-up pings), without blocking the caller."""
+        for capability in (capabilities or self._entries):
+            self._entries[capability].load_in_background()
+
+    def gpu_available(self) -> bool:
+        # Without importing torch when it was never needed
+        if "torch" in sys.modules:
+            return sys.modules["torch"].cuda.is_available()
+        try:
+            import onnxruntime
+            return "CUDAExecutionProvider" in onnxruntime.get_available_providers()
+        except ImportError:
+            return False
+
+    def status(self, capabilities: list = None) -> dict:
+        models = {}
+        for capability in (capabilities or self._entries):
+            entry = self._entries[capability]
+            models[capability] = {
+                "loaded": entry.model is not None,
+                "load_seconds": entry.load_seconds,
+                "error": entry.error,
+                **entry.gate.status(),
+                "batch_queue": entry.model.batcher.depth() if entry.model is not None else 0,
+            }
+            if entry.model is not None and hasattr(entry.model, "tier_status"):
+                models[capability]["tiers"] = entry.model.tier_status()
+        return models
+
+
+registry = ModelRegistry()
+# Bounded queue per model: beyond it the worker sheds load with 503 + Retry-After
+registry.register("upscale", _load_upscaler, ModelGate("upscale", UPSCALE_CONCURRENCY, UPSCALE_MAX_QUEUE))
+registry.register("remove-background", _load_remover, ModelGate("remove-background", REMOVER_CONCURRENCY, REMOVER_MAX_QUEUE))
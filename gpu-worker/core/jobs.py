@@ -0,0 +1,193 @@
+import os
+import time
+import uuid
+import asyncio
+from fastapi import APIRouter, Depends, File, HTTPException, Response, UploadFile
+from fastapi.responses import JSONResponse
+
+from core import service
+from core.transfer import url_allowed
+
+# Job API Configuration
+# Submit returns a job id right away; callers poll (long-poll with ?wait=) or get a callback
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "900"))  # Seconds a finished job and its result are kept
+JOB_MAX_ACTIVE = int(os.getenv("JOB_MAX_ACTIVE", "256"))  # Queued + running jobs before submits get 503
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "25"))  # Longest long-poll
+# URL prefixes results may be POSTed to. Empty = callbacks disabled.
+JOB_CALLBACK_ALLOWED = [p.strip() for p in os.getenv("JOB_CALLBACK_ALLOWED", "").split(",") if p.strip()]
+JOB_CALLBACK_RETRIES = int(os.getenv("JOB_CALLBACK_RETRIES", "3"))
+
+QUEUED, RUNNING, COMPLETED, FAILED = "queued", "running", "completed", "failed"
+
+
+class JobNotFound(Exception):
+    """Unknown job id, or its result already expired."""
+
+
+def check_callback_url(callback_url: str):
+    # Exact scheme/host/port match (see transfer.url_allowed): the callback carries the shared secret
+    if callback_url and not url_allowed(callback_url, JOB_CALLBACK_ALLOWED):
+        raise HTTPException(status_code=400, detail="callback_url is not an allowed callback location")
+
+
+def deliver_callback(callback_url: str, info: dict, content: bytes = None, media_type: str = None):
+    """
+    POSTs the finished job to callback_url: multipart with the job fields and, on success, the result
+    file. Signed with the shared secret (x-api-key) so the receiver can trust it. Blocking.
+    """
+    import requests
+
+    files = {"file": ("result", content, media_type)} if content is not None else None
+    data = {key: str(value) for key, value in info.items() if value is not None}
+    for attempt in range(JOB_CALLBACK_RETRIES):
+        try:
+            response = requests.post(callback_url, data=data, files=files, headers={"x-api-key": service.API_SECRET}, timeout=30)
+            if response.status_code < 500:
+                return
+        except requests.RequestException as e:
+            print(f"Job callback to {callback_url} failed: {e}")
+        time.sleep(2 ** attempt)
+    print(f"Job callback to {callback_url} gave up after {JOB_CALLBACK_RETRIES} attempts")
+
+
+class Job:
+    def __init__(self, capability: str, callback_url: str = None):
+        self.id = uuid.uuid4().hex
+        self.capability = capability
+        self.callback_url = callback_url
+        self.status = QUEUED
+        self.created = time.time()
+        self.finished = None
+        self.content = None
+        self.media_type = None
+        self.error = None
+        self.done = asyncio.Event()
+        self.task: asyncio.Task = None  # The loop only keeps a weak reference to running tasks
+
+    def info(self) -> dict:
+        return {
+            "job_id": self.id,
+            "capability": self.capability,
+            "status": self.status,
+            "created": self.created,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class LocalJobs:
+    """
+    Jobs run as tasks on this worker's event loop and results stay in memory for JOB_RESULT_TTL
+    (Docker/local worker: one process sees every submit and poll).
+    run(capability, content, params) -> (bytes, media_type) does the actual work (service.run_job).
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self._jobs = {}
+
+    def _sweep(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and now - job.finished > JOB_RESULT_TTL]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def active(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
+
+    async def submit(self, capability: str, content: bytes, params: dict, callback_url: str = None) -> dict:
+        self._sweep()
+        if self.active() >= JOB_MAX_ACTIVE:
+            raise HTTPException(status_code=503, detail="Too many active jobs", headers={"Retry-After": "30"})
+        job = Job(capability, callback_url)
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._execute(job, content, params))
+        return job.info()
+
+    async def _execute(self, job: Job, content: bytes, params: dict):
+        job.status = RUNNING
+        try:
+            job.content, job.media_type = await self.run(job.capability, content, params)
+            job.status = COMPLETED
+        except Exception as e:
+            print(f"Job {job.id} ({job.capability}) failed: {e}")
+            job.status, job.error = FAILED, str(e)
+        job.finished = time.time()
+        job.done.set()
+        if job.callback_url:
+            await asyncio.to_thread(deliver_callback, job.callback_url, job.info(), job.content, job.media_type)
+
+    def _get(self, job_id: str) -> Job:
+        self._sweep()
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise JobNotFound(job_id)
+        return job
+
+    async def status(self, job_id: str, wait: float = 0) -> dict:
+        job = self._get(job_id)
+        if wait > 0 and not job.done.is_set():
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+        return job.info()
+
+    async def result(self, job_id: str) -> tuple:
+        """(info, content, media_type); content is None until the job completed."""
+        job = self._get(job_id)
+        return job.info(), job.content, job.media_type
+
+
+def job_router(jobs, verify_token) -> APIRouter:
+    """
+    /jobs endpoints over a job backend (LocalJobs, or Modal's spawned calls in modal_app.py):
+      POST /jobs/{capability}       same parameters as the synchronous endpoint + callback_url -> 202 {job_id}
+      GET  /jobs/{job_id}?wait=N    status, optionally waiting up to N seconds for it to finish
+      GET  /jobs/{job_id}/result    the result bytes (202 while pending, 500 with the error if it failed)
+    Parameters are validated before a job is created (400s stay synchronous).
+    """
+    router = APIRouter(prefix="/jobs", dependencies=[Depends(verify_token)])
+
+    async def submit(capability: str, file: UploadFile, content_hash: str, source_url: str, callback_url: str, params: dict):
+        check_callback_url(callback_url)
+        service.JOB_VALIDATORS[capability](params)
+        # Inputs are resolved now: an unknown content_hash is still a synchronous 404 the caller can act on
+        content = await service.read_input(await file.read() if file is not None else None, content_hash, source_url)
+        info = await jobs.submit(capability, content, params, callback_url)
+        return JSONResponse(info, status_code=202)
+
+    @router.post("/upscale")
+    async def submit_upscale(file: UploadFile = File(None), scale: float = 2.0, content_hash: str = None,
+                             source_url: str = None, response_format: str = "png", callback_url: str = None):
+        params = {"scale": scale, "response_format": response_format}
+        return await submit("upscale", file, content_hash, source_url, callback_url, params)
+
+    @router.post("/remove-background")
+    async def submit_remove_background(file: UploadFile = File(None), output: str = "rgba", content_hash: str = None,
+                                       source_url: str = None, response_format: str = "png", quality: str = None,
+                                       callback_url: str = None):
+        params = {"output": output, "response_format": response_format, "quality": quality}
+        return await submit("remove-background", file, content_hash, source_url, callback_url, params)
+
+    @router.get("/{job_id}")
+    async def job_status(job_id: str, wait: float = 0):
+        try:
+            return await jobs.status(job_id, min(max(wait, 0), JOB_MAX_WAIT))
+        except JobNotFound:
+            raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+    @router.get("/{job_id}/result")
+    async def job_result(job_id: str):
+        try:
+            info, content, media_type = await jobs.result(job_id)
+        except JobNotFound:
+            raise HTTPException(status_code=404, detail="Unknown or expired job")
+        if info["status"] == FAILED:
+            raise HTTPException(status_code=500, detail=info["error"])
+        if content is None:
+            return JSONResponse(info, status_code=202)
+        return Response(content=content, media_type=media_type)
+
+    return router
+
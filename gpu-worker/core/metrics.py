@@ -0,0 +1,106 @@
+import os
+import io
+import sys
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+# Metrics Configuration
+# Prometheus text format on GET /metrics. Each container reports its own numbers
+# (on Modal a scrape reaches one container of the class).
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+MEGAPIXEL_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+BATCH_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+
+REQUEST_SECONDS = Histogram("gpu_worker_request_seconds", "Time from input received to result ready (excludes the response transfer)",
+                            ["capability"], buckets=SECONDS_BUCKETS)
+INFERENCE_SECONDS = Histogram("gpu_worker_inference_seconds", "Forward pass time per batch",
+                              ["model"], buckets=SECONDS_BUCKETS)
+BATCH_SIZE = Histogram("gpu_worker_batch_size", "Items (tiles or images) per forward pass", ["model"], buckets=BATCH_BUCKETS)
+DECODE_SECONDS = Histogram("gpu_worker_decode_seconds", "Input decode (and model input preparation) time",
+                           ["capability"], buckets=SECONDS_BUCKETS)
+ENCODE_SECONDS = Histogram("gpu_worker_encode_seconds", "Result assembly and encode time", ["capability"], buckets=SECONDS_BUCKETS)
+INPUT_MEGAPIXELS = Histogram("gpu_worker_input_megapixels", "Input image size", ["capability"], buckets=MEGAPIXEL_BUCKETS)
+REMOVER_TIER_SECONDS = Histogram("gpu_worker_remover_tier_seconds", "Background removal time per quality tier (batch wait included)",
+                                 ["quality"], buckets=SECONDS_BUCKETS)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    """Observes the block's duration when it succeeds (failures would skew the distribution)."""
+    started = time.perf_counter()
+    yield
+    histogram.labels(**labels).observe(time.perf_counter() - started)
+
+
+def observe_input(capability: str, content: bytes):
+    """Input size from the image header only (no decode). Unreadable inputs fail later with a proper error."""
+    from PIL import Image
+    try:
+        width, height = Image.open(io.BytesIO(content)).size
+    except Exception:
+        return
+    INPUT_MEGAPIXELS.labels(capability=capability).observe(width * height / 1_000_000)
+
+
+def _device_memory() -> list:
+    """[(device, used_bytes, total_bytes)] without importing torch when it was never needed."""
+    if "torch" in sys.modules and sys.modules["torch"].cuda.is_available():
+        torch = sys.modules["torch"]
+        devices = []
+        for index in range(torch.cuda.device_count()):
+            free, total = torch.cuda.mem_get_info(index)
+            devices.append((str(index), total - free, total))
+        return devices
+    try:
+        import pynvml
+        pynvml.nvmlInit()
+    except Exception:
+        return []
+    devices = []
+    for index in range(pynvml.nvmlDeviceGetCount()):
+        info = pynvml.nvmlDeviceGetMemoryInfo(pynvml.nvmlDeviceGetHandleByIndex(index))
+        devices.append((str(index), info.used, info.total))
+    return devices
+
+
+class WorkerCollector:
+    """Values read at scrape time: queue depth, in-flight work, load shedding, model load time, device memory."""
+
+    def collect(self):
+        from core.engine import registry
+
+        queued = GaugeMetricFamily("gpu_worker_queue_depth", "Requests waiting for an admission slot", labels=["capability"])
+        in_flight = GaugeMetricFamily("gpu_worker_in_flight", "Requests holding an admission slot", labels=["capability"])
+        batch_queue = GaugeMetricFamily("gpu_worker_batch_queue_depth", "Items waiting for a forward pass", labels=["capability"])
+        rejected = CounterMetricFamily("gpu_worker_rejected", "Requests shed with 503 (queue full)", labels=["capability"])
+        loaded = GaugeMetricFamily("gpu_worker_model_loaded", "1 once the capability's model is loaded", labels=["capability"])
+        load_seconds = GaugeMetricFamily("gpu_worker_model_load_seconds", "Model load time (cold start)", labels=["capability"])
+        for capability, status in registry.status().items():
+            queued.add_metric([capability], status["queued"])
+            in_flight.add_metric([capability], status["in_flight"])
+            batch_queue.add_metric([capability], status["batch_queue"])
+            rejected.add_metric([capability], status["rejected"])
+            loaded.add_metric([capability], 1 if status["loaded"] else 0)
+            if status["load_seconds"] is not None:
+                load_seconds.add_metric([capability], status["load_seconds"])
+        yield from (queued, in_flight, batch_queue, rejected, loaded, load_seconds)
+
+        used = GaugeMetricFamily("gpu_worker_device_memory_used_bytes", "GPU memory in use", labels=["device"])
+        total = GaugeMetricFamily("gpu_worker_device_memory_total_bytes", "GPU memory size", labels=["device"])
+        for device, used_bytes, total_bytes in _device_memory():
+            used.add_metric([device], used_bytes)
+            total.add_metric([device], total_bytes)
+        yield from (used, total)
+
+
+REGISTRY.register(WorkerCollector())
+
+
+def render() -> tuple:
+    """(body, content_type) for the /metrics endpoint."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
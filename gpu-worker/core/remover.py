@@ -1,18 +1,163 @@
 from rembg import remove, new_session
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageOps
+import asyncio
 import io
+import os
+import time
+import threading
+from collections import deque
+
+from core.transfer import encode_pil
+from core.batching import MicroBatcher, REMOVER_BATCH_SIZE
+from core.metrics import timed, DECODE_SECONDS, ENCODE_SECONDS, INFERENCE_SECONDS, BATCH_SIZE, REMOVER_TIER_SECONDS
+
+# Models sharing U2Net's fixed-size input can be batched: (mean, std, input size)
+BATCHABLE_MODELS = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2net_human_seg": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+}
+
+# Requests per tier kept for the latency percentiles reported by /health
+REMOVER_LATENCY_WINDOW = int(os.getenv("REMOVER_LATENCY_WINDOW", "500"))
+
+
+class LatencyWindow:
+    """Latencies (seconds) of the most recent requests of one quality tier."""
+
+    def __init__(self, size: int = REMOVER_LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self.count = 0
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> dict:
+        if not self._samples:
+            return {"count": self.count}
+        samples = np.array(self._samples)
+        return {
+            "count": self.count,
+            "mean": round(float(samples.mean()), 4),
+            "p50": round(float(np.percentile(samples, 50)), 4),
+            "p95": round(float(np.percentile(samples, 95)), 4),
+        }
+
 
 class BackgroundRemover:
-    def __init__(self, model_name="u2net"):
-        print(f"Initializing BackgroundRemover with {model_name}...")
-        # Create a session once to load the model into GPU memory
-        # 'u2net' is the general purpose model. 'isnet-general-use' is also good.
-        self.session = new_session(model_name)
+    """
+    One rembg session per quality tier (tiers: {"fast": "u2netp", "standard": "u2net", ...}).
+    The default tier loads here, the others on their first request; tiers naming the same
+    model share its session.
+    """
+
+    def __init__(self, tiers: dict = None, default_quality: str = "standard"):
+        self.tiers = dict(tiers or {default_quality: "u2net"})
+        if default_quality not in self.tiers:
+            raise ValueError(f"Default quality '{default_quality}' is not one of the tiers {list(self.tiers)}")
+        self.default_quality = default_quality
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.latency = {quality: LatencyWindow() for quality in self.tiers}
+        self.batcher = MicroBatcher(self._predict_batch, max_size=REMOVER_BATCH_SIZE, name="remover",
+                                    model_label=lambda model_name: model_name)
+        self.session(default_quality)
+
+    def session(self, quality: str = None):
+        """The tier's session, created (and its model loaded into GPU memory) on first use. Blocking."""
+        model_name = self.tiers[quality or self.default_quality]
+        if model_name not in self._sessions:
+            with self._lock:
+                if model_name not in self._sessions:
+                    print(f"Initializing BackgroundRemover session {model_name} (quality={quality or self.default_quality})...")
+                    self._sessions[model_name] = new_session(model_name)
+        return self._sessions[model_name]
 
-    def process(self, image_bytes: bytes) -> bytes:
+    def process(self, image_bytes: bytes, only_mask: bool = False, response_format: str = "png", quality: str = None) -> bytes:
         # rembg simply takes bytes and returns bytes
         # It handles the onnxruntime session internally if passed
-        
-        output = remove(image_bytes, session=self.session)
-        return output
+        # only_mask=True returns the single-channel alpha matte instead of the RGBA cut-out
+        session = self.session(quality)
+        if response_format == "png" or only_mask:
+            return remove(image_bytes, session=session, only_mask=only_mask)
+
+        # Given a PIL image rembg returns a PIL image, which we encode as lossless WebP
+        output = remove(Image.open(io.BytesIO(image_bytes)), session=session)
+        return encode_pil(output, response_format)
+
+    async def process_batched(self, image_bytes: bytes, only_mask: bool = False, response_format: str = "png",
+                              quality: str = None) -> bytes:
+        """
+        Same result as process(), but the network input (every image is resized to the model's
+        fixed input size) is batched with other in-flight requests of the same model into one forward pass.
+        """
+        quality = quality or self.default_quality
+        model_name = self.tiers[quality]
+        if model_name not in self._sessions:
+            await asyncio.to_thread(self.session, quality)
+
+        started = time.monotonic()
+        if model_name not in BATCHABLE_MODELS:
+            # rembg decodes, runs and encodes in one call: all of it counts as inference
+            BATCH_SIZE.labels(model=model_name).observe(1)
+            with timed(INFERENCE_SECONDS, model=model_name):
+                result = await self.batcher.run_exclusive(self.process, image_bytes, only_mask, response_format, quality)
+        else:
+            img, net_input = await asyncio.to_thread(self._prepare, image_bytes, model_name)
+            pred = await self.batcher.submit(model_name, net_input)
+            result = await asyncio.to_thread(self._finish, img, pred, only_mask, response_format)
+        elapsed = time.monotonic() - started
+        self.latency[quality].record(elapsed)
+        REMOVER_TIER_SECONDS.labels(quality=quality).observe(elapsed)
+        return result
+
+    def tier_status(self) -> dict:
+        # Per-tier latency (batch wait + inference + encode), to choose tier defaults from data
+        return {
+            quality: {"model": model_name, "loaded": model_name in self._sessions, **self.latency[quality].summary()}
+            for quality, model_name in self.tiers.items()
+        }
+
+    def _prepare(self, image_bytes: bytes, model_name: str):
+        with timed(DECODE_SECONDS, capability="remove-background"):
+            return self._normalize(image_bytes, model_name)
+
+    def _normalize(self, image_bytes: bytes, model_name: str):
+        # Mirrors rembg: fix EXIF orientation, then BaseSession.normalize for a single image
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+        mean, std, size = BATCHABLE_MODELS[model_name]
+        im_ary = np.array(img.convert("RGB").resize(size, Image.LANCZOS)).astype(np.float32)
+        im_ary = im_ary / max(float(np.max(im_ary)), 1e-6)
+        net_input = ((im_ary - np.array(mean, dtype=np.float32)) / np.array(std, dtype=np.float32)).transpose(2, 0, 1)
+        return img, np.ascontiguousarray(net_input, dtype=np.float32)
+
+    def _predict_batch(self, model_name: str, inputs: list) -> list:
+        session = self._sessions[model_name].inner_session
+        input_name = session.get_inputs()[0].name
+        try:
+            preds = session.run(None, {input_name: np.stack(inputs)})[0][:, 0, :, :]
+        except Exception:
+            # Exported with a fixed batch dimension of 1: fall back to one run per image
+            preds = np.concatenate([session.run(None, {input_name: x[np.newaxis]})[0][:, 0, :, :] for x in inputs])
+
+        masks = []
+        for pred in preds:
+            # Per-image min-max normalization, as rembg does for a single image
+            ma, mi = np.max(pred), np.min(pred)
+            masks.append(((pred - mi) / max(ma - mi, 1e-6) * 255).astype(np.uint8))
+        return masks
+
+    def _finish(self, img: Image.Image, pred: np.ndarray, only_mask: bool, response_format: str) -> bytes:
+        with timed(ENCODE_SECONDS, capability="remove-background"):
+            return self._cutout(img, pred, only_mask, response_format)
+
+    def _cutout(self, img: Image.Image, pred: np.ndarray, only_mask: bool, response_format: str) -> bytes:
+        mask = Image.fromarray(pred, mode="L").resize(img.size, Image.LANCZOS)
+        if only_mask:
+            return encode_pil(mask, response_format)
+        # rembg's naive cutout: original pixels where the mask is set, transparent elsewhere
+        cutout = Image.composite(img.convert("RGBA"), Image.new("RGBA", img.size, 0), mask)
+        return encode_pil(cutout, response_format)
@@ -0,0 +1,190 @@
+import os
+import time
+import asyncio
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from core.engine import registry, REMOVER_TIERS
+from core.admission import QueueFull
+from core.transfer import resolve_input, result_media_type, UnknownContentHash, RESULT_FORMATS
+from core.streaming import STREAM_UPSCALE
+from core import metrics
+from core.metrics import timed, REQUEST_SECONDS
+
+# Endpoint logic shared by main.py (Docker/local) and modal_app.py (Modal classes)
+
+# Largest scale accepted (beyond the 4x model it is a plain resize)
+MAX_UPSCALE = float(os.getenv("MAX_UPSCALE", "8"))
+
+# Security: Shared Secret
+API_SECRET = os.getenv("GPU_SERVICE_SECRET", "dev-secret-123")
+
+def check_secret(secret: str):
+    if secret != API_SECRET:
+        raise HTTPException(status_code=401, detail="Invalid API Key")
+
+def check_response_format(response_format: str):
+    if response_format not in RESULT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"response_format must be one of {RESULT_FORMATS}")
+
+def queue_full(e: QueueFull) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def read_input(content: bytes, content_hash: str, source_url: str) -> bytes:
+    # Inputs arrive as an upload, by content hash (already sent to this container) or by reference
+    try:
+        # source_url fetches are blocking: keep them off the event loop
+        return await asyncio.to_thread(resolve_input, content, content_hash, source_url)
+    except UnknownContentHash:
+        # The backend re-sends the bytes on this specific error
+        raise HTTPException(status_code=404, detail="unknown content_hash")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def get_model(capability: str):
+    # First request for a capability loads its model (later ones reuse it)
+    try:
+        return await registry.get(capability)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"{capability} model not available: {e}")
+
+def health(capabilities: list = None) -> dict:
+    # Queue depth and in-flight work, so the backend router and autoscaling see real load.
+    # Doubles as the warm-up ping (backend gpu_warmer): models not loaded yet start loading in
+    # the background, so the first real request doesn't pay for the load and tile calibration.
+    # The response itself never waits for a load.
+    registry.warm(capabilities)
+    return {
+        "status": "ok",
+        "gpu": registry.gpu_available(),
+        "queues": registry.status(capabilities),
+    }
+
+def metrics_response() -> Response:
+    # Prometheus scrape target (no secret, like /health); never loads a model
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled")
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+def validate_upscale(params: dict):
+    check_response_format(params["response_format"])
+    if params["scale"] <= 0 or params["scale"] > MAX_UPSCALE:
+        raise HTTPException(status_code=400, detail=f"scale must be in (0, {MAX_UPSCALE}]")
+
+def validate_remove_background(params: dict):
+    if params["output"] not in ("rgba", "mask"):
+        raise HTTPException(status_code=400, detail="output must be 'rgba' or 'mask'")
+    check_response_format(params["response_format"])
+    if params.get("quality") is not None and params["quality"] not in REMOVER_TIERS:
+        raise HTTPException(status_code=400, detail=f"quality must be one of {list(REMOVER_TIERS)}")
+
+async def upscale(content: bytes, scale: float, content_hash: str = None, source_url: str = None,
+                  response_format: str = "png") -> Response:
+    validate_upscale({"scale": scale, "response_format": response_format})
+    content = await read_input(content, content_hash, source_url)
+    metrics.observe_input("upscale", content)
+    upscaler = await get_model("upscale")
+    if STREAM_UPSCALE and response_format == "png":
+        return await upscale_stream(upscaler, content, scale)
+
+    try:
+        # The cheapest native model covering the scale runs (2x model up to 2x, else 4x),
+        # then a fast resize gives the exact (possibly fractional) scale.
+        # Tiles are micro-batched with concurrent requests (one forward pass for several tiles)
+        async with registry.gate("upscale").slot():
+            with timed(REQUEST_SECONDS, capability="upscale"):
+                result_bytes = await upscaler.process_batched(content, out_scale=scale, response_format=response_format)
+        return Response(content=result_bytes, media_type=result_media_type(response_format))
+    except QueueFull as e:
+        raise queue_full(e)
+    except Exception as e:
+        print(f"Upscale error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def upscale_stream(upscaler, content: bytes, scale: float) -> StreamingResponse:
+    """
+    PNG upscale sent as it is produced (bounded memory, see Upscaler.process_stream).
+    The admission slot is held until the body is fully sent or the client goes away.
+    """
+    slot = registry.gate("upscale").slot()
+    try:
+        await slot.__aenter__()
+    except QueueFull as e:
+        raise queue_full(e)
+    stream = upscaler.process_stream(content, out_scale=scale)
+    released = False
+    started = time.perf_counter()
+
+    async def release():
+        nonlocal released
+        if not released:
+            released = True
+            await stream.aclose()
+            await slot.__aexit__(None, None, None)
+
+    try:
+        # Decode and the first row of tiles happen here: their errors still get a status code
+        first = await stream.__anext__()
+    except Exception as e:
+        await release()
+        print(f"Upscale error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def body():
+        try:
+            yield first
+            async for chunk in stream:
+                yield chunk
+            REQUEST_SECONDS.labels(capability="upscale").observe(time.perf_counter() - started)
+        except Exception as e:
+            # Headers are gone: the connection is dropped and the client sees a truncated body
+            print(f"Upscale error while streaming: {e}")
+            raise
+        finally:
+            await release()
+
+    return StreamingResponse(body(), media_type="image/png", background=BackgroundTask(release))
+
+async def remove_background(content: bytes, output: str = "rgba", content_hash: str = None, source_url: str = None,
+                            response_format: str = "png", quality: str = None) -> Response:
+    # quality picks the rembg model tier (REMOVER_TIERS): fast ones for previews/batches, heavy for final exports
+    validate_remove_background({"output": output, "response_format": response_format, "quality": quality})
+    content = await read_input(content, content_hash, source_url)
+    metrics.observe_input("remove-background", content)
+    remover = await get_model("remove-background")
+
+    try:
+        only_mask = output == "mask"
+        async with registry.gate("remove-background").slot():
+            with timed(REQUEST_SECONDS, capability="remove-background"):
+                result_bytes = await remover.process_batched(content, only_mask=only_mask, response_format=response_format,
+                                                             quality=quality)
+        return Response(content=result_bytes, media_type=result_media_type(response_format, only_mask))
+    except QueueFull as e:
+        raise queue_full(e)
+    except Exception as e:
+        print(f"Remove BG error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def run_job(capability: str, content: bytes, params: dict) -> tuple:
+    """Runs a submitted job (see core/jobs.py) and returns (result_bytes, media_type)."""
+    metrics.observe_input(capability, content)
+    model = await registry.get(capability)
+    while True:
+        try:
+            async with registry.gate(capability).slot():
+                with timed(REQUEST_SECONDS, capability=capability):
+                    if capability == "upscale":
+                        result = await model.process_batched(content, out_scale=params["scale"], response_format=params["response_format"])
+                        return result, result_media_type(params["response_format"])
+                    only_mask = params["output"] == "mask"
+                    result = await model.process_batched(content, only_mask=only_mask, response_format=params["response_format"],
+                                                         quality=params.get("quality"))
+                    return result, result_media_type(params["response_format"], only_mask)
+        except QueueFull as e:
+            # A job waits for room in the queue instead of being shed
+            await asyncio.sleep(e.retry_after)
+
+JOB_VALIDATORS = {"upscale": validate_upscale, "remove-background": validate_remove_background}
@@ -0,0 +1,185 @@
+import os
+import math
+import struct
+import zlib
+import numpy as np
+
+# Streaming Output Configuration
+STREAM_UPSCALE = os.getenv("STREAM_UPSCALE", "true").lower() == "true"  # PNG results streamed band by band
+STREAM_PNG_LEVEL = int(os.getenv("STREAM_PNG_LEVEL", "1"))  # Same speed-first default as cv2.imencode
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_ADLER_BASE = 65521
+
+
+def _adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+    """Port of zlib's adler32_combine (not exposed by Python's zlib module)."""
+    rem = len2 % _ADLER_BASE
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % _ADLER_BASE
+    sum1 += (adler2 & 0xFFFF) + _ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xFFFF) + ((adler2 >> 16) & 0xFFFF) + _ADLER_BASE - rem
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum2 >= (_ADLER_BASE << 1):
+        sum2 -= (_ADLER_BASE << 1)
+    if sum2 >= _ADLER_BASE:
+        sum2 -= _ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def compress_rows(rows: np.ndarray, level: int = STREAM_PNG_LEVEL) -> tuple:
+    """
+    PNG-filters (Sub) and deflates a strip of rows as an independent, byte-aligned deflate segment.
+    Returns (compressed_bytes, adler32_of_filtered_data, filtered_length).
+    """
+    h, w = rows.shape[:2]
+    bpp = rows.shape[2] if rows.ndim == 3 else 1
+    flat = np.ascontiguousarray(rows).reshape(h, w * bpp)
+
+    filtered = np.empty((h, w * bpp + 1), dtype=np.uint8)
+    filtered[:, 0] = 1  # Filter type 1 (Sub): each byte minus the byte bpp to the left
+    filtered[:, 1:bpp + 1] = flat[:, :bpp]
+    filtered[:, bpp + 1:] = flat[:, bpp:] - flat[:, :-bpp]
+    raw = filtered.tobytes()
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(raw) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(raw), len(raw)
+
+
+class ChunkSink:
+    """File-like buffer drained after every band, so the response body is sent as it is produced."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data: bytes):
+        self._parts.append(data)
+
+    def drain(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+class StreamingPNGWriter:
+    """
+    Writes a PNG row strip by row strip without holding the full image
+    (same format as the backend's cpu_upscaler.StreamingPNGWriter). Strips go top to bottom.
+    """
+
+    def __init__(self, fp, width: int, height: int, channels: int):
+        color_types = {1: 0, 3: 2, 4: 6}  # L, RGB, RGBA
+        if channels not in color_types:
+            raise ValueError(f"Unsupported channel count for PNG: {channels}")
+        self.fp = fp
+        self.height = height
+        self.rows_written = 0
+        self._adler = 1
+        self._started = False
+
+        ihdr = struct.pack(">IIBBBBB", width, height, 8, color_types[channels], 0, 0, 0)
+        fp.write(_PNG_SIGNATURE)
+        fp.write(_png_chunk(b"IHDR", ihdr))
+
+    def write_rows(self, rows: np.ndarray):
+        data, adler, length = compress_rows(rows)
+        if not self._started:
+            # zlib header (deflate, 32K window)
+            data = b"\x78\x01" + data
+            self._started = True
+        self._adler = _adler32_combine(self._adler, adler, length)
+        self.rows_written += rows.shape[0]
+        if data:
+            self.fp.write(_png_chunk(b"IDAT", data))
+
+    def close(self):
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG incomplete: wrote {self.rows_written} of {self.height} rows")
+        tail = zlib.compressobj(STREAM_PNG_LEVEL, zlib.DEFLATED, -15).flush(zlib.Z_FINISH)
+        tail += struct.pack(">I", self._adler)
+        if not self._started:
+            tail = b"\x78\x01" + tail
+        self.fp.write(_png_chunk(b"IDAT", tail))
+        self.fp.write(_png_chunk(b"IEND", b""))
+
+
+def _cubic_weights(x: np.ndarray) -> np.ndarray:
+    # OpenCV's bicubic kernel (A = -0.75), one row of 4 weights per position
+    a = -0.75
+    w0 = ((a * (x + 1) - 5 * a) * (x + 1) + 8 * a) * (x + 1) - 4 * a
+    w1 = ((a + 2) * x - (a + 3)) * x * x + 1
+    w2 = ((a + 2) * (1 - x) - (a + 3)) * (1 - x) * (1 - x) + 1
+    return np.stack([w0, w1, w2, 1 - w0 - w1 - w2], axis=1)
+
+
+class RowResampler:
+    """
+    Resizes an image that arrives as horizontal bands (top to bottom) to out_width x out_height,
+    keeping only the source rows still needed by upcoming output rows. Same filters as
+    resize_to_scale (area when shrinking, bicubic when enlarging) up to rounding: bands are
+    resized horizontally with cv2, vertically with per-row weights over the buffered rows.
+    """
+
+    def __init__(self, width: int, height: int, out_width: int, out_height: int):
+        self.out_size = (out_width, out_height)
+        self.identity = (out_width, out_height) == (width, height)
+        self.shrink = out_width < width
+        if not self.identity:
+            # Source rows (out_height x taps) and their weights for every output row
+            self.rows, self.weights = self._taps(height, out_height)
+            self.last = self.rows.max(axis=1)
+        self.buffer = None  # Horizontally resized float32 rows [self.base, self.base + len)
+        self.base = 0
+        self.received = 0
+        self.next_row = 0
+
+    def _taps(self, height: int, out_height: int) -> tuple:
+        inv = height / out_height
+        o = np.arange(out_height, dtype=np.float64)
+        if self.shrink:
+            # Area: output row o covers source [o * inv, (o + 1) * inv)
+            start, end = o * inv, (o + 1) * inv
+            rows = np.floor(start)[:, None].astype(np.int64) + np.arange(int(math.ceil(inv)) + 1)
+            weights = np.clip(np.minimum(end[:, None], rows + 1) - np.maximum(start[:, None], rows), 0, None) / inv
+        else:
+            src = (o + 0.5) * inv - 0.5
+            base = np.floor(src)
+            rows = base[:, None].astype(np.int64) + np.arange(-1, 3)
+            weights = _cubic_weights(src - base)
+        # Border replicate; taps past the edge with zero weight point at a valid row too
+        return np.clip(rows, 0, height - 1), weights.astype(np.float32)
+
+    def push(self, band: np.ndarray) -> np.ndarray:
+        """Adds the next source rows; returns the output rows that became complete (may be empty)."""
+        import cv2
+        self.received += band.shape[0]
+        if self.identity:
+            self.next_row = self.received
+            return band
+        interpolation = cv2.INTER_AREA if self.shrink else cv2.INTER_CUBIC
+        band = cv2.resize(band, (self.out_size[0], band.shape[0]), interpolation=interpolation).astype(np.float32)
+        self.buffer = band if self.buffer is None else np.concatenate([self.buffer, band])
+
+        # Output rows whose last source row has arrived (last is non-decreasing)
+        end = int(np.searchsorted(self.last, self.received, side="left"))
+        start, self.next_row = self.next_row, end
+        output = np.zeros((end - start,) + band.shape[1:], dtype=np.float32)
+        for k in range(self.rows.shape[1]):
+            weights = self.weights[start:end, k].reshape((-1,) + (1,) * (band.ndim - 1))
+            output += weights * self.buffer[self.rows[start:end, k] - self.base]
+
+        # Forget source rows no upcoming output row reads
+        if end < self.out_size[1]:
+            keep_from = int(self.rows[end:].min())
+            self.buffer = self.buffer[keep_from - self.base:]
+            self.base = keep_from
+        else:
+            self.buffer = None
+        return np.clip(output.round(), 0, 255).astype(np.uint8)
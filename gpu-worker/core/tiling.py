@@ -0,0 +1,89 @@
+import os
+import math
+import time
+import torch
+
+# Tile Tuning Configuration
+# Candidate tile sizes (multiples of 64 keep the 2x model's pixel-unshuffle happy)
+TILE_CANDIDATES = sorted(int(t) for t in os.getenv("TILE_CANDIDATES", "192,256,384,512,768").split(",") if t.strip())
+TILE_DEFAULT = int(os.getenv("TILE_DEFAULT", "400"))  # Used when not calibrated (CPU, calibration off)
+TILE_MEMORY_FRACTION = float(os.getenv("TILE_MEMORY_FRACTION", "0.8"))  # Share of free memory a batch may use
+TILE_CALIBRATION = os.getenv("TILE_CALIBRATION", "true").lower() == "true"
+
+
+class TileOOM(Exception):
+    """A single tile did not fit in device memory: the request must be re-split with a smaller tile."""
+
+
+class TileTuner:
+    """
+    Picks the Real-ESRGAN tile size per request.
+    calibrate() runs each candidate tile once at container start and records its forward time and
+    peak device memory. choose() then takes the fastest tile for the image (tile count x time per
+    tile) among those whose batch fits in the currently free memory.
+    """
+
+    def __init__(self):
+        self.profiles = {}  # native scale -> {tile: {"seconds", "bytes"}}
+
+    def calibrate(self, scale: int, upsampler):
+        if not torch.cuda.is_available() or 'cuda' not in str(upsampler.device):
+            return
+        pad = upsampler.tile_pad
+        profile = {}
+        for tile in TILE_CANDIDATES:
+            size = tile + 2 * pad
+            try:
+                x = torch.rand(1, 3, size, size, device=upsampler.device)
+                if upsampler.half:
+                    x = x.half()
+                torch.cuda.empty_cache()
+                torch.cuda.reset_peak_memory_stats()
+                baseline = torch.cuda.memory_allocated()
+                with torch.no_grad():
+                    # First pass warms up cuDNN algorithm selection for this shape
+                    upsampler.model(x)
+                    torch.cuda.synchronize()
+                    started = time.perf_counter()
+                    upsampler.model(x)
+                    torch.cuda.synchronize()
+                seconds = time.perf_counter() - started
+            except torch.cuda.OutOfMemoryError:
+                # Larger candidates won't fit either
+                torch.cuda.empty_cache()
+                break
+            profile[tile] = {"seconds": seconds, "bytes": torch.cuda.max_memory_allocated() - baseline}
+            del x
+        torch.cuda.empty_cache()
+        self.profiles[scale] = profile
+        summary = ", ".join(f"{t}px {p['seconds'] * 1000:.0f}ms/{p['bytes'] / 2**20:.0f}MB" for t, p in profile.items())
+        print(f"Tile calibration x{scale}: {summary}")
+
+    def free_memory(self) -> int:
+        free, _ = torch.cuda.mem_get_info()
+        # Blocks cached by PyTorch's allocator are free for our purposes too
+        return free + torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+
+    def choose(self, scale: int, height: int, width: int, batch_size: int) -> int:
+        profile = self.profiles.get(scale)
+        if not profile:
+            return TILE_DEFAULT
+        budget = self.free_memory() * TILE_MEMORY_FRACTION
+        feasible = [t for t in profile if profile[t]["bytes"] * batch_size <= budget] or [min(profile)]
+
+        def estimated_seconds(tile):
+            tiles = math.ceil(height / tile) * math.ceil(width / tile)
+            return tiles * profile[tile]["seconds"]
+
+        # Fastest first; on ties the larger tile (fewer seams)
+        return min(feasible, key=lambda t: (estimated_seconds(t), -t))
+
+    def record_oom(self, scale: int, tile: int):
+        """Real images + concurrent work used more than calibrated: be more conservative for this tile."""
+        profile = self.profiles.get(scale, {})
+        if tile in profile:
+            profile[tile]["bytes"] = int(profile[tile]["bytes"] * 1.5)
+
+    def smaller(self, tile: int):
+        candidates = [t for t in TILE_CANDIDATES if t < tile]
+        return candidates[-1] if candidates else None
@@ -0,0 +1,143 @@
+import os
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+
+# Transfer Configuration
+# Recently received inputs, so the backend can send a content hash instead of re-uploading
+INPUT_CACHE_BYTES = int(os.getenv("INPUT_CACHE_BYTES", str(256 * 1024 * 1024)))
+# URL prefixes the worker may fetch inputs from (shared storage). Empty = source_url disabled.
+TRANSFER_ALLOWED_SOURCES = [p.strip() for p in os.getenv("TRANSFER_ALLOWED_SOURCES", "").split(",") if p.strip()]
+RESULT_FORMATS = ("png", "webp")
+
+
+class UnknownContentHash(Exception):
+    """The hash-only request referenced an input this container has not seen (caller re-sends bytes)."""
+
+
+def url_allowed(url: str, prefixes: list) -> bool:
+    """
+    True when url is under one of the allowed locations: same scheme, host and port exactly
+    (no credentials in the URL) and a path that starts at a segment boundary of the prefix's.
+    A plain startswith would let https://bucket.example.com.attacker.net through.
+    """
+    try:
+        target = urlsplit(url)
+        target_port = target.port
+    except ValueError:
+        return False
+    if target.scheme not in ("http", "https") or not target.hostname or target.username or target.password:
+        return False
+    if ".." in unquote(target.path).split("/"):
+        return False
+    for prefix in prefixes:
+        allowed = urlsplit(prefix)
+        try:
+            allowed_port = allowed.port
+        except ValueError:
+            continue
+        if (target.scheme, target.hostname, target_port) != (allowed.scheme, allowed.hostname, allowed_port):
+            continue
+        base = allowed.path.rstrip("/")
+        if not base or target.path == base or target.path.startswith(base + "/"):
+            return True
+    return False
+
+
+class InputCache:
+    """Byte-bounded LRU of raw input payloads keyed by sha256."""
+
+    def __init__(self, max_bytes: int = INPUT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        if len(content) > self.max_bytes:
+            return digest
+        with self._lock:
+            if digest in self._items:
+                self._items.move_to_end(digest)
+                return digest
+            self._items[digest] = content
+            self._size += len(content)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+        return digest
+
+    def get(self, digest: str):
+        with self._lock:
+            content = self._items.get(digest)
+            if content is not None:
+                self._items.move_to_end(digest)
+            return content
+
+
+input_cache = InputCache()
+
+
+def resolve_input(content: bytes = None, content_hash: str = None, source_url: str = None) -> bytes:
+    """
+    Returns the input bytes from, in order: the uploaded body, the local cache (content_hash),
+    or shared storage (source_url, restricted to TRANSFER_ALLOWED_SOURCES).
+    Uploaded/fetched inputs are cached so later requests can reference them by hash.
+    """
+    if content:
+        input_cache.put(content)
+        return content
+
+    if content_hash:
+        cached = input_cache.get(content_hash)
+        if cached is not None:
+            return cached
+        if not source_url:
+            raise UnknownContentHash(content_hash)
+
+    if source_url:
+        if not url_allowed(source_url, TRANSFER_ALLOWED_SOURCES):
+            raise ValueError("source_url is not an allowed shared storage location")
+        import requests
+        # No redirects: they could lead outside the allowed locations
+        response = requests.get(source_url, timeout=30, allow_redirects=False)
+        response.raise_for_status()
+        content = response.content
+        digest = input_cache.put(content)
+        if content_hash and digest != content_hash:
+            raise ValueError("Fetched content does not match content_hash")
+        return content
+
+    raise ValueError("No input provided: send a file, a content_hash or a source_url")
+
+
+def result_media_type(response_format: str = "png", only_mask: bool = False) -> str:
+    # Single-channel masks always stay PNG (WebP has no grayscale mode)
+    if response_format == "webp" and not only_mask:
+        return "image/webp"
+    return "image/png"
+
+
+def encode_bgr(image, response_format: str = "png") -> bytes:
+    """Encodes an OpenCV (BGR/BGRA) image. WebP is lossless (quality > 100 in OpenCV)."""
+    import cv2
+    if response_format == "webp":
+        ok, buffer = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, 101])
+    else:
+        ok, buffer = cv2.imencode(".png", image)
+    if not ok:
+        raise ValueError("Failed to encode output image")
+    return buffer.tobytes()
+
+
+def encode_pil(image, response_format: str = "png") -> bytes:
+    """Encodes a PIL image as lossless WebP or PNG (masks are always PNG)."""
+    buffer = io.BytesIO()
+    if result_media_type(response_format, image.mode == "L") == "image/webp":
+        image.save(buffer, format="WEBP", lossless=True)
+    else:
+        image.save(buffer, format="PNG")
+    return buffer.getvalue()
@@ -1,12 +1,50 @@
+import asyncio
+import math
+import os
+import time
 import cv2
 import numpy as np
+import sys
 import torch
+
+# Fix for basicsr + torchvision 0.17+ compatibility (must run before basicsr is imported)
+try:
+    import torchvision.transforms.functional as F
+    sys.modules.setdefault('torchvision.transforms.functional_tensor', F)
+except ImportError:
+    pass
+
 from realesrgan import RealESRGANer
 from basicsr.archs.rrdbnet_arch import RRDBNet
 from PIL import Image
 
+from core.transfer import encode_bgr
+from core.metrics import timed, DECODE_SECONDS, ENCODE_SECONDS
+from core.streaming import StreamingPNGWriter, RowResampler, ChunkSink
+from core.batching import MicroBatcher, UPSCALE_BATCH_SIZE
+from core.tiling import TileTuner, TileOOM, TILE_DEFAULT, TILE_CALIBRATION
+
+# Small images are padded up to a multiple of this so similar sizes share a batch
+TILE_BUCKET = 64
+# Output rows deflated at a time when streaming
+STREAM_SLICE_ROWS = 128
+
+def select_native_scale(requested_scale: float, available: list) -> int:
+    """Cheapest model that covers the requested scale (the largest one if none does)."""
+    covering = [scale for scale in sorted(available) if scale >= requested_scale]
+    return covering[0] if covering else max(available)
+
+def resize_to_scale(image: np.ndarray, width: int, height: int, out_scale: float) -> np.ndarray:
+    """Final fast resize from the model output to exactly out_scale x the input size."""
+    size = (max(1, int(width * out_scale)), max(1, int(height * out_scale)))
+    if size == (image.shape[1], image.shape[0]):
+        return image
+    # INTER_AREA is fast and alias-free when shrinking (the common 4x -> 3x, 2x -> 1.5x cases)
+    interpolation = cv2.INTER_AREA if size[0] < image.shape[1] else cv2.INTER_CUBIC
+    return cv2.resize(image, size, interpolation=interpolation)
+
 class Upscaler:
-    def __init__(self, model_path='weights/RealESRGAN_x4plus.pth', device=None):
+    def __init__(self, model_path='weights/RealESRGAN_x4plus.pth', device=None, model_path_x2='weights/RealESRGAN_x2plus.pth'):
         if device is None:
             self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         else:
@@ -21,14 +59,38 @@ class Upscaler:
             scale=4,
             model_path=model_path,
             model=model,
-            tile=400, # Tile partition to avoid OOM on smaller GPUs
+            tile=TILE_DEFAULT, # Tile partition to avoid OOM on smaller GPUs (batched path tunes it per request)
             tile_pad=10,
             pre_pad=0,
             half=True if 'cuda' in str(self.device) else False, # Use fp16 on CUDA
             device=self.device,
         )
+        # Native models by scale: a 2x request runs the 2x model (4x fewer output pixels than 4x + downscale)
+        self.upsamplers = {4: self.upsampler}
+        if model_path_x2 and os.path.exists(model_path_x2):
+            model_x2 = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2)
+            self.upsamplers[2] = RealESRGANer(
+                scale=2,
+                model_path=model_path_x2,
+                model=model_x2,
+                tile=TILE_DEFAULT,
+                tile_pad=10,
+                pre_pad=0,
+                half=True if 'cuda' in str(self.device) else False,
+                device=self.device,
+            )
+        else:
+            print(f"WARNING: 2x model not found at {model_path_x2}. All scales use the 4x model.")
+        # Measure time/memory per candidate tile size once per container (GPU only)
+        self.tuner = TileTuner()
+        if TILE_CALIBRATION:
+            for scale, upsampler in self.upsamplers.items():
+                self.tuner.calibrate(scale, upsampler)
+        # Tiles of concurrent requests that share a model and shape go through the network together
+        self.batcher = MicroBatcher(self._forward_tiles, max_size=UPSCALE_BATCH_SIZE, name="upscale",
+                                    model_label=lambda key: f"realesrgan-x{key[0]}")
 
-    def process(self, image_bytes: bytes, out_scale=4) -> bytes:
+    def process(self, image_bytes: bytes, out_scale=4, response_format="png") -> bytes:
         # Convert bytes to cv2 image
         nparr = np.frombuffer(image_bytes, np.uint8)
         img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
@@ -44,9 +106,182 @@ class Upscaler:
             print(f"Error during upscaling: {e}")
             raise e
 
-        # Convert back to bytes
-        is_success, buffer = cv2.imencode(".png", output)
-        if not is_success:
-            raise ValueError("Failed to encode output image")
-            
-        return buffer.tobytes()
+        # Convert back to bytes (PNG or lossless WebP)
+        return encode_bgr(output, response_format)
+
+    async def process_batched(self, image_bytes: bytes, out_scale=4, response_format="png") -> bytes:
+        """
+        Upscales by out_scale (fractional allowed) with the cheapest native model that covers it,
+        then a fast resize to the exact size. The image is cut into fixed-shape tiles that are
+        batched with the tiles of other in-flight requests (one forward pass for several tiles).
+        """
+        if out_scale <= 0:
+            raise ValueError("scale must be greater than 0")
+        img = await asyncio.to_thread(self._decode, image_bytes)
+        if img is None:
+            raise ValueError("Failed to decode image")
+
+        native_scale = select_native_scale(out_scale, list(self.upsamplers))
+        # Tile size from the image dimensions and the free device memory (calibrated profile)
+        tile = self.tuner.choose(native_scale, img.shape[0], img.shape[1], UPSCALE_BATCH_SIZE)
+        while True:
+            tiles, layout = await asyncio.to_thread(self._split_tiles, img, native_scale, tile)
+            try:
+                outputs = await self.batcher.submit_many((native_scale, tiles[0].shape), tiles)
+                break
+            except TileOOM:
+                # Out of memory even for a single tile: retry the request with a smaller tile
+                self.tuner.record_oom(native_scale, tile)
+                smaller = self.tuner.smaller(min(tile, layout[4], layout[5]))
+                if smaller is None:
+                    raise
+                print(f"Upscale OOM with {tile}px tiles, retrying with {smaller}px")
+                tile = smaller
+        return await asyncio.to_thread(self._finish, outputs, layout, native_scale, out_scale, response_format)
+
+    async def process_stream(self, image_bytes: bytes, out_scale=4):
+        """
+        Same upscale as process_batched, returned as PNG chunks produced one row of tiles at a time:
+        each row is upscaled (batched like any other tiles), resized to out_scale and deflated into
+        the PNG stream, then dropped. Peak memory follows tile height x image width instead of the
+        output size. The first chunk (PNG header + first band) is only produced once the first
+        row succeeded, so callers can still turn early errors into a proper HTTP status.
+        """
+        if out_scale <= 0:
+            raise ValueError("scale must be greater than 0")
+        img = await asyncio.to_thread(self._decode, image_bytes)
+        if img is None:
+            raise ValueError("Failed to decode image")
+
+        native_scale = select_native_scale(out_scale, list(self.upsamplers))
+        h, w = img.shape[:2]
+        out_w, out_h = max(1, int(w * out_scale)), max(1, int(h * out_scale))
+        tile = self.tuner.choose(native_scale, h, w, UPSCALE_BATCH_SIZE)
+        while True:
+            padded, layout = await asyncio.to_thread(self._plan_tiles, img, native_scale, tile)
+            try:
+                first = await self._upscale_row(padded, layout, native_scale, 0)
+                break
+            except TileOOM:
+                # Nothing sent yet: the whole request can still switch to a smaller tile
+                self.tuner.record_oom(native_scale, tile)
+                smaller = self.tuner.smaller(min(tile, layout[4], layout[5]))
+                if smaller is None:
+                    raise
+                print(f"Upscale OOM with {tile}px tiles, retrying with {smaller}px")
+                tile = smaller
+
+        rows, s = layout[2], native_scale
+        sink = ChunkSink()
+        writer = StreamingPNGWriter(sink, out_w, out_h, 3)
+        resampler = RowResampler(w * s, h * s, out_w, out_h)
+
+        encode_seconds = [0.0]
+
+        def encode_band(bodies, r):
+            # Tile outputs side by side, cropped to the image; then resize + deflate
+            started = time.perf_counter()
+            band = np.concatenate(bodies, axis=1)[:min(layout[4], h - r * layout[4]) * s, :w * s]
+            out_rows = resampler.push(band)
+            # Deflated in slices so the filter/compress temporaries stay small too
+            for y in range(0, len(out_rows), STREAM_SLICE_ROWS):
+                writer.write_rows(out_rows[y:y + STREAM_SLICE_ROWS])
+            if r == rows - 1:
+                writer.close()
+            encode_seconds[0] += time.perf_counter() - started
+            if r == rows - 1:
+                # One observation per request, like the buffered path
+                ENCODE_SECONDS.labels(capability="upscale").observe(encode_seconds[0])
+            return sink.drain()
+
+        pending = None
+        try:
+            bodies = first
+            for r in range(rows):
+                # Next row goes to the GPU while this one is resized and compressed
+                pending = asyncio.ensure_future(self._upscale_row(padded, layout, native_scale, r + 1)) if r + 1 < rows else None
+                yield await asyncio.to_thread(encode_band, bodies, r)
+                bodies = await pending if pending is not None else None
+                pending = None
+        finally:
+            if pending is not None:
+                pending.cancel()
+
+    def _decode(self, image_bytes: bytes):
+        with timed(DECODE_SECONDS, capability="upscale"):
+            return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+    async def _upscale_row(self, padded: np.ndarray, layout: tuple, native_scale: int, r: int) -> list:
+        tiles = await asyncio.to_thread(self._row_tiles, padded, layout, native_scale, r)
+        return await self.batcher.submit_many((native_scale, tiles[0].shape), tiles)
+
+    def _plan_tiles(self, img: np.ndarray, native_scale: int = 4, tile: int = TILE_DEFAULT):
+        """
+        Reflect-pads a BGR image to a whole number of equally shaped tiles plus the overlap margin
+        on every side. Images smaller than a tile become a single tile rounded up to TILE_BUCKET.
+        """
+        h, w = img.shape[:2]
+        pad = self.upsamplers[native_scale].tile_pad
+        tile_h = tile if h > tile else min(tile, math.ceil(h / TILE_BUCKET) * TILE_BUCKET)
+        tile_w = tile if w > tile else min(tile, math.ceil(w / TILE_BUCKET) * TILE_BUCKET)
+        rows, cols = math.ceil(h / tile_h), math.ceil(w / tile_w)
+
+        mode = "reflect" if min(h, w) > 1 else "edge"
+        padded = np.pad(img, ((pad, rows * tile_h - h + pad), (pad, cols * tile_w - w + pad), (0, 0)), mode=mode)
+        return padded, (h, w, rows, cols, tile_h, tile_w)
+
+    def _row_tiles(self, padded: np.ndarray, layout: tuple, native_scale: int, r: int) -> list:
+        """The RGB float tiles (3, t + 2p, t + 2p) of tile row r."""
+        _, _, _, cols, tile_h, tile_w = layout
+        pad = self.upsamplers[native_scale].tile_pad
+        y = r * tile_h
+        strip = cv2.cvtColor(padded[y:y + tile_h + 2 * pad], cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
+        strip = strip.transpose(2, 0, 1)
+        return [np.ascontiguousarray(strip[:, :, c * tile_w:c * tile_w + tile_w + 2 * pad]) for c in range(cols)]
+
+    def _split_tiles(self, img: np.ndarray, native_scale: int = 4, tile: int = TILE_DEFAULT):
+        """Splits a BGR image into equally shaped, padded RGB float tiles (3, t + 2p, t + 2p)."""
+        padded, layout = self._plan_tiles(img, native_scale, tile)
+        tiles = []
+        for r in range(layout[2]):
+            tiles.extend(self._row_tiles(padded, layout, native_scale, r))
+        return tiles, layout
+
+    def _forward_tiles(self, key, tiles: list) -> list:
+        # One forward pass for the whole batch (runs on the batcher thread)
+        upsampler = self.upsamplers[key[0]]
+        try:
+            batch = torch.from_numpy(np.stack(tiles)).to(self.device)
+            if upsampler.half:
+                batch = batch.half()
+            with torch.no_grad():
+                output = upsampler.model(batch)
+                # Keep only the tile bodies, as uint8 HWC RGB (4x less to copy off the GPU than float)
+                pad = upsampler.tile_pad * upsampler.scale
+                output = output[:, :, pad:output.shape[2] - pad, pad:output.shape[3] - pad]
+                output = output.float().clamp_(0, 1).mul_(255.0).round_().to(torch.uint8).permute(0, 2, 3, 1)
+            return list(output.cpu().numpy())
+        except torch.cuda.OutOfMemoryError:
+            batch = output = None
+            torch.cuda.empty_cache()
+            if len(tiles) == 1:
+                raise TileOOM(f"Tile {tiles[0].shape[1:]} does not fit in device memory")
+            # Split the batch before giving up on the tile size
+            half = len(tiles) // 2
+            return self._forward_tiles(key, tiles[:half]) + self._forward_tiles(key, tiles[half:])
+
+    def _finish(self, outputs: list, layout: tuple, native_scale: int, out_scale, response_format: str) -> bytes:
+        with timed(ENCODE_SECONDS, capability="upscale"):
+            return self._assemble(outputs, layout, native_scale, out_scale, response_format)
+
+    def _assemble(self, outputs: list, layout: tuple, native_scale: int, out_scale, response_format: str) -> bytes:
+        h, w, rows, cols, tile_h, tile_w = layout
+        scale = self.upsamplers[native_scale].scale
+        canvas = np.empty((rows * tile_h * scale, cols * tile_w * scale, 3), dtype=np.uint8)
+        for index, tile_out in enumerate(outputs):
+            r, c = divmod(index, cols)
+            y, x = r * tile_h * scale, c * tile_w * scale
+            canvas[y:y + tile_h * scale, x:x + tile_w * scale] = tile_out
+
+        output = cv2.cvtColor(canvas[:h * scale, :w * scale], cv2.COLOR_RGB2BGR)
+        return encode_bgr(resize_to_scale(output, w, h, out_scale), response_format)
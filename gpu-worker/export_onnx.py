@@ -0,0 +1,140 @@
+"""
+Exports Real-ESRGAN to ONNX for the backend's CPU AI upscaler (backend/onnx_upscaler.py).
+
+    # Compact model (realesr-general-x4v3, ~1.2M params): the practical choice on CPU
+    python export_onnx.py --arch compact --output weights/realesr-general-x4v3.onnx
+    # Same, int8 (static QDQ quantization calibrated on real images)
+    python export_onnx.py --arch compact --quantize --calibration-dir samples/ --output weights/realesr-general-x4v3.int8.onnx
+    # The RRDBNet x4plus model the GPU worker runs (~16.7M params, much slower on CPU)
+    python export_onnx.py --arch rrdb --output weights/RealESRGAN_x4plus.onnx
+
+Needs this worker's requirements (torch, basicsr, realesrgan) plus `pip install onnx onnxruntime sympy`.
+Then on the backend: CPU_AI_UPSCALE_MODEL=/path/to/model.onnx
+"""
+import argparse
+import glob
+import os
+import sys
+import urllib.request
+
+import numpy as np
+import torch
+
+# Fix for basicsr + torchvision 0.17+ compatibility (must run before basicsr is imported)
+try:
+    import torchvision.transforms.functional as F
+    sys.modules.setdefault('torchvision.transforms.functional_tensor', F)
+except ImportError:
+    pass
+
+from basicsr.archs.rrdbnet_arch import RRDBNet
+from realesrgan.archs.srvgg_arch import SRVGGNetCompact
+
+WEIGHTS = {
+    "compact": ("weights/realesr-general-x4v3.pth",
+                "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-x4v3.pth"),
+    "rrdb": ("weights/RealESRGAN_x4plus.pth",
+             "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth"),
+}
+CALIBRATION_TILE = 128
+CALIBRATION_TILES = 64
+
+
+def build_model(arch: str, weights_path: str) -> torch.nn.Module:
+    if arch == "compact":
+        model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu')
+    else:
+        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
+    state = torch.load(weights_path, map_location="cpu")
+    # Same key preference as RealESRGANer
+    state = state.get("params_ema", state.get("params", state))
+    model.load_state_dict(state, strict=True)
+    return model.eval()
+
+
+def export(model: torch.nn.Module, output_path: str, opset: int):
+    dummy = torch.rand(1, 3, 64, 64)
+    axes = {0: "batch", 2: "height", 3: "width"}
+    torch.onnx.export(
+        model, dummy, output_path,
+        input_names=["input"], output_names=["output"],
+        dynamic_axes={"input": axes, "output": axes},
+        opset_version=opset,
+        do_constant_folding=True,
+    )
+
+
+class TileCalibrationReader:
+    """Feeds random tiles cut from real images to onnxruntime's static quantization calibrator."""
+
+    def __init__(self, image_dir: str, tile: int = CALIBRATION_TILE, count: int = CALIBRATION_TILES):
+        from PIL import Image
+
+        paths = sorted(p for ext in ("png", "jpg", "jpeg", "webp") for p in glob.glob(os.path.join(image_dir, f"*.{ext}")))
+        if not paths:
+            raise ValueError(f"No calibration images found in {image_dir}")
+        rng = np.random.default_rng(0)
+        tiles = []
+        for i in range(count):
+            img = np.asarray(Image.open(paths[i % len(paths)]).convert("RGB"), dtype=np.float32) / 255.0
+            h, w = img.shape[:2]
+            size = min(tile, h, w)
+            y, x = rng.integers(0, h - size + 1), rng.integers(0, w - size + 1)
+            tiles.append(np.ascontiguousarray(img[y:y + size, x:x + size].transpose(2, 0, 1))[None])
+        self._tiles = iter(tiles)
+
+    def get_next(self):
+        tile = next(self._tiles, None)
+        return None if tile is None else {"input": tile}
+
+
+def quantize(fp32_path: str, output_path: str, calibration_dir: str):
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    # Shape inference + graph folding first, as onnxruntime recommends before quantizing
+    prepared_path = os.path.splitext(fp32_path)[0] + ".prep.onnx"
+    quant_pre_process(fp32_path, prepared_path)
+    # Static QDQ: int8 weights and activations, per-channel weight scales (dynamic quantization
+    # barely helps convolution-only networks)
+    quantize_static(
+        prepared_path, output_path, TileCalibrationReader(calibration_dir),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    os.remove(prepared_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--arch", choices=sorted(WEIGHTS), default="compact")
+    parser.add_argument("--weights", help="Path to the .pth weights (downloaded if missing)")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--quantize", action="store_true", help="Write an int8 model (needs --calibration-dir)")
+    parser.add_argument("--calibration-dir", help="Folder of representative images for int8 calibration")
+    args = parser.parse_args()
+    if args.quantize and not args.calibration_dir:
+        parser.error("--quantize needs --calibration-dir")
+
+    weights_path, url = WEIGHTS[args.arch]
+    weights_path = args.weights or weights_path
+    if not os.path.exists(weights_path):
+        os.makedirs(os.path.dirname(weights_path) or ".", exist_ok=True)
+        print(f"Downloading {url} -> {weights_path}")
+        urllib.request.urlretrieve(url, weights_path)
+
+    model = build_model(args.arch, weights_path)
+    fp32_path = args.output if not args.quantize else os.path.splitext(args.output)[0] + ".fp32.onnx"
+    export(model, fp32_path, args.opset)
+    print(f"Exported {args.arch} -> {fp32_path}")
+
+    if args.quantize:
+        quantize(fp32_path, args.output, args.calibration_dir)
+        print(f"Quantized int8 -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import modal
-import io
 import os
-import sys
+import time
+import asyncio
+from collections import OrderedDict
+
+REMBG_MODELS = ["u2netp", "silueta", "u2net", "isnet-general-use"]
+REMBG_DOWNLOAD = "python -c \"from rembg import new_session; [new_session(m) for m in %r]\"" % REMBG_MODELS
 
 # Define the image with necessary system and Python dependencies
 image = (
@@ -14,6 +18,8 @@ image = (
         "requests==2.31.0",
         "numpy==1.26.3",
         "Pillow==10.2.0",
+        "prometheus-client==0.19.0",
+        "nvidia-ml-py==12.535.133",
         # Install PyTorch with CUDA support
         "torch==2.2.0+cu118",
         "torchvision==0.17.0+cu118",
@@ -31,129 +37,270 @@ image = (
     .run_commands(
         # Download weights during build to bake them into the image
         "mkdir -p /weights",
-        "wget https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth -O /weights/RealESRGAN_x4plus.pth"
+        "wget https://github.com/xinntao/Real-ESRGAN/releases/download/v0.1.0/RealESRGAN_x4plus.pth -O /weights/RealESRGAN_x4plus.pth",
+        "wget https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth -O /weights/RealESRGAN_x2plus.pth",
+        # rembg otherwise downloads its models on the first session of every new container
+        # (all the REMOVER_TIERS models: a tier's first request only loads it, no download)
+        REMBG_DOWNLOAD,
     )
+    .env({"WEIGHTS_DIR": "/weights"})
+    # Model registry, model classes and endpoint logic are used as-is from core/ (shared with main.py)
+    .add_local_python_source("core")
+)
+
+# Background removal only needs rembg + onnxruntime: no torch/basicsr in the image
+# (smaller image to pull, nothing heavy to import on a cold start)
+remover_image = (
+    modal.Image.from_registry("nvidia/cuda:11.8.0-cudnn8-runtime-ubuntu22.04", add_python="3.10")
+    .apt_install("libgl1-mesa-glx", "libglib2.0-0", "libgl1")
+    .pip_install(
+        "fastapi==0.109.0",
+        "python-multipart==0.0.9",
+        "requests==2.31.0",
+        "numpy==1.26.3",
+        "Pillow==10.2.0",
+        "prometheus-client==0.19.0",
+        "nvidia-ml-py==12.535.133",
+        "rembg[gpu]==2.0.56",
+        "onnxruntime-gpu==1.17.0",
+        "opencv-python-headless==4.9.0.80",
+    )
+    .run_commands(REMBG_DOWNLOAD)
+    .add_local_python_source("core")
+)
+
+# Job API front end (core/jobs.py): validates, spawns work on the GPU classes and serves results.
+# No models or GPU here, so it stays cheap to keep warm.
+api_image = (
+    modal.Image.debian_slim(python_version="3.10")
+    .pip_install(
+        "fastapi==0.109.0",
+        "python-multipart==0.0.9",
+        "requests==2.31.0",
+        "numpy==1.26.3",
+        "Pillow==10.2.0",
+        "prometheus-client==0.19.0",
+    )
+    .add_local_python_source("core")
 )
 
 app = modal.App("dimo-gpu-worker", image=image)
 
+def scaling(prefix: str) -> dict:
+    """Per-class autoscaling settings, e.g. REMOVER_MAX_CONTAINERS=20 (read at deploy time)."""
+    return {
+        "gpu": os.environ.get(f"{prefix}_GPU", "T4"),
+        "scaledown_window": int(os.environ.get(f"{prefix}_SCALEDOWN", "300")),  # rename from container_idle_timeout
+        "max_containers": int(os.environ.get(f"{prefix}_MAX_CONTAINERS", "10")),  # rename from concurrency_limit
+        "min_containers": int(os.environ.get(f"{prefix}_MIN_CONTAINERS", "0")),  # rename from keep_warm
+    }
+
+def max_inputs(prefix: str) -> int:
+    # Several requests per container so the micro-batcher can group them into one forward pass
+    return int(os.environ.get(f"{prefix}_MAX_INPUTS", os.environ.get("MODAL_MAX_INPUTS", "16")))
+
 try:
-    from fastapi import UploadFile, File, HTTPException, Header, Depends
-    from fastapi.responses import Response
+    from fastapi import FastAPI, File, Header
 except ImportError:
-    # These imports are only needed locally for the type hints 
+    # These imports are only needed locally for the type hints
     # when Modal parses the file for deployment.
     # Inside the container, image.imports() handles them.
     pass
 
 with image.imports():
-    import cv2
-    import numpy as np
-    import torch
-    
-    # Fix for basicsr + torchvision 0.17+ compatibility
-    import sys
-    try:
-        import torchvision.transforms.functional as F
-        sys.modules['torchvision.transforms.functional_tensor'] = F
-    except ImportError:
-        pass
-
-    from realesrgan import RealESRGANer
-    from basicsr.archs.rrdbnet_arch import RRDBNet
-    from rembg import remove, new_session
+    # Neither imports torch nor rembg: models load per capability on first use (core/engine.py)
+    from core import service
+    from core.engine import registry
+    from core.jobs import job_router, deliver_callback, JobNotFound, QUEUED, RUNNING, COMPLETED, FAILED
 
-# --- Logic Classes (Ported from core/) ---
-
-class Upscaler:
-    def __init__(self, model_path='/weights/RealESRGAN_x4plus.pth', device=None):
-        if device is None:
-            self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        else:
-            self.device = device
-            
-        print(f"Initializing Upscaler on {self.device}...")
-        
-        # Initialize the model (RealESRGAN_x4plus)
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=4)
-        
-        self.upsampler = RealESRGANer(
-            scale=4,
-            model_path=model_path,
-            model=model,
-            tile=400, # Tile partition to avoid OOM
-            tile_pad=10,
-            pre_pad=0,
-            half=True if 'cuda' in str(self.device) else False,
-            device=self.device,
-        )
-
-    def process(self, image_bytes: bytes, out_scale=4) -> bytes:
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            raise ValueError("Failed to decode image")
+# --- Modal Classes with Web Endpoints ---
+# GPUWorker serves both capabilities (the URLs the backend has always used).
+# BackgroundRemoverWorker and UpscalerWorker deploy them separately, each with its own image
+# and scaling; point GPU_REMOVER_URL / GPU_UPSCALE_URL at their endpoints to use them:
+#   https://<workspace>--dimo-gpu-worker-backgroundremoverworker-remove-background.modal.run
+#   https://<workspace>--dimo-gpu-worker-upscalerworker-upscale.modal.run
 
-        try:
-            output, _ = self.upsampler.enhance(img, outscale=out_scale)
-        except RuntimeError as e:
-            print(f"Error during upscaling: {e}")
-            raise e
-
-        is_success, buffer = cv2.imencode(".png", output)
-        if not is_success:
-            raise ValueError("Failed to encode output image")
-            
-        return buffer.tobytes()
-
-class BackgroundRemover:
-    def __init__(self, model_name="u2net"):
-        print(f"Initializing BackgroundRemover with {model_name}...")
-        self.session = new_session(model_name)
-
-    def process(self, image_bytes: bytes) -> bytes:
-        output = remove(image_bytes, session=self.session)
-        return output
-
-# --- Modal Class with Web Endpoints ---
-
-@app.cls(
-    gpu="T4",
-    scaledown_window=300, # rename from container_idle_timeout
-    max_containers=10,    # rename from concurrency_limit
-    min_containers=0      # rename from keep_warm
-)
+@app.cls(**scaling("GPU_WORKER"))
+@modal.concurrent(max_inputs=max_inputs("GPU_WORKER"))
 class GPUWorker:
     @modal.enter()
     def initialize(self):
-        # Load models when the container starts
-        self.upscaler = Upscaler()
-        self.remover = BackgroundRemover()
+        # Nothing loaded here: a remove-background cold start doesn't wait for Real-ESRGAN
+        # (and its tile calibration), and vice versa. /health (the warm-up ping) starts
+        # loading both in the background.
+        registry.preload()
+
+    @modal.fastapi_endpoint(method="GET")
+    async def health(self):
+        # Probed by the backend circuit breaker (GPU_HEALTH_URL) while the GPU path is tripped.
+        # Queue depth and in-flight work show this container's real load.
+        return service.health()
+
+    @modal.fastapi_endpoint(method="GET")
+    async def metrics(self):
+        # This container's numbers only (Modal routes each scrape to one container)
+        return service.metrics_response()
 
     @modal.fastapi_endpoint(method="POST")
-    def upscale(self, file: bytes = File(...), secret: str = Header(alias="x-api-key")):
+    async def upscale(self, file: bytes = File(None), scale: float = 2.0, content_hash: str = None, source_url: str = None,
+                response_format: str = "png", secret: str = Header(alias="x-api-key")):
         # Simple security check
-        expected_secret = os.environ.get("GPU_SERVICE_SECRET", "dev-secret-123")
-        if secret != expected_secret:
-            raise HTTPException(status_code=401, detail="Invalid API Key")
+        service.check_secret(secret)
+        return await service.upscale(file, scale, content_hash, source_url, response_format)
 
-        try:
-            result_bytes = self.upscaler.process(file, out_scale=4)
-            return Response(content=result_bytes, media_type="image/png")
-        except Exception as e:
-            print(f"Upscale error: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+    @modal.fastapi_endpoint(method="POST")
+    async def remove_background(self, file: bytes = File(None), output: str = "rgba", content_hash: str = None,
+                          source_url: str = None, response_format: str = "png", quality: str = None,
+                          secret: str = Header(alias="x-api-key")):
+        service.check_secret(secret)
+        return await service.remove_background(file, output, content_hash, source_url, response_format, quality)
+
+@app.cls(image=remover_image, **scaling("REMOVER"))
+@modal.concurrent(max_inputs=max_inputs("REMOVER"))
+class BackgroundRemoverWorker:
+    @modal.enter()
+    def initialize(self):
+        registry.preload(["remove-background"])
+
+    @modal.fastapi_endpoint(method="GET")
+    async def health(self):
+        return service.health(["remove-background"])
+
+    @modal.fastapi_endpoint(method="GET")
+    async def metrics(self):
+        # This container's numbers only (Modal routes each scrape to one container)
+        return service.metrics_response()
+
+    @modal.method()
+    async def run_job(self, content: bytes, params: dict, callback_url: str = None) -> tuple:
+        return await run_job("remove-background", content, params, callback_url)
+
+    @modal.fastapi_endpoint(method="POST")
+    async def remove_background(self, file: bytes = File(None), output: str = "rgba", content_hash: str = None,
+                          source_url: str = None, response_format: str = "png", quality: str = None,
+                          secret: str = Header(alias="x-api-key")):
+        service.check_secret(secret)
+        return await service.remove_background(file, output, content_hash, source_url, response_format, quality)
+
+@app.cls(**scaling("UPSCALER"))
+@modal.concurrent(max_inputs=max_inputs("UPSCALER"))
+class UpscalerWorker:
+    @modal.enter()
+    def initialize(self):
+        registry.preload(["upscale"])
+
+    @modal.fastapi_endpoint(method="GET")
+    async def health(self):
+        return service.health(["upscale"])
+
+    @modal.fastapi_endpoint(method="GET")
+    async def metrics(self):
+        # This container's numbers only (Modal routes each scrape to one container)
+        return service.metrics_response()
 
     @modal.fastapi_endpoint(method="POST")
-    def remove_background(self, file: bytes = File(...), secret: str = Header(alias="x-api-key")):
-        expected_secret = os.environ.get("GPU_SERVICE_SECRET", "dev-secret-123")
-        if secret != expected_secret:
-            raise HTTPException(status_code=401, detail="Invalid API Key")
+    async def upscale(self, file: bytes = File(None), scale: float = 2.0, content_hash: str = None, source_url: str = None,
+                response_format: str = "png", secret: str = Header(alias="x-api-key")):
+        service.check_secret(secret)
+        return await service.upscale(file, scale, content_hash, source_url, response_format)
 
+    @modal.method()
+    async def run_job(self, content: bytes, params: dict, callback_url: str = None) -> tuple:
+        return await run_job("upscale", content, params, callback_url)
+
+async def run_job(capability: str, content: bytes, params: dict, callback_url: str = None) -> tuple:
+    """Body of the spawned job calls: the function call id is the job id."""
+    job_id = modal.current_function_call_id()
+    info = {"job_id": job_id, "capability": capability}
+    try:
+        content, media_type = await service.run_job(capability, content, params)
+    except Exception as e:
+        print(f"Job {job_id} ({capability}) failed: {e}")
+        if callback_url:
+            await asyncio.to_thread(deliver_callback, callback_url, {**info, "status": "failed", "error": str(e)})
+        raise
+    if callback_url:
+        await asyncio.to_thread(deliver_callback, callback_url, {**info, "status": "completed"}, content, media_type)
+    return content, media_type
+
+# --- Job API ---
+# Submit returns at once; the work runs as a spawned call on BackgroundRemoverWorker / UpscalerWorker
+# (their scaling applies) and Modal keeps its result, so JOB_RESULT_TTL only applies to main.py.
+#   https://<workspace>--dimo-gpu-worker-jobs-api.modal.run/jobs/upscale   (backend: GPU_JOBS_URL=<that>/jobs)
+# Modal only reports a call's status by returning its output, so a finished job's output is kept
+# here (up to JOB_RESULT_CACHE_BYTES per container) until /result serves it: polls download it once.
+JOB_RESULT_CACHE_BYTES = int(os.environ.get("JOB_RESULT_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+class ModalJobs:
+    """core/jobs.py job backend over Modal spawned function calls."""
+
+    WORKERS = {"upscale": UpscalerWorker, "remove-background": BackgroundRemoverWorker}
+
+    def __init__(self):
+        self._finished = OrderedDict()  # job_id -> (info, content, media_type), LRU
+        self._finished_bytes = 0
+
+    def _remember(self, job_id: str, outcome: tuple):
+        size = len(outcome[1] or b"")
+        if size > JOB_RESULT_CACHE_BYTES:
+            return
+        self._finished[job_id] = outcome
+        self._finished_bytes += size
+        while self._finished_bytes > JOB_RESULT_CACHE_BYTES:
+            _, (_, content, _) = self._finished.popitem(last=False)
+            self._finished_bytes -= len(content or b"")
+
+    def _forget(self, job_id: str):
+        outcome = self._finished.pop(job_id, None)
+        if outcome is not None:
+            self._finished_bytes -= len(outcome[1] or b"")
+
+    async def submit(self, capability: str, content: bytes, params: dict, callback_url: str = None) -> dict:
+        call = await self.WORKERS[capability]().run_job.spawn.aio(content, params, callback_url)
+        return {"job_id": call.object_id, "capability": capability, "status": QUEUED,
+                "created": time.time(), "finished": None, "error": None}
+
+    async def _poll(self, job_id: str, wait: float) -> tuple:
+        # (info, content, media_type): get() with a timeout is the only status Modal exposes
+        if job_id in self._finished:
+            self._finished.move_to_end(job_id)
+            return self._finished[job_id]
+        info = {"job_id": job_id, "capability": None, "status": RUNNING, "created": None, "finished": None, "error": None}
         try:
-            result_bytes = self.remover.process(file)
-            return Response(content=result_bytes, media_type="image/png")
+            call = modal.FunctionCall.from_id(job_id)
+            content, media_type = await call.get.aio(timeout=wait)
+        except modal.exception.FunctionTimeoutError as e:
+            # The job itself ran out of time (not our poll)
+            outcome = {**info, "status": FAILED, "error": str(e)}, None, None
+        except (TimeoutError, modal.exception.TimeoutError):
+            return info, None, None
+        except (modal.exception.NotFoundError, modal.exception.OutputExpiredError, modal.exception.InvalidError):
+            raise JobNotFound(job_id)
         except Exception as e:
-            print(f"Remove BG error: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+            outcome = {**info, "status": FAILED, "error": str(e)}, None, None
+        else:
+            outcome = {**info, "status": COMPLETED}, content, media_type
+        self._remember(job_id, outcome)
+        return outcome
+
+    async def status(self, job_id: str, wait: float = 0) -> dict:
+        info, _, _ = await self._poll(job_id, wait)
+        return info
+
+    async def result(self, job_id: str) -> tuple:
+        outcome = await self._poll(job_id, 0)
+        # Served: free the memory (a repeated /result fetches it from Modal again)
+        self._forget(job_id)
+        return outcome
+
+@app.function(image=api_image)
+@modal.concurrent(max_inputs=100)
+@modal.asgi_app()
+def jobs_api():
+    api = FastAPI(title="Dimo GPU Worker Jobs")
+
+    async def verify_token(x_api_key: str = Header(...)):
+        service.check_secret(x_api_key)
+
+    api.include_router(job_router(ModalJobs(), verify_token))
+    return api
@@ -0,0 +1,265 @@
+"""
+Local stand-in for the GPU worker: same /health, /upscale, /remove-background and /jobs contract,
+no GPU or models. It simulates a scale-to-zero container (cold start after idle time), noisy
+service times, failures and a bounded queue, so the backend router, circuit breaker, warmer and
+CPU fallback can be exercised offline (see loadtest_processing.py at the repository root).
+
+    STANDIN_COLD_START=8 STANDIN_SCALEDOWN=60 uvicorn stand_in:app --port 8001
+    # backend: APP_ENV=dev GPU_SERVICE_URL=http://localhost:8001
+
+Behaviour can be changed while running: PUT /stand-in/behavior {"error_rate": 0.2, ...}
+(same names as the STANDIN_* variables, lower case, plus "seed"); GET /stand-in/stats for what it did.
+"""
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends, Response, Body
+from PIL import Image
+import asyncio
+import random
+import time
+import os
+import io
+
+from core.transfer import resolve_input, UnknownContentHash
+from core.admission import ModelGate, QueueFull
+from core.jobs import LocalJobs, job_router
+
+# Stand-in Configuration
+STANDIN_COLD_START = float(os.getenv("STANDIN_COLD_START", "10"))  # Seconds to "load models"
+STANDIN_SCALEDOWN = float(os.getenv("STANDIN_SCALEDOWN", "300"))  # Idle seconds before scaling to zero
+STANDIN_SECONDS_PER_MP = float(os.getenv("STANDIN_SECONDS_PER_MP", "0.5"))  # Simulated inference time
+STANDIN_BASE_LATENCY = float(os.getenv("STANDIN_BASE_LATENCY", "0.05"))  # Fixed cost per request
+# Service time noise: fixed | lognormal | exponential | uniform (all with mean 1, spread set by sigma)
+STANDIN_LATENCY_DIST = os.getenv("STANDIN_LATENCY_DIST", "lognormal")
+STANDIN_LATENCY_SIGMA = float(os.getenv("STANDIN_LATENCY_SIGMA", "0.3"))
+# Occasional stragglers: this fraction of requests takes STANDIN_TAIL_FACTOR x longer
+STANDIN_TAIL_RATE = float(os.getenv("STANDIN_TAIL_RATE", "0"))
+STANDIN_TAIL_FACTOR = float(os.getenv("STANDIN_TAIL_FACTOR", "10"))
+# Failures: 500 after the work, or no answer for STANDIN_HANG_SECONDS (client read timeouts)
+STANDIN_ERROR_RATE = float(os.getenv("STANDIN_ERROR_RATE", "0"))
+STANDIN_HANG_RATE = float(os.getenv("STANDIN_HANG_RATE", "0"))
+STANDIN_HANG_SECONDS = float(os.getenv("STANDIN_HANG_SECONDS", "120"))
+# Admission control like the real worker: beyond the queue, 503 + Retry-After
+STANDIN_CONCURRENCY = int(os.getenv("STANDIN_CONCURRENCY", "4"))
+STANDIN_MAX_QUEUE = int(os.getenv("STANDIN_MAX_QUEUE", "16"))
+STANDIN_SEED = os.getenv("STANDIN_SEED")  # Reproducible runs
+
+app = FastAPI(title="Dimo GPU Worker (stand-in)")
+
+API_SECRET = os.getenv("GPU_SERVICE_SECRET", "dev-secret-123")
+
+async def verify_token(x_api_key: str = Header(...)):
+    if x_api_key != API_SECRET:
+        raise HTTPException(status_code=401, detail="Invalid API Key")
+
+class Behavior:
+    """Simulated worker behaviour (initially from the STANDIN_* variables)."""
+
+    def __init__(self):
+        self.cold_start = STANDIN_COLD_START
+        self.scaledown = STANDIN_SCALEDOWN
+        self.seconds_per_mp = STANDIN_SECONDS_PER_MP
+        self.base_latency = STANDIN_BASE_LATENCY
+        self.latency_dist = STANDIN_LATENCY_DIST
+        self.latency_sigma = STANDIN_LATENCY_SIGMA
+        self.tail_rate = STANDIN_TAIL_RATE
+        self.tail_factor = STANDIN_TAIL_FACTOR
+        self.error_rate = STANDIN_ERROR_RATE
+        self.hang_rate = STANDIN_HANG_RATE
+        self.hang_seconds = STANDIN_HANG_SECONDS
+        self.concurrency = STANDIN_CONCURRENCY
+        self.max_queue = STANDIN_MAX_QUEUE
+        self.rng = random.Random(int(STANDIN_SEED) if STANDIN_SEED else None)
+
+    def update(self, changes: dict):
+        for name, value in changes.items():
+            if name == "seed":
+                self.rng.seed(value)
+                continue
+            if name == "rng" or not hasattr(self, name):
+                raise HTTPException(status_code=400, detail=f"Unknown behavior setting '{name}'")
+            setattr(self, name, type(getattr(self, name))(value))
+
+    def settings(self) -> dict:
+        return {name: value for name, value in vars(self).items() if name != "rng"}
+
+    def noise(self) -> float:
+        sigma = self.latency_sigma
+        if self.latency_dist == "lognormal":
+            return self.rng.lognormvariate(-sigma * sigma / 2, sigma)
+        if self.latency_dist == "exponential":
+            return self.rng.expovariate(1.0)
+        if self.latency_dist == "uniform":
+            return self.rng.uniform(max(0.0, 1 - sigma), 1 + sigma)
+        return 1.0
+
+    def service_time(self, megapixels: float) -> float:
+        seconds = (self.base_latency + self.seconds_per_mp * megapixels) * self.noise()
+        if self.rng.random() < self.tail_rate:
+            seconds *= self.tail_factor
+        return seconds
+
+behavior = Behavior()
+
+class Container:
+    """Simulated scale-to-zero container: the first call after `scaledown` idle seconds pays the cold start."""
+
+    def __init__(self):
+        self.last_used = None
+        self.cold_starts = 0
+        self._lock = asyncio.Lock()
+
+    def is_warm(self) -> bool:
+        return self.last_used is not None and time.monotonic() - self.last_used < behavior.scaledown
+
+    async def acquire(self):
+        if not self.is_warm():
+            async with self._lock:
+                # Concurrent requests wait for the same boot
+                if not self.is_warm():
+                    self.cold_starts += 1
+                    print(f"Stand-in cold start #{self.cold_starts} ({behavior.cold_start}s)")
+                    await asyncio.sleep(behavior.cold_start)
+                    self.last_used = time.monotonic()
+        self.last_used = time.monotonic()
+
+container = Container()
+gates = {}
+stats = {}
+
+def gate(capability: str) -> ModelGate:
+    # Rebuilt when the limits change
+    current = gates.get(capability)
+    if current is None or (current.concurrency, current.max_queue) != (max(1, behavior.concurrency), max(0, behavior.max_queue)):
+        current = gates[capability] = ModelGate(capability, behavior.concurrency, behavior.max_queue)
+    return current
+
+def count(capability: str, outcome: str):
+    per_capability = stats.setdefault(capability, {})
+    per_capability[outcome] = per_capability.get(outcome, 0) + 1
+
+async def simulate_inference(capability: str, megapixels: float):
+    """Waits for an admission slot, then the simulated service time; may fail or hang as configured."""
+    try:
+        async with gate(capability).slot():
+            await asyncio.sleep(behavior.service_time(megapixels))
+            container.last_used = time.monotonic()
+            if behavior.rng.random() < behavior.hang_rate:
+                count(capability, "hung")
+                await asyncio.sleep(behavior.hang_seconds)
+            if behavior.rng.random() < behavior.error_rate:
+                count(capability, "failed")
+                raise HTTPException(status_code=500, detail="Simulated inference failure")
+    except QueueFull as e:
+        count(capability, "shed")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    count(capability, "served")
+
+async def read_input(file: UploadFile, content_hash: str) -> bytes:
+    content = await file.read() if file is not None else None
+    try:
+        return resolve_input(content, content_hash)
+    except UnknownContentHash:
+        raise HTTPException(status_code=404, detail="unknown content_hash")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def encode(img: Image.Image, response_format: str) -> tuple:
+    buffer = io.BytesIO()
+    if response_format == "webp" and img.mode != "L":
+        img.save(buffer, format="WEBP", lossless=True)
+        return buffer.getvalue(), "image/webp"
+    img.save(buffer, format="PNG")
+    return buffer.getvalue(), "image/png"
+
+async def run(capability: str, content: bytes, params: dict) -> tuple:
+    """Simulated work behind both the synchronous endpoints and the job API: (bytes, media_type)."""
+    await container.acquire()
+    if capability == "upscale":
+        img = Image.open(io.BytesIO(content)).convert("RGB")
+        # Like the real worker, the output is exactly 'scale' x the input
+        scale = params["scale"]
+        out_size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        await simulate_inference(capability, out_size[0] * out_size[1] / 1_000_000)
+        return encode(img.resize(out_size, Image.Resampling.BICUBIC), params["response_format"])
+
+    img = Image.open(io.BytesIO(content)).convert("RGBA")
+    await simulate_inference(capability, img.width * img.height / 1_000_000)
+    # Fake matte: everything opaque except a transparent border
+    mask = Image.new("L", img.size, 0)
+    border_x, border_y = img.width // 10, img.height // 10
+    mask.paste(255, (border_x, border_y, img.width - border_x, img.height - border_y))
+    if params["output"] == "mask":
+        return encode(mask, params["response_format"])
+    img.putalpha(mask)
+    return encode(img, params["response_format"])
+
+async def _run_job(capability: str, content: bytes, params: dict) -> tuple:
+    # Jobs wait for room in the queue instead of being shed, like service.run_job
+    while True:
+        try:
+            return await run(capability, content, params)
+        except HTTPException as e:
+            if e.status_code != 503:
+                raise RuntimeError(e.detail)
+            await asyncio.sleep(float(e.headers["Retry-After"]))
+
+app.include_router(job_router(LocalJobs(_run_job), verify_token))
+
+@app.get("/health")
+async def health():
+    # Like Modal, hitting the health endpoint boots a container
+    await container.acquire()
+    return {
+        "status": "ok",
+        "gpu": False,
+        "stand_in": True,
+        "cold_starts": container.cold_starts,
+        "queues": {capability: current.status() for capability, current in gates.items()},
+    }
+
+@app.get("/stand-in/stats")
+async def get_stats():
+    return {"cold_starts": container.cold_starts, "requests": stats, "behavior": behavior.settings()}
+
+@app.put("/stand-in/behavior")
+async def put_behavior(changes: dict = Body(...), _: str = Depends(verify_token)):
+    behavior.update(changes)
+    return behavior.settings()
+
+@app.post("/stand-in/reset")
+async def reset(_: str = Depends(verify_token)):
+    """Cold container, empty stats (between load-test scenarios)."""
+    container.last_used = None
+    container.cold_starts = 0
+    stats.clear()
+    return {"status": "ok"}
+
+@app.post("/upscale")
+async def upscale(
+    file: UploadFile = File(None),
+    scale: float = 2.0,
+    content_hash: str = None,
+    response_format: str = "png",
+    _: str = Depends(verify_token)
+):
+    content = await read_input(file, content_hash)
+    result, media_type = await run("upscale", content, {"scale": scale, "response_format": response_format})
+    return Response(content=result, media_type=media_type)
+
+@app.post("/remove-background")
+async def remove_bg(
+    file: UploadFile = File(None),
+    output: str = "rgba",
+    content_hash: str = None,
+    response_format: str = "png",
+    quality: str = None,
+    _: str = Depends(verify_token)
+):
+    if output not in ("rgba", "mask"):
+        raise HTTPException(status_code=400, detail="output must be 'rgba' or 'mask'")
+    content = await read_input(file, content_hash)
+    result, media_type = await run("remove-background", content, {"output": output, "response_format": response_format})
+    return Response(content=result, media_type=media_type)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8001")))
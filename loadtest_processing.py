@@ -0,0 +1,278 @@
+"""
+Load test of the backend's processing endpoints against the local GPU-worker stand-in
+(gpu-worker/stand_in.py). Runs fully offline: the stand-in serves the worker contract on
+localhost and the backend app is driven in-process (auth bypassed, throwaway SQLite database).
+
+Each scenario gives the stand-in a behaviour (slow, cold, failing, overloaded, down...) and
+sends --requests requests per endpoint with --concurrency in flight. Reported per scenario and
+endpoint: throughput, p50/p95/p99 latency, error rate and fallback rate (requests the backend
+finished on its CPU path instead of the GPU worker).
+
+    python loadtest_processing.py --scenario all --requests 100 --concurrency 8
+    python loadtest_processing.py --scenario flaky --endpoint upscale --json report.json
+
+The remove-background CPU fallback needs rembg's u2net model, normally downloaded on first use.
+In offline CI pass --simulate-cpu-remover (seconds per megapixel) to replace it with a sleep.
+Every scenario runs in a fresh process, so breaker/router state never leaks between them.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SECRET = "loadtest-secret"
+
+# Stand-in behaviour per scenario (on top of BASE_BEHAVIOR); "down" starts no stand-in at all
+BASE_BEHAVIOR = {"cold_start": 0, "scaledown": 3600, "seconds_per_mp": 0.5, "base_latency": 0.05,
+                 "latency_dist": "lognormal", "latency_sigma": 0.3, "concurrency": 8, "max_queue": 64}
+SCENARIOS = {
+    "healthy": {},
+    "slow": {"seconds_per_mp": 3.0, "latency_sigma": 0.8, "tail_rate": 0.05, "tail_factor": 8},
+    "cold": {"cold_start": 8, "scaledown": 3},
+    "flaky": {"error_rate": 0.2},
+    "hanging": {"hang_rate": 0.1, "hang_seconds": 30},
+    "overloaded": {"concurrency": 1, "max_queue": 2, "seconds_per_mp": 1.0},
+    "down": None,
+}
+ENDPOINTS = ("remove-background", "upscale")
+
+
+def percentile(values: list, q: float):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_image(size: int) -> bytes:
+    """Smooth gradient + noise PNG, size px on its longest side (4:3)."""
+    width, height = size, size * 3 // 4
+    y, x = np.mgrid[0:height, 0:width]
+    rng = np.random.default_rng(0)
+    img = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=2)
+    img = np.clip(img + rng.integers(-20, 20, img.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(img).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def start_stand_in(port: int, behavior: dict):
+    sys.path.insert(0, os.path.join(ROOT, "gpu-worker"))
+    import uvicorn
+    import stand_in
+
+    stand_in.behavior.update(behavior)
+    server = uvicorn.Server(uvicorn.Config(stand_in.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return stand_in
+
+
+def simulate_cpu_remover(seconds_per_mp: float):
+    """Offline replacement for rembg on the backend's CPU path: sleeps, returns the input as the cut-out."""
+    def remove(data, session=None, only_mask=False):
+        img = Image.open(io.BytesIO(data))
+        time.sleep(seconds_per_mp * img.width * img.height / 1_000_000)
+        buffer = io.BytesIO()
+        (img.convert("L") if only_mask else img.convert("RGBA")).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    rembg = types.ModuleType("rembg")
+    rembg.new_session = lambda *args, **kwargs: None
+    rembg.remove = remove
+    sys.modules["rembg"] = rembg
+
+
+async def drive(client, endpoint: str, image: bytes, requests: int, concurrency: int, poll_interval: float) -> dict:
+    latencies, errors = [], []
+    remaining = iter(range(requests))
+
+    async def one(index: int):
+        started = time.monotonic()
+        # Distinct bytes per request (ignored after the PNG end chunk), or identical in-flight
+        # upscales would be deduplicated into one task
+        files = {"image": ("image.png", image + f"loadtest-{index}".encode(), "image/png")}
+        if endpoint == "remove-background":
+            response = await client.post("/api/remove-background", files=files, data={"output": "rgba"})
+            if response.status_code != 200:
+                raise RuntimeError(f"{response.status_code} {response.text[:200]}")
+        else:
+            response = await client.post("/api/upscale", files=files, data={"factor": "2"})
+            if response.status_code != 200:
+                raise RuntimeError(f"{response.status_code} {response.text[:200]}")
+            task_id = response.json()["task_id"]
+            while True:
+                status = (await client.get(f"/api/processing/tasks/{task_id}")).json()
+                if status["status"] == "COMPLETED":
+                    break
+                if status["status"] == "FAILED":
+                    raise RuntimeError(status["error"])
+                await asyncio.sleep(poll_interval)
+        return time.monotonic() - started
+
+    async def worker():
+        for index in remaining:
+            try:
+                latencies.append(await one(index))
+            except Exception as e:
+                errors.append(str(e))
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"duration": time.monotonic() - started, "latencies": latencies, "errors": errors}
+
+
+async def run_scenario(args) -> list:
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.update({
+        "APP_ENV": "loadtest",
+        "GPU_SERVICE_URL": f"http://127.0.0.1:{port}",
+        "GPU_SERVICE_SECRET": SECRET,
+        "DATABASE_URL": f"sqlite:///{workdir}/loadtest.db",
+        "DATABASE_URL_LOCAL": f"sqlite:///{workdir}/loadtest.db",
+        # Task results (and the database holding the inputs) stay in the scenario's workdir, removed at the end
+        "STATIC_DIR": os.path.join(workdir, "static"),
+        # Hung requests should cost seconds here, not the production minute
+        "GPU_READ_TIMEOUT": os.environ.get("GPU_READ_TIMEOUT", "15"),
+        "GPU_JOB_POLL_WAIT": os.environ.get("GPU_JOB_POLL_WAIT", "5"),
+    })
+    try:
+        return await _run_scenario(args, port)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def _run_scenario(args, port: int) -> list:
+    behavior = SCENARIOS[args.run_scenario]
+    stand_in = start_stand_in(port, {**BASE_BEHAVIOR, **behavior}) if behavior is not None else None
+    if args.simulate_cpu_remover is not None:
+        simulate_cpu_remover(args.simulate_cpu_remover)
+
+    sys.path.insert(0, ROOT)
+    import httpx
+    from backend import main
+    from backend.deps import get_approved_user
+    from backend.services.gpu_router import gpu_router
+
+    main.app.dependency_overrides[get_approved_user] = lambda: types.SimpleNamespace(id=0, is_approved=True, is_admin=True)
+    # Every request finished on the CPU path ends with gpu_router.record_cpu
+    cpu_finished = {}
+    record_cpu = gpu_router.record_cpu
+
+    def counting_record_cpu(capability, megapixels, seconds):
+        cpu_finished[capability] = cpu_finished.get(capability, 0) + 1
+        record_cpu(capability, megapixels, seconds)
+
+    gpu_router.record_cpu = counting_record_cpu
+
+    image = test_image(args.size)
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    # Same startup as production: pooled GPU client and warmer
+    async with main.app.router.lifespan_context(main.app), \
+            httpx.AsyncClient(transport=transport, base_url="http://backend", timeout=None) as client:
+        for endpoint in args.endpoint:
+            if stand_in is not None:
+                stand_in.container.last_used = None
+                stand_in.container.cold_starts = 0
+                stand_in.stats.clear()
+            cpu_finished.clear()
+            if args.warmup:
+                # The editor's warm-up call when a user opens an image (see gpu_warmer)
+                await client.post("/api/processing/warmup")
+            run = await drive(client, endpoint, image, args.requests, args.concurrency, args.poll_interval)
+            latencies, completed = run["latencies"], len(run["latencies"])
+            results.append({
+                "scenario": args.run_scenario,
+                "endpoint": endpoint,
+                "requests": args.requests,
+                "completed": completed,
+                "duration": round(run["duration"], 2),
+                "throughput": round(completed / run["duration"], 2) if run["duration"] else None,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "error_rate": round(len(run["errors"]) / args.requests, 3),
+                "fallback_rate": round(cpu_finished.get(endpoint, 0) / completed, 3) if completed else None,
+                "errors": sorted(set(run["errors"]))[:5],
+                "stand_in": {"cold_starts": stand_in.container.cold_starts, "requests": dict(stand_in.stats)} if stand_in else None,
+            })
+    return results
+
+
+def print_table(results: list):
+    print(f"{'scenario':<11} {'endpoint':<18} {'ok':>5} {'req/s':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'errors':>7} {'fallback':>9}")
+    for r in results:
+        fmt = lambda v: f"{v:.2f}" if v is not None else "-"
+        fallback = f"{r['fallback_rate']:.1%}" if r["fallback_rate"] is not None else "-"
+        print(f"{r['scenario']:<11} {r['endpoint']:<18} {r['completed']:>5} {fmt(r['throughput']):>7} {fmt(r['p50']):>7} "
+              f"{fmt(r['p95']):>7} {fmt(r['p99']):>7} {r['error_rate']:>7.1%} {fallback:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", default="all", choices=["all", *SCENARIOS])
+    parser.add_argument("--endpoint", action="append", choices=ENDPOINTS, help="Endpoint to load (repeatable, default both)")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per endpoint and scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--size", type=int, default=800, help="Test image size (longest side, px)")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="Upscale task status polling (s)")
+    parser.add_argument("--simulate-cpu-remover", type=float, metavar="SECONDS_PER_MP",
+                        help="Replace rembg on the backend CPU path with a sleep (offline CI)")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false",
+                        help="Skip the editor's warm-up call before each endpoint's run (cold router start)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.endpoint = args.endpoint or list(ENDPOINTS)
+
+    if args.run_scenario:
+        # Child process: one scenario, results to --result-file
+        results = asyncio.run(run_scenario(args))
+        with open(args.result_file, "w") as f:
+            json.dump(results, f)
+        return
+
+    results = []
+    for scenario in (SCENARIOS if args.scenario == "all" else [args.scenario]):
+        with tempfile.NamedTemporaryFile(suffix=".json") as result_file:
+            command = [sys.executable, os.path.abspath(__file__), "--run-scenario", scenario, "--result-file", result_file.name,
+                       "--requests", str(args.requests), "--concurrency", str(args.concurrency), "--size", str(args.size),
+                       "--poll-interval", str(args.poll_interval)]
+            if not args.warmup:
+                command.append("--no-warmup")
+            command += [arg for endpoint in args.endpoint for arg in ("--endpoint", endpoint)]
+            if args.simulate_cpu_remover is not None:
+                command += ["--simulate-cpu-remover", str(args.simulate_cpu_remover)]
+            print(f"Running scenario '{scenario}'...", file=sys.stderr)
+            if subprocess.run(command).returncode != 0:
+                print(f"Scenario '{scenario}' crashed", file=sys.stderr)
+                continue
+            results.extend(json.load(open(result_file.name)))
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
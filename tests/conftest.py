@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+import pytest
+
+# The backend connects at import time: tests run against a throwaway SQLite database
+# and write results to a temporary static directory, never to the developer's.
+_workdir = tempfile.mkdtemp(prefix="dimo-tests-")
+os.environ["APP_ENV"] = "test"
+os.environ["DATABASE_URL_LOCAL"] = f"sqlite:///{_workdir}/test.db"
+os.environ["STATIC_DIR"] = os.path.join(_workdir, "static")
+os.environ["RESULT_STORAGE"] = "local"
+
+
+@pytest.fixture
+def queue_db():
+    """Empty processing_tasks / processing_task_inputs tables, cleared again after the test."""
+    from backend import models
+    from backend.database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine, tables=[models.ProcessingTask.__table__, models.ProcessingTaskInput.__table__])
+    yield
+    db = SessionLocal()
+    try:
+        db.query(models.ProcessingTask).delete()
+        db.query(models.ProcessingTaskInput).delete()
+        db.commit()
+    finally:
+        db.close()
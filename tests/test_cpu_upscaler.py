@@ -0,0 +1,77 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from backend import cpu_upscaler
+
+
+def full_image_upscale(img_pil: Image.Image, factor: float, detail_boost: float = 1.5) -> np.ndarray:
+    """The single-threaded pipeline the band engine replaced (baseline upscale_image_legacy)."""
+    width, height = img_pil.size
+    if width < 1000:
+        img_pil = img_pil.filter(ImageFilter.MedianFilter(size=3))
+    result = img_pil.resize((int(width * factor), int(height * factor)), Image.Resampling.LANCZOS)
+    if detail_boost > 0:
+        result = result.filter(ImageFilter.UnsharpMask(radius=1 + (factor / 4), percent=int(100 * detail_boost), threshold=3))
+    return np.asarray(result)
+
+
+def random_image(width: int, height: int, mode: str, seed: int = 0) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (height, width, len(mode)), dtype=np.uint8), mode)
+
+
+@pytest.mark.parametrize("width,height,factor,mode,band_rows", [
+    (1200, 700, 1.5, "RGBA", 256),  # Fractional factors used to drift from row 256 on
+    (800, 600, 1.5, "RGB", 256),
+    (180, 120, 2.5, "RGBA", 32),
+    (300, 200, 2, "RGB", 64),
+    (150, 97, 4, "RGB", 100),
+    (640, 480, 0.75, "RGB", 64),
+])
+def test_bands_match_full_image_pipeline(width, height, factor, mode, band_rows):
+    img_pil = random_image(width, height, mode)
+    buffer = io.BytesIO()
+    cpu_upscaler.upscale_to_stream(img_pil, buffer, factor, workers=4, band_rows=band_rows)
+
+    result = np.asarray(Image.open(io.BytesIO(buffer.getvalue())))
+    np.testing.assert_array_equal(result, full_image_upscale(img_pil, factor))
+
+
+@pytest.mark.parametrize("width,height,factor,band_rows", [
+    (300, 201, 1.5, 16),  # Odd height at 1.5x: no row stride shorter than the whole image
+    (257, 131, 3.3, 64),
+    (640, 481, 0.75, 64),
+])
+def test_unaligned_bands_stay_within_tolerance(width, height, factor, band_rows):
+    img_pil = random_image(width, height, "RGB")
+    new_height = int(height * factor)
+    assert cpu_upscaler._row_step(height, new_height, band_rows) is None
+    assert len(cpu_upscaler._plan_bands(new_height, band_rows)) > 1
+    buffer = io.BytesIO()
+    cpu_upscaler.upscale_to_stream(img_pil, buffer, factor, workers=4, band_rows=band_rows)
+
+    result = np.asarray(Image.open(io.BytesIO(buffer.getvalue()))).astype(int)
+    diff = np.abs(result - full_image_upscale(img_pil, factor))
+    assert diff.max() <= 8
+    assert (diff > 0).mean() < 1e-3
+
+
+def test_without_detail_boost():
+    img_pil = random_image(400, 300, "RGB", seed=1)
+    buffer = io.BytesIO()
+    cpu_upscaler.upscale_to_stream(img_pil, buffer, 1.5, detail_boost=0, band_rows=40)
+
+    result = np.asarray(Image.open(io.BytesIO(buffer.getvalue())))
+    np.testing.assert_array_equal(result, full_image_upscale(img_pil, 1.5, detail_boost=0))
+
+
+@pytest.mark.parametrize("height,new_height,band_rows", [(700, 1050, 256), (200, 400, 64), (1000, 3300, 50)])
+def test_band_starts_map_to_whole_source_rows(height, new_height, band_rows):
+    bands = cpu_upscaler._plan_bands(new_height, band_rows, cpu_upscaler._row_step(height, new_height, band_rows))
+    assert len(bands) > 1
+    assert bands[0][0] == 0 and bands[-1][1] == new_height
+    for start, _ in bands:
+        assert start * height % new_height == 0
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from backend.services import gpu_router as router_module
+from backend.services.gpu_router import GPURouter, GPU_BASE_LATENCY, GPU_COLD_THRESHOLD
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(router_module, "time", clock)
+    return clock
+
+
+def run_queued_request(monkeypatch, clock, elapsed: float, queued_ahead: int) -> GPURouter:
+    """One request dispatched behind queued_ahead others, answering after elapsed seconds."""
+    async def post(url, **kwargs):
+        clock.now += elapsed
+        return "response"
+
+    monkeypatch.setattr(router_module.gpu_client, "post", post)
+    router = GPURouter()
+    router.configure("upscale", ["http://gpu/upscale"])
+    backend = router.backends("upscale")[0]
+    backend.seconds_per_mp = 1.0
+    backend.last_completed = clock.now  # Warm
+    backend.in_flight = queued_ahead
+
+    async def call():
+        return await router._dispatch(backend, 1.0)
+
+    assert asyncio.run(call()) == "response"
+    assert backend.in_flight == queued_ahead
+    return router
+
+
+@pytest.mark.parametrize("extra,cold", [(-0.5, False), (0.5, True)])
+def test_cold_threshold_counts_each_queued_request_once(monkeypatch, clock, extra, cold):
+    service = GPU_BASE_LATENCY + 1.0
+    # Two requests ahead, then this one: 3 service times when warm
+    router = run_queued_request(monkeypatch, clock, 3 * service + GPU_COLD_THRESHOLD + extra, queued_ahead=2)
+    assert router._requests["upscale"] == {"total": 1, "cold": int(cold)}
@@ -0,0 +1,100 @@
+import asyncio
+import io
+import json
+import uuid
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from backend import main
+from backend.deps import get_approved_user
+from backend.services import task_queue
+from backend.services.result_store import result_store
+
+
+def png(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def decode(data: bytes) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(data)))
+
+
+@pytest.fixture
+def client():
+    main.app.dependency_overrides[get_approved_user] = lambda: None
+    yield TestClient(main.app)
+    main.app.dependency_overrides.pop(get_approved_user, None)
+
+
+@pytest.fixture
+def image_and_mask():
+    image = np.random.default_rng(0).integers(0, 256, (40, 60, 3), dtype=np.uint8)
+    mask = np.zeros((40, 60), dtype=np.uint8)
+    mask[10:30, 20:50] = 255
+    return image, mask
+
+
+def test_manual_mask_keeps_only_the_masked_area(client, image_and_mask):
+    image, mask = image_and_mask
+    response = client.post("/api/remove-background", files={
+        "image": ("image.png", png(image), "image/png"), "mask": ("mask.png", png(mask), "image/png"),
+    })
+    assert response.status_code == 200
+    result = decode(response.content)
+    np.testing.assert_array_equal(result[:, :, 3], mask)
+    np.testing.assert_array_equal(result[:, :, :3], image)
+
+
+def test_manual_mask_refine_and_mask_output(client, image_and_mask):
+    image, mask = image_and_mask
+    mask[0, 0] = 255  # Isolated speck, dropped by refine
+    response = client.post("/api/remove-background", data={"refine": "true", "output": "mask"}, files={
+        "image": ("image.png", png(image), "image/png"), "mask": ("mask.png", png(mask), "image/png"),
+    })
+    assert response.status_code == 200
+    alpha = decode(response.content)
+    assert alpha.ndim == 2 and alpha[0, 0] == 0
+    assert alpha[20, 35] == 255 and alpha[5, 5] == 0
+
+
+def test_manual_mask_task(queue_db, image_and_mask):
+    image, mask = image_and_mask
+    task_id = str(uuid.uuid4())
+    params = {"colors": None, "threshold": 30, "refine": False, "output": "rgba", "quality": None,
+              "auto_trim": True, "trim_padding": 0, "mask_vector": None}
+    url, offset = asyncio.run(task_queue.handlers["remove-background"](task_id, {"image": png(image), "mask": png(mask)}, params))
+    assert offset["x"] == 20 and offset["y"] == 10
+    result = decode(open(result_store.path(url[len("/api/static/"):]), "rb").read())
+    assert result.shape == (20, 30, 4) and (result[:, :, 3] == 255).all()
+
+
+def test_vector_mask(client, image_and_mask):
+    image, mask = image_and_mask
+    # Same rectangle as the PNG mask, as row-major runs (background first)
+    runs = [10 * 60 + 20] + [30, 30] * 19 + [30, 10 + 10 * 60]
+    vector_mask = {"width": 60, "height": 40, "rle": runs}
+    response = client.post("/api/remove-background", data={"mask_vector": json.dumps(vector_mask)},
+                           files={"image": ("image.png", png(image), "image/png")})
+    assert response.status_code == 200
+    np.testing.assert_array_equal(decode(response.content)[:, :, 3], mask)
+
+    strokes = {"width": 30, "height": 20, "strokes": [{"points": [[10, 10], [20, 10]], "width": 4}]}
+    response = client.post("/api/remove-background", data={"mask_vector": json.dumps(strokes)},
+                           files={"image": ("image.png", png(image), "image/png")})
+    assert response.status_code == 200
+    alpha = decode(response.content)[:, :, 3]
+    # Strokes are scaled to the 60x40 image: the line runs from (20, 20) to (40, 20), 8 px wide
+    assert alpha[20, 30] == 255 and alpha[5, 5] == 0 and alpha[35, 55] == 0
+
+
+def test_malformed_vector_mask_is_400(client, image_and_mask):
+    image, _ = image_and_mask
+    for vector_mask in ({"width": 60, "height": 40, "rle": [1, 2]}, {"width": 60, "height": 40, "strokes": [{"points": [[1]], "width": 2}]}):
+        response = client.post("/api/remove-background", data={"mask_vector": json.dumps(vector_mask)},
+                               files={"image": ("image.png", png(image), "image/png")})
+        assert response.status_code == 400
@@ -0,0 +1,45 @@
+import os
+import time
+import uuid
+
+import pytest
+
+from backend.services import retention
+from backend.services.result_store import result_store, result_key
+
+pytestmark = pytest.mark.usefixtures("queue_db")
+
+
+def write_result(kind: str, size: int, age: float) -> str:
+    key = result_key(kind, str(uuid.uuid4()))
+    result_store.save(key, b"\0" * size)
+    stamp = time.time() - age
+    os.utime(result_store.path(key), (stamp, stamp))
+    return key
+
+
+@pytest.fixture
+def sweeper(monkeypatch):
+    monkeypatch.setattr(retention, "RESULT_TTLS", "upscale=100,halftone=1000")
+    for key, *_ in result_store.scan():
+        result_store.delete([key])
+    return retention.ResultSweeper()
+
+
+def test_sweep_deletes_results_past_their_kind_ttl(sweeper):
+    expired = write_result("upscale", 10, age=200)
+    kept = [write_result("upscale", 10, age=50), write_result("halftone", 10, age=200)]
+    stats = sweeper.sweep()
+    assert stats["expired_files"] == 1 and stats["reclaimed_bytes"] == 10
+    assert not os.path.exists(result_store.path(expired))
+    assert sorted(item[0] for item in result_store.scan()) == sorted(kept)
+
+
+def test_sweep_evicts_least_recently_used_over_the_cap(sweeper):
+    sweeper.max_bytes = 250
+    oldest, older, newest = (write_result("halftone", 100, age) for age in (30, 20, 10))
+    stats = sweeper.sweep()
+    # 300 bytes > 250: evict down to the low watermark (225), oldest access first
+    assert stats["evicted_files"] == 1
+    assert sorted(item[0] for item in result_store.scan()) == sorted([older, newest])
+    assert sweeper.metrics()["usage"] == {"files": 2, "bytes": 200}
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from backend.database import SessionLocal
+from backend.routers import processing as processing_router
+from backend.services import task_queue
+from backend.services.task_events import task_events
+
+pytestmark = pytest.mark.usefixtures("queue_db")
+
+
+def test_stream_subscribes_only_while_streaming():
+    db = SessionLocal()
+    try:
+        task_id = task_queue.enqueue(db, "upscale", {"image": b"image"}, {})
+    finally:
+        db.close()
+
+    async def stream():
+        response = await processing_router.stream_task_status(task_id)
+        # Client gone before the body started: nothing to leak
+        assert task_events.subscribers() == 0
+        first = await response.body_iterator.__anext__()
+        assert first.startswith("event: status") and '"PENDING"' in first
+        assert task_events.subscribers() == 1
+        await response.body_iterator.aclose()
+        assert task_events.subscribers() == 0
+
+    asyncio.run(stream())
+
+
+def test_stream_of_unknown_task_is_404():
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(processing_router.stream_task_status("missing"))
+    assert raised.value.status_code == 404
+    assert task_events.subscribers() == 0
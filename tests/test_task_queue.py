@@ -0,0 +1,181 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from backend import models
+from backend.database import SessionLocal
+from backend.services import task_queue
+
+
+pytestmark = pytest.mark.usefixtures("queue_db")
+
+
+def enqueue(image: bytes = b"image", params: dict = None, kind: str = "upscale") -> str:
+    db = SessionLocal()
+    try:
+        return task_queue.enqueue(db, kind, {"image": image}, params or {})
+    finally:
+        db.close()
+
+
+def task(task_id: str) -> models.ProcessingTask:
+    db = SessionLocal()
+    try:
+        return db.query(models.ProcessingTask).filter(models.ProcessingTask.id == task_id).one()
+    finally:
+        db.close()
+
+
+def update(task_id: str, **values):
+    db = SessionLocal()
+    try:
+        db.query(models.ProcessingTask).filter(models.ProcessingTask.id == task_id).update(values)
+        db.commit()
+    finally:
+        db.close()
+
+
+def stored_inputs() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(models.ProcessingTaskInput).count()
+    finally:
+        db.close()
+
+
+def test_enqueue_stores_inputs_and_reuses_identical_submissions():
+    task_id = enqueue(b"abc", {"factor": 2})
+    assert enqueue(b"abc", {"factor": 2}) == task_id
+    assert enqueue(b"abc", {"factor": 3}) != task_id
+    assert stored_inputs() == 2
+    assert task_queue.read_inputs(task(task_id).input_ref) == {"image": b"abc"}
+
+
+def test_claim_hands_each_due_task_to_one_worker():
+    first, second = enqueue(b"1"), enqueue(b"2")
+    claims = [task_queue.claim("w1"), task_queue.claim("w2")]
+    assert task_queue.claim("w3") is None
+    assert {claimed[0] for claimed in claims} == {first, second}
+    for (task_id, kind, params, input_ref), worker_id in zip(claims, ("w1", "w2")):
+        row = task(task_id)
+        assert (row.status, row.locked_by, row.attempts) == ("RUNNING", worker_id, 1)
+        assert kind == "upscale" and input_ref == row.input_ref
+
+
+def test_claim_skips_tasks_not_due_yet():
+    task_id = enqueue()
+    update(task_id, run_after=task_queue._now() + timedelta(minutes=5))
+    assert task_queue.claim("w1") is None
+
+
+def test_expired_lease_is_reclaimed_and_fences_the_old_worker():
+    task_id = enqueue()
+    task_queue.claim("w1")
+    assert task_queue.heartbeat(task_id, "w1")
+    update(task_id, lease_expires_at=task_queue._now() - timedelta(seconds=1))
+
+    assert task_queue.claim("w2")[0] == task_id
+    assert task(task_id).attempts == 2
+    # The first worker lost the job: it can neither renew nor finish it
+    assert not task_queue.heartbeat(task_id, "w1")
+    assert not task_queue.complete(task_id, "w1", task(task_id).input_ref, "/api/static/lost.png")
+    assert stored_inputs() == 1
+
+    assert task_queue.complete(task_id, "w2", task(task_id).input_ref, "/api/static/done.png")
+    row = task(task_id)
+    assert (row.status, row.result_url, row.locked_by) == ("COMPLETED", "/api/static/done.png", None)
+    assert stored_inputs() == 0
+
+
+def test_lost_worker_on_the_last_attempt_fails_the_task(monkeypatch):
+    monkeypatch.setattr(task_queue, "TASK_MAX_ATTEMPTS", 1)
+    task_id = enqueue()
+    task_queue.claim("w1")
+    update(task_id, lease_expires_at=task_queue._now() - timedelta(seconds=1))
+
+    assert task_queue.claim("w2") is None
+    row = task(task_id)
+    assert (row.status, row.error) == ("FAILED", "Worker lost while running the task")
+    assert stored_inputs() == 0
+
+
+def test_fail_retries_with_backoff_then_gives_up(monkeypatch):
+    monkeypatch.setattr(task_queue, "TASK_MAX_ATTEMPTS", 2)
+    task_id = enqueue()
+    input_ref = task_queue.claim("w1")[3]
+
+    assert task_queue.fail(task_id, "w1", input_ref, "boom") == "PENDING"
+    row = task(task_id)
+    assert (row.status, row.error, row.locked_by) == ("PENDING", "boom", None)
+    assert task_queue.claim("w1") is None  # Backing off
+    assert stored_inputs() == 1
+
+    update(task_id, run_after=task_queue._now())
+    assert task_queue.claim("w2")[0] == task_id
+    assert task_queue.fail(task_id, "w2", input_ref, "boom again") == "FAILED"
+    row = task(task_id)
+    assert (row.status, row.error, row.attempts) == ("FAILED", "boom again", 2)
+    assert stored_inputs() == 0
+
+
+def test_retry_delay_doubles_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(task_queue, "TASK_RETRY_BASE_DELAY", 10)
+    monkeypatch.setattr(task_queue, "TASK_RETRY_MAX_DELAY", 30)
+    assert 5 <= task_queue.retry_delay(1) <= 10
+    assert 10 <= task_queue.retry_delay(2) <= 20
+    assert 15 <= task_queue.retry_delay(5) <= 30
+
+
+def test_release_hands_the_job_back_without_counting_the_attempt():
+    task_id = enqueue()
+    task_queue.claim("w1")
+    assert not task_queue.release(task_id, "w2")
+    assert task_queue.release(task_id, "w1")
+    row = task(task_id)
+    assert (row.status, row.attempts, row.locked_by) == ("PENDING", 0, None)
+    assert not task_queue.release(task_id, "w1")
+    assert task_queue.claim("w2")[0] == task_id
+
+
+def test_worker_runs_the_handler_and_retries_failures(monkeypatch):
+    calls = []
+
+    async def run(task_id, inputs, params):
+        calls.append(inputs["image"])
+        if params.get("fail"):
+            raise RuntimeError("handler failed")
+        return f"/api/static/results/{task_id}.png", {"x": 1}
+
+    monkeypatch.setitem(task_queue.handlers, "test", run)
+    worker = task_queue.TaskWorker(concurrency=1)
+    done, failing = enqueue(b"ok", kind="test"), enqueue(b"bad", {"fail": True}, kind="test")
+
+    async def run_claims():
+        for _ in range(2):
+            await worker._run("w1", *task_queue.claim("w1"))
+
+    asyncio.run(run_claims())
+    assert sorted(calls) == [b"bad", b"ok"]
+    row = task(done)
+    assert (row.status, row.result_url, row.result_meta) == ("COMPLETED", f"/api/static/results/{done}.png", {"x": 1})
+    row = task(failing)
+    assert (row.status, row.error, row.attempts) == ("PENDING", "handler failed", 1)
+    assert worker.metrics()["completed"] == 1 and worker.metrics()["retried"] == 1
+
+
+def test_missing_input_fails_the_attempt(monkeypatch):
+    async def run(task_id, inputs, params):
+        raise AssertionError("ran without inputs")
+
+    monkeypatch.setitem(task_queue.handlers, "test", run)
+    task_id = enqueue(kind="test")
+    db = SessionLocal()
+    try:
+        db.query(models.ProcessingTaskInput).delete()
+        db.commit()
+    finally:
+        db.close()
+    worker = task_queue.TaskWorker(concurrency=1)
+    asyncio.run(worker._run("w1", *task_queue.claim("w1")))
+    assert task(task_id).error.startswith("Input unavailable")